@@ -0,0 +1,83 @@
+"""
+ChatApp Archive - keeps admin_messages small
+A background job moves read messages older than MESSAGE_ARCHIVE_AFTER_DAYS into
+admin_messages_archive (monthly partitions on PostgreSQL) and, when MESSAGE_RETENTION_DAYS
+is set, deletes archived messages past retention. History pages that run past the hot
+table are served from the archive by get_messages.
+"""
+
+import os
+import threading
+import time
+from datetime import datetime, timezone, timedelta
+from typing import Dict, Any
+
+MESSAGE_ARCHIVE_AFTER_DAYS = int(os.getenv('MESSAGE_ARCHIVE_AFTER_DAYS', '0'))  # 0 disables archiving
+MESSAGE_RETENTION_DAYS = int(os.getenv('MESSAGE_RETENTION_DAYS', '0'))  # Delete archived messages after this many days (0 = keep)
+MESSAGE_ARCHIVE_INTERVAL = float(os.getenv('MESSAGE_ARCHIVE_INTERVAL', '3600'))  # Seconds between archive runs
+MESSAGE_ARCHIVE_BATCH = 1000  # Rows moved per transaction, so writers are never blocked for long
+
+
+def cutoff_timestamp(days: int) -> str:
+    return (datetime.now(timezone.utc) - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class MessageArchiver:
+    """Periodic hot -> archive move plus retention purge"""
+
+    def __init__(self, db, archive_after_days: int = MESSAGE_ARCHIVE_AFTER_DAYS,
+                 retention_days: int = MESSAGE_RETENTION_DAYS, interval: float = MESSAGE_ARCHIVE_INTERVAL):
+        self.db = db
+        self.archive_after_days = archive_after_days
+        self.retention_days = retention_days
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._pid = None
+        self._stats = {'runs': 0, 'archived': 0, 'purged': 0, 'errors': 0, 'last_run': None}
+
+    @property
+    def enabled(self) -> bool:
+        return self.archive_after_days > 0
+
+    def run_once(self) -> Dict[str, int]:
+        """Archive everything past the cutoff (in batches), then apply retention"""
+        archived = 0
+        while True:
+            moved = self.db.archive_messages(cutoff_timestamp(self.archive_after_days), MESSAGE_ARCHIVE_BATCH)
+            archived += moved
+            if moved < MESSAGE_ARCHIVE_BATCH:
+                break
+        purged = self.db.purge_archive(cutoff_timestamp(self.retention_days)) if self.retention_days > 0 else 0
+        with self._lock:
+            self._stats['runs'] += 1
+            self._stats['archived'] += archived
+            self._stats['purged'] += purged
+            self._stats['last_run'] = datetime.now(timezone.utc).isoformat()
+        if archived or purged:
+            print(f"🗄️  [Archive] Moved {archived} messages to the archive, purged {purged}")
+        return {'archived': archived, 'purged': purged}
+
+    def _run(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                with self._lock:
+                    self._stats['errors'] += 1
+                print(f"❌ [Archive] Run failed: {e}")
+            time.sleep(self.interval)
+
+    def start(self):
+        """Start the background job once per process (no-op when archiving is disabled)"""
+        if not self.enabled or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, name='message-archiver', daemon=True).start()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats, enabled=self.enabled, archive_after_days=self.archive_after_days,
+                        retention_days=self.retention_days)
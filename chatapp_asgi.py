@@ -0,0 +1,408 @@
+"""
+ChatApp ASGI - async serving mode for chatapp_simple
+    gunicorn chatapp_asgi:app -k uvicorn_worker.UvicornWorker -w 4   (see DEPLOYMENT.md)
+
+The requests that mostly sit idle - /api/sync and /api/messages long polls (?wait=) and the
+call signal stream - are served here as coroutines parked on the change notifier, so a worker
+process holds thousands of them without a thread each. Their database work goes through
+ChatAppDatabase.run_async. Every other route runs the unchanged Flask app on a thread pool
+(WSGI_THREADS per process), so uploads, downloads and admin pages behave exactly as under gthread.
+"""
+
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+import jwt
+from werkzeug.exceptions import ClientDisconnected
+from werkzeug.http import parse_etags
+from werkzeug.wsgi import FileWrapper
+
+import chatapp_simple as chat
+from chatapp_database import query_stats
+from chatapp_notify import conversation_keys
+
+WSGI_THREADS = int(os.getenv('WSGI_THREADS', '32'))  # Threads running Flask routes per process
+ASGI_FILE_CHUNK = 256 * 1024  # Bytes per send() when a Flask route returns a file
+
+
+class ChatAppASGI:
+    """ASGI application: native long-poll / SSE handlers, everything else via the WSGI app"""
+
+    def __init__(self, wsgi_app, threads: int = WSGI_THREADS):
+        self.wsgi_app = wsgi_app
+        self.threads = threads
+        self._pid = None
+        self._executor = None
+        self.routes = {
+            ('POST', '/api/sync'): self.sync,
+            ('GET', '/api/messages'): self.messages,
+            ('GET', '/api/call/signals/stream'): self.signal_stream,
+        }
+
+    def executor(self) -> ThreadPoolExecutor:
+        """The WSGI thread pool for this process (each worker starts its own)"""
+        if self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='wsgi')
+            self._pid = os.getpid()
+        return self._executor
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            handler = self.routes.get((scope['method'], scope['path']))
+            if handler is None or not await self.timed(handler, scope, receive, send):
+                await self.call_wsgi(scope, receive, send)  # Flask records its own metrics
+
+    async def timed(self, handler, scope, receive, send) -> bool:
+        """Run a native handler, recording it in chat.request_metrics like the Flask hooks do"""
+        start = time.perf_counter()
+        queries = query_stats.track_request()  # run_async copies this context into the DB threads
+        response = {'status': 499, 'size': 0}  # 499: client went away before a response
+
+        async def timed_send(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+            else:
+                response['size'] += len(message.get('body', b''))
+            await send(message)
+
+        chat.request_metrics.started()
+        try:
+            handled = await handler(scope, receive, timed_send)
+        finally:
+            chat.request_metrics.finished()
+        if handled:
+            chat.request_metrics.observe(scope['method'], scope['path'], response['status'],
+                                         time.perf_counter() - start, response['size'], queries[0], queries[1] / 1000)
+        return handled
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # chatapp_simple did its startup work on import
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                chat.db.close_pool()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    # ============= Native Handlers =============
+    # Each returns False to hand the request to Flask instead
+
+    async def sync(self, scope, receive, send):
+        """POST /api/sync (same body and response as the Flask route; see chatapp_simple.sync)"""
+        user, error = await authenticate(scope)
+        if error:
+            await send_json(send, scope, 401, {'error': error})
+            return True
+        body = await read_body(receive)
+        try:
+            data = json.loads(body) if body else {}
+        except ValueError:
+            data = {}
+        try:
+            args, wait, keys = chat.sync_arguments(data or {}, user['user_id'], user.get('role') == 'administrator')
+        except ValueError as e:
+            await send_json(send, scope, 400, {'error': str(e)})
+            return True
+
+        async def respond():
+            try:
+                result = await long_poll(keys, wait, lambda: chat.collect_sync(**args))
+                await send_json(send, scope, 200, result)
+            except Exception as e:
+                await send_json(send, scope, 500, {'error': str(e)})
+
+        await until_disconnected(respond(), receive)
+        return True
+
+    async def messages(self, scope, receive, send):
+        """GET /api/messages?wait=N (without wait, the Flask route answers)"""
+        args = dict(parse_qsl(scope['query_string'].decode('latin-1')))
+        try:
+            paging = chat.message_query_args(args)
+            wait = chat.wait_seconds(args.get('wait'))
+        except ValueError:
+            await send_json(send, scope, 400, {'error': 'since_id, before_id, limit and wait must be numbers'})
+            return True
+        if not wait:
+            return False
+        user, error = await authenticate(scope)
+        if error:
+            await send_json(send, scope, 401, {'error': error})
+            return True
+        user_id = user['user_id']
+        if_none_match = parse_etags(header(scope, 'if-none-match'))
+        check = chat.messages_poll_check(user_id, paging, if_none_match)
+
+        async def respond():
+            try:
+                stamp, messages = await long_poll(conversation_keys(user_id)[:1], wait, check)
+                etag = chat.stamp_etag(stamp)
+                headers = [(b'etag', f'"{etag}"'.encode()), (b'cache-control', b'private, no-cache')]
+                if if_none_match.contains(etag):
+                    await send_response(send, scope, 304, b'', headers)
+                    return
+                if messages is None:
+                    messages = await chat.db.run_async(chat.db.get_messages, user_id, **paging)
+                await send_json(send, scope, 200, messages, headers)
+            except Exception as e:
+                await send_json(send, scope, 500, {'error': str(e)})
+
+        await until_disconnected(respond(), receive)
+        return True
+
+    async def signal_stream(self, scope, receive, send):
+        """GET /api/call/signals/stream - Server-Sent Events, woken by the signals:<user_id> key"""
+        args = dict(parse_qsl(scope['query_string'].decode('latin-1')))
+        ticket = args.get('ticket')  # From /api/call/signals/ticket - EventSource cannot send headers
+        user, error = await authenticate(scope, ticket, chat.SIGNAL_STREAM_PURPOSE if ticket else None)
+        if error:
+            await send_json(send, scope, 401, {'error': error})
+            return True
+        user_id = user['user_id']
+        keys = (f'signals:{user_id}',)
+
+        async def stream():
+            await send({'type': 'http.response.start', 'status': 200, 'headers': cors_headers(scope, [
+                (b'content-type', b'text/event-stream; charset=utf-8'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ])})
+            await send_chunk(send, 'retry: 1000\n\n')
+            deadline = time.monotonic() + chat.SIGNAL_STREAM_MAX_AGE
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                since = chat.notifier.snapshot(keys)
+                signals = await chat.db.run_async(chat.signal_store.drain, user_id)
+                if signals:
+                    await send_chunk(send, f"data: {json.dumps(signals)}\n\n")
+                elif not await chat.notifier.wait_async(keys, since, min(chat.SIGNAL_STREAM_KEEPALIVE, remaining)):
+                    await send_chunk(send, ': keep-alive\n\n')
+            await send({'type': 'http.response.body', 'body': b''})
+
+        await until_disconnected(stream(), receive)
+        return True
+
+    # ============= WSGI Bridge =============
+
+    async def call_wsgi(self, scope, receive, send):
+        """Run the Flask app for this request on the thread pool and stream its response.
+        The request body is not buffered here: Flask reads it from receive() as it parses it, so an
+        upload goes straight into the hashing spool (and MAX_CONTENT_LENGTH is Flask's 413)."""
+        loop = asyncio.get_running_loop()
+        executor = self.executor()
+        body = ASGIInputStream(receive, loop)
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+            return lambda data: None  # Flask never uses the legacy write() callable
+
+        def begin():
+            result = self.wsgi_app(wsgi_environ(scope, body), start_response)
+            iterator = iter(result)
+            return result, iterator, next(iterator, None)  # start_response has run by the first chunk
+
+        result, iterator, chunk = await loop.run_in_executor(executor, begin)
+        try:
+            await send({'type': 'http.response.start', 'status': response['status'], 'headers': response['headers']})
+            if isinstance(result, (list, tuple)):
+                # Ordinary responses: the body is already in memory
+                await send({'type': 'http.response.body', 'body': b''.join(result)})
+                return
+            while chunk is not None:
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                chunk = await loop.run_in_executor(executor, next, iterator, None)
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(result, 'close'):
+                await loop.run_in_executor(executor, result.close)
+
+
+class ASGIInputStream:
+    """wsgi.input for a WSGI thread: each read pulls http.request messages from receive() on the
+    event loop (blocking that thread, not the loop) until it has the bytes asked for"""
+
+    def __init__(self, receive, loop):
+        self.receive = receive
+        self.loop = loop
+        self.buffer = bytearray()
+        self.more_body = True
+
+    def _fill(self, size: int):
+        """Receive until the buffer holds size bytes (size < 0: the whole body) or the body ends"""
+        while self.more_body and (size < 0 or len(self.buffer) < size):
+            message = asyncio.run_coroutine_threadsafe(self.receive(), self.loop).result()
+            if message['type'] == 'http.disconnect':
+                self.more_body = False
+                raise ClientDisconnected()
+            self.buffer += message.get('body', b'')
+            self.more_body = message.get('more_body', False)
+
+    def _take(self, size: int) -> bytes:
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def read(self, size: int = -1) -> bytes:
+        size = -1 if size is None else size
+        self._fill(size)
+        return self._take(len(self.buffer) if size < 0 else size)
+
+    def readline(self, size: int = -1) -> bytes:
+        size = -1 if size is None else size
+        while b'\n' not in self.buffer and self.more_body and (size < 0 or len(self.buffer) < size):
+            self._fill(len(self.buffer) + 1)
+        end = self.buffer.find(b'\n') + 1 or len(self.buffer)
+        return self._take(end if size < 0 else min(end, size))
+
+    def readlines(self, hint: int = -1) -> list:
+        return list(iter(self.readline, b''))
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+
+# ============= Helpers =============
+
+def header(scope, name: str) -> str:
+    """Request header (comma-joined when repeated), '' if absent"""
+    key = name.encode('latin-1')
+    return ', '.join(value.decode('latin-1') for field, value in scope['headers'] if field == key)
+
+
+async def authenticate(scope, token: str = None, purpose: str = None):
+    """Bearer token (or a ticket for `purpose`) -> (JWT claims, None) or (None, error) - the checks
+    require_auth makes. Cache misses look the account up, so they run on the database pool."""
+    token = token or header(scope, 'authorization')
+    if token.startswith('Bearer '):
+        token = token[7:]
+    if not token:
+        return None, 'No token provided'
+    try:
+        claims = chat.token_cache.lookup(token, purpose)
+        if claims is None:
+            claims = await chat.db.run_async(chat.token_cache.verify, token, purpose)
+        return claims, None
+    except jwt.ExpiredSignatureError:
+        return None, 'Token expired'
+    except jwt.InvalidTokenError:
+        return None, 'Invalid token'
+
+
+async def long_poll(keys, wait, check):
+    """chatapp_simple.long_poll as a coroutine: check() runs on the database pool, waits park no thread"""
+    deadline = time.monotonic() + wait
+    while True:
+        since = chat.notifier.snapshot(keys)
+        ready, result = await chat.db.run_async(check)
+        remaining = deadline - time.monotonic()
+        if ready or remaining <= 0:
+            return result
+        await chat.notifier.wait_async(keys, since, min(chat.LONG_POLL_RECHECK, remaining))
+
+
+async def read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body', False):
+            return b''.join(chunks)
+
+
+async def until_disconnected(coroutine, receive):
+    """Run coroutine, cancelling it if the client goes away first (an aborted long poll frees at once)"""
+    async def disconnected():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    task = asyncio.ensure_future(coroutine)
+    watcher = asyncio.ensure_future(disconnected())
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for pending in (task, watcher):
+            pending.cancel()
+    if task.done() and not task.cancelled() and task.exception() is not None:
+        raise task.exception()
+
+
+def cors_headers(scope, headers):
+    """What flask_cors adds for CORS(app) defaults"""
+    if header(scope, 'origin'):
+        headers.append((b'access-control-allow-origin', b'*'))
+    return headers
+
+
+async def send_response(send, scope, status: int, body: bytes, headers=()):
+    headers = list(headers)
+    if status != 304:
+        headers.append((b'content-length', str(len(body)).encode()))
+    headers = cors_headers(scope, headers)
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_json(send, scope, status: int, payload, headers=()):
+    body = (chat.app.json.dumps(payload, separators=(',', ':')) + '\n').encode('utf-8')
+    await send_response(send, scope, status, body, [(b'content-type', b'application/json')] + list(headers))
+
+
+async def send_chunk(send, text: str):
+    await send({'type': 'http.response.body', 'body': text.encode('utf-8'), 'more_body': True})
+
+
+def wsgi_environ(scope, body) -> dict:
+    """PEP 3333 environ for an ASGI HTTP scope"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+        # send_file asks for 8KB reads; larger ones mean fewer trips through the thread pool
+        'wsgi.file_wrapper': lambda file, buffer_size=8192: FileWrapper(file, ASGI_FILE_CHUNK),
+    }
+    for field, value in scope['headers']:
+        name = field.decode('latin-1').upper().replace('-', '_')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value.decode('latin-1')
+            continue
+        if name == 'CONTENT_LENGTH':
+            environ['CONTENT_LENGTH'] = value.decode('latin-1')
+            continue
+        key = f'HTTP_{name}'
+        value = value.decode('latin-1')
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    if 'CONTENT_LENGTH' not in environ:
+        environ['wsgi.input_terminated'] = True  # Chunked body: read until the stream ends
+    return environ
+
+
+app = ChatAppASGI(chat.app)
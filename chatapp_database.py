@@ -4,8 +4,17 @@ Supports: User authentication, messaging between Ken Tse and users, file attachm
 """
 
 import os
-import bcrypt
+import re
+import html
+import asyncio
+import contextvars
+import functools
 import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from datetime import datetime, timezone, timedelta
 from typing import Dict, List, Optional, Any
 
@@ -13,6 +22,12 @@ from typing import Dict, List, Optional, Any
 import sqlite3
 from pathlib import Path
 
+from chatapp_logging import get_logger
+from chatapp_passwords import PasswordHasher
+from chatapp_writer import WriteQueue
+
+log = get_logger('database')
+
 # Try PostgreSQL first (for Railway), fallback to SQLite
 USE_POSTGRES = False
 POSTGRES_ERROR = None
@@ -34,6 +49,229 @@ except ImportError as e:
     POSTGRES_ERROR = f"psycopg2 import failed: {e}"
     USE_POSTGRES = False
 
+# Connection pool configuration
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '10'))  # Max open PostgreSQL connections per process
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))  # Seconds to wait for a free connection
+DB_POOL_HEALTH_CHECK_INTERVAL = float(os.getenv('DB_POOL_HEALTH_CHECK_INTERVAL', '30'))  # Re-check idle connections older than this
+DB_ASYNC_THREADS = int(os.getenv('DB_ASYNC_THREADS', str(DB_POOL_MAX_SIZE)))  # Threads running queries for the ASGI app (run_async)
+DB_EXPLAIN_ON_STARTUP = os.getenv('DB_EXPLAIN_ON_STARTUP', 'false').lower() == 'true'  # Print hot-query plans at startup
+# SQLite tuning (ignored on PostgreSQL)
+SQLITE_JOURNAL_MODE = os.getenv('SQLITE_JOURNAL_MODE', 'WAL')  # WAL: readers never block the writer
+SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')  # NORMAL is durable in WAL except on power loss
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))  # Wait this long for a lock instead of 'database is locked'
+SQLITE_CACHE_SIZE_KB = int(os.getenv('SQLITE_CACHE_SIZE_KB', '20000'))  # Page cache per connection
+SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))  # Bytes of the file read via mmap
+SQLITE_WRITER = os.getenv('SQLITE_WRITER', 'true').lower() == 'true'  # Route hot writes through one writer thread
+WRITE_BATCHING = os.getenv('WRITE_BATCHING', 'false').lower() == 'true'  # Group-commit messages / read receipts (both backends)
+WRITE_BATCH_WINDOW_MS = float(os.getenv('WRITE_BATCH_WINDOW_MS', '5'))  # How long the writer waits to fill a batch
+WRITE_BATCH_MAX = int(os.getenv('WRITE_BATCH_MAX', '200'))  # Jobs per transaction
+DB_QUERY_STATS = os.getenv('DB_QUERY_STATS', 'true').lower() == 'true'  # Per-statement timing (/api/admin/db-stats/queries, /metrics)
+QUERY_STATS_SAMPLES = 500  # Recent durations kept per statement for p99
+SQL_CACHE_SIZE = 1024  # Distinct statement texts remembered by the translation cache
+SEARCH_HIGHLIGHT = ('\x02', '\x03')  # Sentinels around matches; replaced with <mark> after HTML-escaping
+ONLINE_WINDOW_SECONDS = float(os.getenv('PRESENCE_ONLINE_WINDOW', '15'))  # Admin list fallback when no presence set is passed
+
+# Columns used by the call history methods but missing from the original call_history CREATE TABLE
+# (SQLite can't ADD COLUMN with a CURRENT_TIMESTAMP default, so log_call_attempt sets call_time itself)
+CALL_HISTORY_COLUMNS = [
+    ('call_status', 'TEXT'),
+    ('call_time', 'DATETIME'),
+    ('call_duration', 'INTEGER'),
+    ('answered_at', 'DATETIME'),
+    ('ended_at', 'DATETIME'),
+    ('seen_by_callee', 'INTEGER DEFAULT 0'),
+]
+
+# Columns added to conversation_summary after it first shipped
+CONVERSATION_SUMMARY_COLUMNS = [
+    ('version', 'INTEGER DEFAULT 0'),  # Bumped on every change to the conversation (ETag stamps)
+]
+
+# Newest message id of the conversation in admin_messages_archive (NULL = nothing archived);
+# history pages newer than it never read the archive
+SUMMARY_ARCHIVE_COLUMNS = [
+    ('archived_max_id', 'INTEGER'),
+]
+
+# Thumbnail / poster frame of an upload blob (see chatapp_previews.PreviewGenerator)
+UPLOAD_PREVIEW_COLUMNS = [
+    ('preview', 'TEXT'),  # Preview filename in the upload folder
+    ('preview_state', 'TEXT'),  # NULL = not tried yet, then 'working', 'ready', 'none' or 'failed'
+]
+
+# Columns the old add_*_column.py scripts added by hand to databases created before them
+LEGACY_COLUMNS = {
+    'users': [
+        ('user_role', "TEXT DEFAULT 'guest'"),
+        ('email_verified', 'INTEGER DEFAULT 0'),
+        ('verification_code', 'TEXT'),
+        ('verification_expires', 'DATETIME'),
+        ('is_deleted', 'INTEGER DEFAULT 0'),
+    ],
+    'admin_messages': [
+        ('file_url', 'TEXT'),
+        ('file_name', 'TEXT'),
+        ('file_size', 'INTEGER'),
+        ('reply_to', 'INTEGER'),
+    ],
+}
+
+# Secondary indexes for the polling access paths: (name, table, columns, partial-index WHERE)
+INDEXES = [
+    # get_messages: WHERE user_id = ? ORDER BY timestamp DESC; MAX(timestamp) per user in the admin list
+    ('idx_admin_messages_user_timestamp', 'admin_messages', ['user_id', 'timestamp'], None),
+    # get_messages keyset paging: WHERE user_id = ? AND id > / < ? ORDER BY id
+    ('idx_admin_messages_user_id', 'admin_messages', ['user_id', 'id'], None),
+    # get_unread_count / mark_*_read / admin unread counts - only unread rows are indexed
+    ('idx_admin_messages_unread', 'admin_messages', ['user_id', 'sender_type'], 'is_read = 0'),
+    # get_missed_calls: WHERE callee_id = ? AND call_status = 'missed' ORDER BY call_time DESC
+    ('idx_call_history_callee_status', 'call_history', ['callee_id', 'call_status', 'call_time'], None),
+    # get_call_history_for_user: both directions between two users
+    ('idx_call_history_pair', 'call_history', ['caller_id', 'callee_id', 'call_time'], None),
+    # Presence: users seen since a cutoff (shared online set across workers)
+    ('idx_user_status_last_seen', 'user_status', ['last_seen'], None),
+]
+
+# Queries run on every client poll, checked by explain_hot_queries(): (name, sql, sample params)
+HOT_QUERIES = [
+    ('get_messages', '''
+        SELECT id, user_id, sender_type, message, file_url, file_name, file_size, timestamp, is_read
+        FROM admin_messages WHERE user_id = ? ORDER BY id DESC LIMIT ?
+    ''', (1, 100)),
+    ('get_messages_since', '''
+        SELECT id, user_id, sender_type, message, file_url, file_name, file_size, timestamp, is_read
+        FROM admin_messages WHERE user_id = ? AND id > ? ORDER BY id ASC LIMIT ?
+    ''', (1, 0, 100)),
+    ('get_unread_count', '''
+        SELECT COUNT(*) FROM admin_messages WHERE user_id = ? AND sender_type = ? AND is_read = 0
+    ''', (1, 'admin')),
+    ('mark_messages_read', '''
+        UPDATE admin_messages SET is_read = 1
+        WHERE user_id = ? AND sender_type = 'admin' AND is_read = 0
+    ''', (1,)),
+    ('admin_list_last_message', '''
+        SELECT MAX(timestamp) FROM admin_messages WHERE user_id = ?
+    ''', (1,)),
+    ('get_missed_calls', '''
+        SELECT ch.id, ch.caller_id, u.username, ch.call_time, ch.seen_by_callee
+        FROM call_history ch JOIN users u ON ch.caller_id = u.id
+        WHERE ch.callee_id = ? AND ch.call_status = 'missed'
+        ORDER BY ch.call_time DESC LIMIT 50
+    ''', (1,)),
+    ('get_user_status', '''
+        SELECT status, last_seen, current_call_with FROM user_status WHERE user_id = ?
+    ''', (1,)),
+]
+
+# Ordered schema changes: (version, description, ChatAppDatabase method, online)
+# Each method takes a cursor. Regular migrations run in one transaction together with their
+# schema_version row; online ones run outside a transaction so PostgreSQL can build indexes
+# CONCURRENTLY without blocking writes. Never edit or reorder a shipped entry - append a new one.
+MIGRATIONS = [
+    (1, 'base tables', '_create_base_tables', False),
+    (2, 'legacy user and attachment columns', '_add_legacy_columns', False),
+    (3, 'call_history call tracking columns', '_add_call_history_columns', False),
+    (4, 'conversation_summary version column', '_add_summary_version_column', False),
+    (5, 'polling indexes', '_create_polling_indexes', True),
+    (6, 'message full-text search', '_create_search_index', False),
+    (7, 'message full-text search GIN index', '_create_search_gin_index', True),
+    (8, 'message archive table', '_create_archive_table', False),
+    (9, 'conversation summary backfill', '_backfill_conversation_summary', False),
+    (10, 'content-addressed upload blobs', '_create_upload_blobs_table', False),
+    (11, 'chunked upload sessions', '_create_upload_sessions_tables', False),
+    (12, 'upload preview columns', '_add_upload_preview_columns', False),
+    (13, 'archived message full-text search', '_create_archive_search_index', False),
+    (14, 'conversation summary archived_max_id', '_add_summary_archive_column', False),
+]
+SCHEMA_MIGRATION_LOCK = 72160016  # pg_advisory_lock key: one migrating worker at a time
+
+# ============= Statement Translation & Stats =============
+
+@lru_cache(maxsize=SQL_CACHE_SIZE)
+def statement_key(sql: str) -> str:
+    """Source text with whitespace collapsed - identifies a statement in the stats table"""
+    return ' '.join(sql.split())
+
+@lru_cache(maxsize=SQL_CACHE_SIZE)
+def translate_for_postgres(sql: str) -> tuple:
+    """Translate a SQLite-style statement once: returns (pg_sql, returns_id, stats key)"""
+    upper = sql.upper()
+    pg_sql = sql.replace('?', '%s')
+    
+    # Add RETURNING id for INSERT statements (but NOT for UPSERT with ON CONFLICT)
+    # UPSERT queries don't always return id and may not have an id column
+    returns_id = upper.lstrip().startswith('INSERT') and 'ON CONFLICT' not in upper
+    if returns_id and 'RETURNING' not in upper:
+        pg_sql = pg_sql.rstrip().rstrip(';') + ' RETURNING id'
+    return pg_sql, returns_id, statement_key(sql)
+
+# [statements, ms] of the request being handled (set by track_request; copied into run_async calls)
+_request_queries = contextvars.ContextVar('request_queries', default=None)
+
+class QueryStats:
+    """Per-statement call count, time and rows for this process"""
+    
+    def __init__(self, samples: int = QUERY_STATS_SAMPLES):
+        self.samples = samples
+        self._lock = threading.Lock()
+        self._statements = {}  # key -> [calls, total_ms, max_ms, rows, recent durations]
+    
+    @staticmethod
+    def track_request() -> list:
+        """Count statements from here on (this request); returns the [statements, ms] being added to"""
+        totals = [0, 0.0]
+        _request_queries.set(totals)
+        return totals
+    
+    def record(self, key: str, elapsed_ms: float, rows: int):
+        totals = _request_queries.get()
+        if totals is not None:
+            totals[0] += 1
+            totals[1] += elapsed_ms
+        with self._lock:
+            entry = self._statements.get(key)
+            if entry is None:
+                entry = self._statements[key] = [0, 0.0, 0.0, 0, deque(maxlen=self.samples)]
+            entry[0] += 1
+            entry[1] += elapsed_ms
+            entry[2] = max(entry[2], elapsed_ms)
+            entry[3] += max(rows, 0)
+            entry[4].append(elapsed_ms)
+    
+    def add_fetch(self, key: str, elapsed_ms: float, rows: int):
+        """Rows (and time) for SELECTs whose rows are produced while fetching (SQLite)"""
+        totals = _request_queries.get()
+        if totals is not None:
+            totals[1] += elapsed_ms
+        with self._lock:
+            entry = self._statements.get(key)
+            if entry is not None:
+                entry[1] += elapsed_ms
+                entry[3] += rows
+    
+    def snapshot(self, sort: str = 'total_ms', limit: int = 50) -> List[Dict[str, Any]]:
+        with self._lock:
+            items = [(key, entry[:4], sorted(entry[4])) for key, entry in self._statements.items()]
+        rows = []
+        for key, (calls, total_ms, max_ms, row_count), recent in items:
+            rows.append({
+                'statement': key,
+                'calls': calls,
+                'total_ms': round(total_ms, 2),
+                'mean_ms': round(total_ms / calls, 3),
+                'p99_ms': round(recent[min(int(len(recent) * 0.99), len(recent) - 1)], 3),
+                'max_ms': round(max_ms, 3),
+                'rows': row_count
+            })
+        rows.sort(key=lambda r: r.get(sort, 0), reverse=True)
+        return rows[:limit]
+    
+    def reset(self):
+        with self._lock:
+            self._statements.clear()
+
+query_stats = QueryStats()
+
 # Wrapper classes to unify SQLite and PostgreSQL interfaces
 class PostgreSQLCursorWrapper:
     """Wrapper to convert ? to %s for PostgreSQL"""
@@ -42,21 +280,17 @@ class PostgreSQLCursorWrapper:
         self.lastrowid = None
     
     def execute(self, sql, params=None):
-        """Execute with parameter conversion"""
-        pg_sql = sql.replace('?', '%s')
-        
-        # Add RETURNING id for INSERT statements (but NOT for UPSERT with ON CONFLICT)
-        # UPSERT queries don't always return id and may not have an id column
-        if (sql.strip().upper().startswith('INSERT') and 
-            'RETURNING' not in sql.upper() and 
-            'ON CONFLICT' not in sql.upper()):
-            pg_sql = pg_sql.rstrip().rstrip(';') + ' RETURNING id'
+        """Execute with parameter conversion (translation is memoized per statement text)"""
+        pg_sql, returns_id, key = translate_for_postgres(sql)
         
+        start = time.perf_counter()
         result = self.cursor.execute(pg_sql, params) if params else self.cursor.execute(pg_sql)
+        if DB_QUERY_STATS:
+            # psycopg2 buffers SELECT results, so rowcount is the row count for every statement type
+            query_stats.record(key, (time.perf_counter() - start) * 1000, self.cursor.rowcount)
         
         # Get lastrowid for INSERT statements (skip for UPSERT)
-        if (sql.strip().upper().startswith('INSERT') and 
-            'ON CONFLICT' not in sql.upper()):
+        if returns_id:
             try:
                 row = self.cursor.fetchone()
                 self.lastrowid = row[0] if row else None
@@ -65,6 +299,10 @@ class PostgreSQLCursorWrapper:
         
         return result
     
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+    
     def fetchone(self):
         return self.cursor.fetchone()
     
@@ -76,9 +314,11 @@ class PostgreSQLCursorWrapper:
 
 class PostgreSQLConnectionWrapper:
     """Wrapper to provide unified connection interface"""
-    def __init__(self, conn):
+    def __init__(self, conn, pool=None):
         self.conn = conn
+        self.pool = pool
         self._in_transaction = False
+        self._released = False
     
     def cursor(self):
         return PostgreSQLCursorWrapper(self.conn.cursor())
@@ -86,8 +326,368 @@ class PostgreSQLConnectionWrapper:
     def commit(self):
         return self.conn.commit()
     
+    def rollback(self):
+        return self.conn.rollback()
+    
+    def set_autocommit(self, enabled: bool):
+        """Statements outside a transaction block (CREATE INDEX CONCURRENTLY)"""
+        self.conn.autocommit = enabled
+    
     def close(self):
-        return self.conn.close()
+        """Return the connection to the pool (or really close it if unpooled)"""
+        if self._released:
+            return
+        self._released = True
+        if self.pool:
+            self.pool.release(self.conn)
+        else:
+            self.conn.close()
+
+class SQLiteCursorWrapper:
+    """Times statements for query_stats; everything else goes to the sqlite3 cursor"""
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self._key = None
+    
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+    
+    def execute(self, sql, params=()):
+        self._key = statement_key(sql)
+        start = time.perf_counter()
+        self.cursor.execute(sql, params)
+        query_stats.record(self._key, (time.perf_counter() - start) * 1000, self.cursor.rowcount)
+        return self
+    
+    def fetchone(self):
+        start = time.perf_counter()
+        row = self.cursor.fetchone()
+        query_stats.add_fetch(self._key, (time.perf_counter() - start) * 1000, 1 if row is not None else 0)
+        return row
+    
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = self.cursor.fetchall()
+        query_stats.add_fetch(self._key, (time.perf_counter() - start) * 1000, len(rows))
+        return rows
+    
+    def __iter__(self):
+        return iter(self.fetchall())
+
+class SQLiteConnectionWrapper:
+    """Wrapper around a per-thread SQLite connection - close() hands it back instead of closing"""
+    def __init__(self, conn, pool):
+        self.conn = conn
+        self.pool = pool
+        self._released = False
+    
+    def __getattr__(self, name):
+        # Everything else (commit, rollback, execute, ...) goes to the real connection
+        return getattr(self.conn, name)
+    
+    def cursor(self):
+        cursor = self.conn.cursor()
+        return SQLiteCursorWrapper(cursor) if DB_QUERY_STATS else cursor
+    
+    def close(self):
+        if self._released:
+            return
+        self._released = True
+        self.pool.release(self.conn)
+
+class PoolTimeoutError(Exception):
+    """Raised when no pooled connection becomes available within DB_POOL_TIMEOUT"""
+    pass
+
+class PostgreSQLConnectionPool:
+    """
+    Bounded, thread-safe pool of psycopg2 connections.
+    Connections are opened lazily up to max_size; callers block (up to timeout) when all are in use.
+    Safe across gunicorn forks: a child process never reuses connections inherited from its parent.
+    """
+    def __init__(self, db_url: str, max_size: int = DB_POOL_MAX_SIZE,
+                 timeout: float = DB_POOL_TIMEOUT,
+                 health_check_interval: float = DB_POOL_HEALTH_CHECK_INTERVAL):
+        self.db_url = db_url
+        self.max_size = max(1, max_size)
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._cond = threading.Condition()
+        self._reset_state()
+    
+    def _reset_state(self):
+        self._pid = os.getpid()
+        self._idle = deque()  # (connection, last_used_monotonic)
+        self._size = 0  # open connections, idle + in use
+        self._stats = {
+            'created': 0,
+            'discarded': 0,
+            'acquisitions': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'health_check_failures': 0,
+            'total_wait_ms': 0.0,
+            'max_wait_ms': 0.0,
+        }
+    
+    def _check_fork(self):
+        """Drop (without closing) connections inherited from a parent process"""
+        if self._pid != os.getpid():
+            # Closing would send a terminate message on the parent's socket, so just forget them
+            self._reset_state()
+    
+    def _is_healthy(self, conn, last_used: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT 1')
+            cur.close()
+            conn.rollback()
+            return True
+        except Exception:
+            with self._cond:
+                self._stats['health_check_failures'] += 1
+            return False
+    
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+    
+    def acquire(self):
+        """Check out a raw psycopg2 connection, opening one if the pool has room"""
+        started = time.monotonic()
+        waited = False
+        while True:
+            candidate = None
+            with self._cond:
+                self._check_fork()
+                while not self._idle and self._size >= self.max_size:
+                    remaining = self.timeout - (time.monotonic() - started)
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolTimeoutError(
+                            f"No database connection available after {self.timeout}s "
+                            f"(pool size {self.max_size})"
+                        )
+                    waited = True
+                    self._cond.wait(remaining)
+                
+                if self._idle:
+                    candidate = self._idle.pop()  # LIFO keeps the hottest connections warm
+                else:
+                    self._size += 1  # Reserve the slot, then connect outside the lock
+            
+            if candidate is None:
+                break
+            
+            # Health check runs outside the lock so a slow ping never blocks other threads
+            conn, last_used = candidate
+            if self._is_healthy(conn, last_used):
+                with self._cond:
+                    self._record_acquire(started, waited)
+                return conn
+            with self._cond:
+                self._size -= 1
+                self._stats['discarded'] += 1
+                self._cond.notify()
+            self._discard(conn)
+        
+        try:
+            conn = psycopg2.connect(self.db_url)
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        
+        with self._cond:
+            self._stats['created'] += 1
+            self._record_acquire(started, waited)
+        return conn
+    
+    def _record_acquire(self, started: float, waited: bool):
+        wait_ms = (time.monotonic() - started) * 1000
+        self._stats['acquisitions'] += 1
+        if waited:
+            self._stats['waits'] += 1
+        self._stats['total_wait_ms'] += wait_ms
+        self._stats['max_wait_ms'] = max(self._stats['max_wait_ms'], wait_ms)
+    
+    def release(self, conn):
+        """Return a connection, rolling back anything left uncommitted"""
+        healthy = not conn.closed
+        if healthy:
+            try:
+                conn.rollback()
+            except Exception:
+                healthy = False
+        
+        with self._cond:
+            if self._pid != os.getpid():
+                return  # Checked out before a fork; it belongs to the parent
+            if healthy:
+                self._idle.append((conn, time.monotonic()))
+            else:
+                self._size -= 1
+                self._stats['discarded'] += 1
+                self._discard(conn)
+            self._cond.notify()
+    
+    def close_all(self):
+        """Close idle connections (in-use ones are closed when released)"""
+        with self._cond:
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._size -= 1
+                self._discard(conn)
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            self._check_fork()
+            acquisitions = self._stats['acquisitions']
+            return {
+                'backend': 'postgresql',
+                'max_size': self.max_size,
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                **self._stats,
+                'avg_wait_ms': self._stats['total_wait_ms'] / acquisitions if acquisitions else 0.0,
+            }
+
+class SQLiteConnectionPool:
+    """
+    Per-thread reusable SQLite connections.
+    Each thread keeps one open connection; a nested checkout in the same thread gets a
+    short-lived extra connection so the outer caller's transaction is never disturbed.
+    """
+    def __init__(self, db_path: Path, health_check_interval: float = DB_POOL_HEALTH_CHECK_INTERVAL):
+        self.db_path = db_path
+        self.health_check_interval = health_check_interval
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._connections = set()  # every per-thread connection, for stats and close_all
+        self._stats = {
+            'created': 0,
+            'reused': 0,
+            'nested': 0,
+            'discarded': 0,
+            'acquisitions': 0,
+            'health_check_failures': 0,
+        }
+    
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000)
+        conn.execute(f'PRAGMA journal_mode = {SQLITE_JOURNAL_MODE}')
+        conn.execute(f'PRAGMA synchronous = {SQLITE_SYNCHRONOUS}')
+        conn.execute(f'PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}')
+        conn.execute(f'PRAGMA cache_size = -{SQLITE_CACHE_SIZE_KB}')
+        conn.execute(f'PRAGMA mmap_size = {SQLITE_MMAP_SIZE}')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        with self._lock:
+            self._stats['created'] += 1
+        return conn
+    
+    def _is_healthy(self, conn, last_used: float) -> bool:
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            with self._lock:
+                self._stats['health_check_failures'] += 1
+            return False
+    
+    def acquire(self):
+        local = self._local
+        with self._lock:
+            self._stats['acquisitions'] += 1
+            if self._pid != os.getpid():
+                # Forked child: forget the parent's connections
+                self._pid = os.getpid()
+                self._connections = set()
+                self._local = local = threading.local()
+        
+        conn = getattr(local, 'conn', None)
+        if conn is not None and getattr(local, 'pid', None) != os.getpid():
+            conn = local.conn = None
+        
+        if conn is not None and getattr(local, 'in_use', False):
+            # Nested checkout in the same thread - hand out a private connection
+            with self._lock:
+                self._stats['nested'] += 1
+            return self._connect()
+        
+        if conn is not None and not self._is_healthy(conn, local.last_used):
+            self._drop_thread_connection(local)
+            conn = None
+        
+        if conn is None:
+            conn = self._connect()
+            local.conn = conn
+            local.pid = os.getpid()
+            with self._lock:
+                self._connections.add(conn)
+        else:
+            with self._lock:
+                self._stats['reused'] += 1
+        
+        local.in_use = True
+        return conn
+    
+    def _drop_thread_connection(self, local):
+        conn = local.conn
+        local.conn = None
+        with self._lock:
+            self._connections.discard(conn)
+            self._stats['discarded'] += 1
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+    
+    def release(self, conn):
+        local = self._local
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            if getattr(local, 'conn', None) is conn:
+                self._drop_thread_connection(local)
+                local.in_use = False
+                return
+        
+        if getattr(local, 'conn', None) is conn:
+            local.in_use = False
+            local.last_used = time.monotonic()
+        else:
+            conn.close()  # Nested (or foreign-thread) connection
+    
+    def close_all(self):
+        """Close every per-thread connection (call only at shutdown)"""
+        with self._lock:
+            connections, self._connections = self._connections, set()
+            self._local = threading.local()
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'backend': 'sqlite',
+                'size': len(self._connections),
+                **self._stats,
+            }
 
 class ChatAppDatabase:
     """
@@ -105,21 +705,93 @@ class ChatAppDatabase:
                 self.db_url = self.db_url.replace('postgres://', 'postgresql://', 1)
             print(f"🐘 Using PostgreSQL database")
             print(f"   Connection: {self.db_url[:50]}...")
+            self.pool = PostgreSQLConnectionPool(self.db_url)
+            print(f"   Pool: up to {self.pool.max_size} connections per process")
         else:
             self.db_path = Path(db_path)
             print(f"💾 Using SQLite database: {self.db_path}")
             if POSTGRES_ERROR:
                 print(f"   Reason: {POSTGRES_ERROR}")
+            self.pool = SQLiteConnectionPool(self.db_path)
+        # SQLite allows one writer at a time: funnel hot writes through a single thread that group-commits.
+        # WRITE_BATCHING adds a short collection window (and enables the writer on PostgreSQL too).
+        self.writer = None
+        if WRITE_BATCHING or (SQLITE_WRITER and not self.use_postgres):
+            self.writer = WriteQueue(
+                self.get_connection,
+                begin_sql=None if self.use_postgres else 'BEGIN IMMEDIATE',
+                window_ms=WRITE_BATCH_WINDOW_MS if WRITE_BATCHING else 0,
+                max_batch=WRITE_BATCH_MAX
+            )
+        self.passwords = PasswordHasher()
+        self._async_lock = threading.Lock()
+        self._async_pid = None
+        self._async_executor = None
         self.init_database()
     
     def get_connection(self):
-        """Get database connection with unified interface"""
+        """Get a pooled database connection with unified interface (close() returns it to the pool)"""
         if self.use_postgres:
-            conn = psycopg2.connect(self.db_url)
             # Wrap connection to auto-convert ? to %s
-            return PostgreSQLConnectionWrapper(conn)
+            return PostgreSQLConnectionWrapper(self.pool.acquire(), self.pool)
         else:
-            return sqlite3.connect(self.db_path)
+            return SQLiteConnectionWrapper(self.pool.acquire(), self.pool)
+    
+    def pool_stats(self) -> Dict[str, Any]:
+        """Connection pool size and wait-time metrics for this process"""
+        stats = self.pool.stats()
+        if self.writer:
+            stats['writer'] = self.writer.stats()
+        return stats
+    
+    def _write(self, fn, *args):
+        """Run fn(cursor, *args) in its own transaction and return its result.
+        Goes through the writer thread when there is one; fn must not commit."""
+        if self.writer:
+            return self.writer.run(fn, *args)
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            if not self.use_postgres:
+                cursor.execute('BEGIN IMMEDIATE')  # Take the write lock up front (no lock-upgrade deadlocks)
+            result = fn(cursor, *args)
+            conn.commit()
+            return result
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+    
+    async def run_async(self, fn, *args, **kwargs):
+        """Await a blocking call that uses the database (usually a method of this class) from a coroutine.
+        Calls run on a per-process pool of DB_ASYNC_THREADS threads - about as many as there are
+        connections, so waiting coroutines queue here instead of holding threads or pool slots."""
+        if self._async_pid != os.getpid():
+            with self._async_lock:
+                if self._async_pid != os.getpid():
+                    self._async_executor = ThreadPoolExecutor(max_workers=DB_ASYNC_THREADS, thread_name_prefix='db-async')
+                    self._async_pid = os.getpid()
+        loop = asyncio.get_running_loop()
+        call = functools.partial(fn, *args, **kwargs)
+        return await loop.run_in_executor(self._async_executor, contextvars.copy_context().run, call)
+    
+    def query_stats(self, sort: str = 'total_ms', limit: int = 50) -> Dict[str, Any]:
+        """Per-statement timings for this process plus translation cache hit counts"""
+        cache = translate_for_postgres.cache_info() if self.use_postgres else statement_key.cache_info()
+        return {
+            'enabled': DB_QUERY_STATS,
+            'translation_cache': {'hits': cache.hits, 'misses': cache.misses, 'size': cache.currsize},
+            'statements': query_stats.snapshot(sort, limit)
+        }
+    
+    def reset_query_stats(self):
+        query_stats.reset()
+    
+    def close_pool(self):
+        """Close pooled connections (on shutdown)"""
+        self.pool.close_all()
     
     def _sql(self, sqlite_sql: str) -> str:
         """Convert SQLite SQL to PostgreSQL if needed"""
@@ -136,10 +808,122 @@ class ChatAppDatabase:
         return pg_sql
     
     def init_database(self):
-        """Initialize all database tables"""
+        """Bring the schema up to date - a single version read when it already is"""
+        self.migrate()
+        self.search_backend = self._detect_search_backend()
+        if DB_EXPLAIN_ON_STARTUP:
+            self.report_query_plans()
+    
+    # ============= Schema Migrations =============
+    
+    def schema_version(self) -> int:
+        """Highest applied migration (0 for databases that predate schema_version)"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
+        try:
+            if self.use_postgres:
+                cursor.execute("SELECT to_regclass('schema_version') IS NOT NULL")
+                exists = cursor.fetchone()[0]
+            else:
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'")
+                exists = cursor.fetchone() is not None
+            if not exists:
+                return 0
+            cursor.execute('SELECT MAX(version) FROM schema_version')
+            return cursor.fetchone()[0] or 0
+        finally:
+            conn.close()
+    
+    def pending_migrations(self) -> List[tuple]:
+        """(version, description) of migrations not applied yet"""
+        current = self.schema_version()
+        return [(version, description) for version, description, _, _ in MIGRATIONS if version > current]
+    
+    def migrate(self) -> int:
+        """Apply pending MIGRATIONS in order, returns how many ran.
+        Stops at the first failure; the rest are retried on the next start."""
+        if self.schema_version() >= MIGRATIONS[-1][0]:
+            return 0  # Current: no DDL at all
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        applied = 0
+        
+        try:
+            if self.use_postgres:
+                # Workers booting together queue here; the ones after the first find nothing left to do
+                cursor.execute('SELECT pg_advisory_lock(?)', (SCHEMA_MIGRATION_LOCK,))
+            cursor.execute(self._sql('''
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT NOT NULL,
+                    applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            '''))
+            conn.commit()
+            
+            for version, description, method, online in MIGRATIONS:
+                try:
+                    ran = self._apply_migration(conn, cursor, version, description, getattr(self, method), online)
+                except Exception as e:
+                    conn.rollback()
+                    print(f"❌ [Schema] Migration {version} ({description}) failed: {e}")
+                    break
+                if ran:
+                    applied += 1
+                    print(f"🛠️  [Schema] Applied migration {version}: {description}")
+        finally:
+            if self.use_postgres:
+                conn.rollback()
+                cursor.execute('SELECT pg_advisory_unlock(?)', (SCHEMA_MIGRATION_LOCK,))
+                conn.commit()
+            conn.close()
+        return applied
+    
+    def _apply_migration(self, conn, cursor, version: int, description: str, migration, online: bool) -> bool:
+        """Run one migration unless another worker already has; False if it was skipped"""
+        if online and self.use_postgres:
+            cursor.execute('SELECT 1 FROM schema_version WHERE version = ?', (version,))
+            if cursor.fetchone() is not None:
+                conn.commit()
+                return False
+            conn.commit()
+            conn.set_autocommit(True)
+            try:
+                migration(cursor)
+            finally:
+                conn.set_autocommit(False)
+        else:
+            if not self.use_postgres:
+                cursor.execute('BEGIN IMMEDIATE')  # Serializes racing workers; re-check inside the lock
+            cursor.execute('SELECT 1 FROM schema_version WHERE version = ?', (version,))
+            if cursor.fetchone() is not None:
+                conn.rollback()
+                return False
+            migration(cursor)
+        cursor.execute('''
+            INSERT INTO schema_version (version, description) VALUES (?, ?)
+            ON CONFLICT(version) DO NOTHING
+        ''', (version, description))
+        conn.commit()
+        return True
+    
+    def _detect_search_backend(self) -> str:
+        """'tsvector' on PostgreSQL, 'fts5' when the SQLite FTS table exists, otherwise 'like'"""
+        if self.use_postgres:
+            return 'tsvector'
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'admin_messages_fts'")
+            return 'fts5' if cursor.fetchone() is not None else 'like'
+        finally:
+            conn.close()
+    
+    def _create_base_tables(self, cursor):
+        """Migration 1: the original tables (IF NOT EXISTS, so pre-migration databases pass straight through)"""
         # Users table for authentication (matches existing schema)
         cursor.execute(self._sql('''
             CREATE TABLE IF NOT EXISTS users (
@@ -233,17 +1017,152 @@ class ChatAppDatabase:
             )
         '''))
         
-        conn.commit()
-        conn.close()
+        # Per-user conversation totals, maintained by send_message / mark_*_read / delete_message
+        # so the admin user list never has to aggregate admin_messages
+        cursor.execute(self._sql('''
+            CREATE TABLE IF NOT EXISTS conversation_summary (
+                user_id INTEGER PRIMARY KEY,
+                message_count INTEGER DEFAULT 0,
+                last_message_time DATETIME,
+                unread_by_admin INTEGER DEFAULT 0,
+                unread_by_user INTEGER DEFAULT 0,
+                version INTEGER DEFAULT 0,
+                FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+            )
+        '''))
+        
+        # Change counters for data without a natural version (e.g. 'users' for the admin list ETag)
+        cursor.execute(self._sql('''
+            CREATE TABLE IF NOT EXISTS data_versions (
+                name TEXT PRIMARY KEY,
+                version INTEGER DEFAULT 0
+            )
+        '''))
+        
+        # WebRTC signal queue shared by all worker processes (see chatapp_signals.DatabaseSignalStore)
+        # Not passed through _sql(): SDP payloads are far longer than VARCHAR(500)
+        id_column = 'SERIAL PRIMARY KEY' if self.use_postgres else 'INTEGER PRIMARY KEY AUTOINCREMENT'
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS call_signals (
+                id {id_column},
+                recipient_id INTEGER NOT NULL,
+                payload TEXT NOT NULL,
+                expires_ms BIGINT NOT NULL
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_call_signals_recipient
+            ON call_signals (recipient_id, id)
+        ''')
     
-    # ============= Authentication Methods =============
+    def _add_legacy_columns(self, cursor):
+        for table, columns in LEGACY_COLUMNS.items():
+            self.ensure_columns(cursor, table, columns)
     
-    def create_user(self, username: str, email: str, password: str, role: str = 'user') -> Optional[int]:
-        """Create a new user (deleted users cannot re-signup)"""
+    def _add_call_history_columns(self, cursor):
+        """Columns the call methods use (call_status, call_time, ...) on call_history tables created without them"""
+        self.ensure_columns(cursor, 'call_history', CALL_HISTORY_COLUMNS)
+    
+    def _add_summary_version_column(self, cursor):
+        self.ensure_columns(cursor, 'conversation_summary', CONVERSATION_SUMMARY_COLUMNS)
+    
+    # ============= Indexes & Query Plans =============
+    
+    def _table_columns(self, cursor, table: str) -> set:
+        """Column names of a table (empty set if it doesn't exist)"""
+        if self.use_postgres:
+            cursor.execute('''
+                SELECT column_name FROM information_schema.columns WHERE table_name = ?
+            ''', (table,))
+            return {row[0] for row in cursor.fetchall()}
+        cursor.execute(f'PRAGMA table_info({table})')
+        return {row[1] for row in cursor.fetchall()}
+    
+    def ensure_columns(self, cursor, table: str, columns: List[tuple]):
+        """Add any of (column, definition) missing from an existing table"""
+        existing = self._table_columns(cursor, table)
+        for column, definition in columns:
+            if column not in existing:
+                cursor.execute(self._sql(f'ALTER TABLE {table} ADD COLUMN {column} {definition}'))
+    
+    def create_index(self, cursor, name: str, table: str, definition: str):
+        """CREATE INDEX name ON table definition - CONCURRENTLY on PostgreSQL, so the table stays
+        writable during the build (the cursor's connection must be in autocommit mode)"""
+        if not self.use_postgres:
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} {definition}')
+            return
+        # A build that died part way leaves an INVALID index that IF NOT EXISTS would keep - drop it first
+        cursor.execute('''
+            SELECT i.indisvalid FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid
+            WHERE c.relname = ?
+        ''', (name,))
+        row = cursor.fetchone()
+        if row is not None and not row[0]:
+            cursor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+        try:
+            cursor.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} {definition}')
+        except Exception:
+            cursor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+            raise
+    
+    def _create_polling_indexes(self, cursor):
+        """Secondary indexes for the hot access paths"""
+        for name, table, columns, where in INDEXES:
+            # Older databases use different call_history column names - skip what doesn't apply
+            needed = {c.split()[0] for c in columns}
+            if not needed <= self._table_columns(cursor, table):
+                continue
+            where_clause = f' WHERE {where}' if where else ''
+            self.create_index(cursor, name, table, f"({', '.join(columns)}){where_clause}")
+    
+    def explain_hot_queries(self) -> List[Dict[str, Any]]:
+        """Run EXPLAIN on each polling query and flag full table scans"""
         conn = self.get_connection()
         cursor = conn.cursor()
+        results = []
         
         try:
+            for name, sql, params in HOT_QUERIES:
+                try:
+                    if self.use_postgres:
+                        cursor.execute('EXPLAIN ' + sql, params)
+                        plan = [row[0] for row in cursor.fetchall()]
+                        seq_scans = [line.strip() for line in plan if 'Seq Scan' in line]
+                    else:
+                        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                        plan = [row[3] for row in cursor.fetchall()]
+                        # "SCAN t" is a full scan; "SCAN t USING INDEX" walks an index instead
+                        seq_scans = [line for line in plan
+                                     if line.startswith('SCAN ') and 'USING' not in line]
+                    results.append({'query': name, 'plan': plan, 'seq_scans': seq_scans, 'error': None})
+                except Exception as e:
+                    if self.use_postgres:
+                        conn.rollback()
+                    results.append({'query': name, 'plan': [], 'seq_scans': [], 'error': str(e)})
+        finally:
+            conn.close()
+        return results
+    
+    def report_query_plans(self) -> bool:
+        """Print the hot-query plan check; returns True when no query scans a whole table"""
+        ok = True
+        for result in self.explain_hot_queries():
+            if result['error']:
+                print(f"⚠️  [Query Plan] {result['query']}: EXPLAIN failed - {result['error']}")
+            elif result['seq_scans']:
+                ok = False
+                print(f"❌ [Query Plan] {result['query']}: sequential scan - {'; '.join(result['seq_scans'])}")
+            else:
+                print(f"✅ [Query Plan] {result['query']}: {'; '.join(result['plan'])}")
+        return ok
+    
+    # ============= Authentication Methods =============
+    
+    def create_user(self, username: str, email: str, password: str, role: str = 'user') -> Optional[int]:
+        """Create a new user (deleted users cannot re-signup)"""
+        # Hash before taking a connection - bcrypt is slow and may raise PasswordHasherBusy
+        password_hash = self.passwords.hash(password)
+        def write(cursor):
             # Check if username exists (including deleted users)
             cursor.execute('SELECT id, is_deleted FROM users WHERE username = ?', (username,))
             existing_user = cursor.fetchone()
@@ -253,13 +1172,13 @@ class ChatAppDatabase:
                 return None
             
             # Create new user
-            password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
             cursor.execute('''
                 INSERT INTO users (username, email, password_hash, user_role, email_verified)
                 VALUES (?, ?, ?, ?, ?)
             ''', (username, email, password_hash, role, 1))
             
             user_id = cursor.lastrowid
+            self._bump_version(cursor, 'users')
             
             # Create default profile
             cursor.execute('''
@@ -267,8 +1186,10 @@ class ChatAppDatabase:
                 VALUES (?, ?, ?, ?)
             ''', (user_id, '', '', ''))
             
-            conn.commit()
             return user_id
+        
+        try:
+            return self._write(write)
         except (sqlite3.IntegrityError, Exception) as e:
             # Handle both SQLite and PostgreSQL integrity errors
             # PostgreSQL raises psycopg2.IntegrityError, SQLite raises sqlite3.IntegrityError
@@ -276,24 +1197,26 @@ class ChatAppDatabase:
                 return None
             # Re-raise other exceptions
             raise
-        finally:
-            conn.close()
     
     def authenticate_user(self, username: str, password: str) -> Optional[Dict[str, Any]]:
         """Authenticate user and return user data"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('''
-            SELECT id, username, email, password_hash, user_role, is_deleted 
-            FROM users WHERE username = ?
-        ''', (username,))
-        user = cursor.fetchone()
-        conn.close()
+        try:
+            cursor.execute('''
+                SELECT id, username, email, password_hash, user_role, is_deleted 
+                FROM users WHERE username = ?
+            ''', (username,))
+            user = cursor.fetchone()
+        finally:
+            conn.close()
         
-        if user and bcrypt.checkpw(password.encode('utf-8'), user[3].encode('utf-8')):
+        if user and self.passwords.check(password, user[3]):
             if user[5]:  # is_deleted
                 return None
+            if self.passwords.needs_rehash(user[3]):
+                self._rehash_password(user[0], user[3], password)
             return {
                 'id': user[0],
                 'username': user[1],
@@ -302,17 +1225,34 @@ class ChatAppDatabase:
             }
         return None
     
+    def _rehash_password(self, user_id: int, old_hash: str, password: str):
+        """Upgrade a hash made with an old cost factor (only if it hasn't changed meanwhile)"""
+        try:
+            new_hash = self.passwords.hash(password)
+        except Exception as e:
+            print(f"⚠️  Rehash skipped for user {user_id}: {e}")
+            return
+        def write(cursor):
+            cursor.execute('UPDATE users SET password_hash = ? WHERE id = ? AND password_hash = ?',
+                           (new_hash, user_id, old_hash))
+            return cursor.rowcount
+        
+        if self._write(write):
+            self.passwords.record_rehash()
+    
     def get_user_by_id(self, user_id: int) -> Optional[Dict[str, Any]]:
         """Get user by ID"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('''
-            SELECT id, username, email, user_role, is_deleted 
-            FROM users WHERE id = ?
-        ''', (user_id,))
-        user = cursor.fetchone()
-        conn.close()
+        try:
+            cursor.execute('''
+                SELECT id, username, email, user_role, is_deleted 
+                FROM users WHERE id = ?
+            ''', (user_id,))
+            user = cursor.fetchone()
+        finally:
+            conn.close()
         
         if user and not user[4]:  # not is_deleted
             return {
@@ -328,16 +1268,18 @@ class ChatAppDatabase:
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        # Get any administrator account (now there's only one)
-        cursor.execute('''
-            SELECT id, username, email, user_role 
-            FROM users 
-            WHERE user_role = 'administrator' AND is_deleted = 0
-            ORDER BY id ASC
-            LIMIT 1
-        ''')
-        user = cursor.fetchone()
-        conn.close()
+        try:
+            # Get any administrator account (now there's only one)
+            cursor.execute('''
+                SELECT id, username, email, user_role 
+                FROM users 
+                WHERE user_role = 'administrator' AND is_deleted = 0
+                ORDER BY id ASC
+                LIMIT 1
+            ''')
+            user = cursor.fetchone()
+        finally:
+            conn.close()
         
         if user:
             return {
@@ -350,41 +1292,22 @@ class ChatAppDatabase:
     
     def change_password(self, user_id: int, new_password: str) -> bool:
         """Change user password"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
-            password_hash = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-            print(f"[DEBUG] Changing password for user_id: {user_id}")
-            print(f"[DEBUG] New password hash: {password_hash[:30]}...")
-            
+        password_hash = self.passwords.hash(new_password)
+        def write(cursor):
             cursor.execute('''
                 UPDATE users SET password_hash = ?, updated_at = CURRENT_TIMESTAMP
                 WHERE id = ?
             ''', (password_hash, user_id))
             
             rows_affected = cursor.rowcount
-            print(f"[DEBUG] Rows affected: {rows_affected}")
-            
-            conn.commit()
-            print(f"[DEBUG] Commit executed")
-            
-            # Verify the change
-            cursor.execute('SELECT password_hash, username FROM users WHERE id = ?', (user_id,))
-            result = cursor.fetchone()
-            if result:
-                print(f"[DEBUG] Verified DB - User: {result[1]}, Hash: {result[0][:30]}...")
-                if result[0] == password_hash:
-                    print(f"[DEBUG] ✅ Password hash matches in DB!")
-                else:
-                    print(f"[DEBUG] ❌ Password hash MISMATCH in DB!")
-            
+            log.debug('Changed password for user %s (%s rows)', user_id, rows_affected)
             return rows_affected > 0
+        
+        try:
+            return self._write(write)
         except Exception as e:
-            print(f"[DEBUG] ❌ ERROR in change_password: {e}")
+            log.error('Password change for user %s failed: %s', user_id, e)
             raise
-        finally:
-            conn.close()
     
     def update_user_password(self, user_id: int, new_password: str) -> bool:
         """Alias for change_password (for compatibility)"""
@@ -395,73 +1318,71 @@ class ChatAppDatabase:
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('SELECT user_role FROM users WHERE id = ?', (user_id,))
-        result = cursor.fetchone()
-        conn.close()
+        try:
+            cursor.execute('SELECT user_role FROM users WHERE id = ?', (user_id,))
+            result = cursor.fetchone()
+        finally:
+            conn.close()
         
         return result[0] if result else None
     
-    def get_all_users_for_admin(self, include_deleted: bool = False) -> List[Dict[str, Any]]:
-        """Get all users for admin (excluding admin themselves)"""
+    def get_all_users_for_admin(self, include_deleted: bool = False,
+                                online_user_ids: Optional[set] = None) -> List[Dict[str, Any]]:
+        """Get all users for admin (excluding admin themselves)
+        online_user_ids: users the presence service reports online; without it, fall back to last_seen"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        # Build WHERE clause based on include_deleted parameter
-        where_clause = "u.user_role != 'administrator'"
-        if not include_deleted:
-            where_clause += " AND u.is_deleted = 0"
-        
-        query = f'''
-            SELECT u.id, u.username, u.email, u.user_role, u.is_deleted,
-                   (SELECT COUNT(*) FROM admin_messages WHERE user_id = u.id) as message_count,
-                   (SELECT MAX(timestamp) FROM admin_messages WHERE user_id = u.id) as last_message_time,
-                   (SELECT COUNT(*) FROM admin_messages WHERE user_id = u.id AND sender_type = 'user' AND is_read = 0) as unread_count,
-                   us.status,
-                   us.last_seen
-            FROM users u
-            LEFT JOIN user_status us ON u.id = us.user_id
-            WHERE {where_clause}
-            ORDER BY 
-                u.is_deleted ASC,
-                CASE WHEN (SELECT MAX(timestamp) FROM admin_messages WHERE user_id = u.id) IS NULL THEN 0 ELSE 1 END,
-                (SELECT MAX(timestamp) FROM admin_messages WHERE user_id = u.id) DESC, 
-                u.username ASC
-        '''
-        cursor.execute(query)
-        
-        users = []
-        for row in cursor.fetchall():
-            # Determine actual online status based on last_seen timestamp
-            last_seen = row[9]
-            is_online = False
+        try:
+            # Build WHERE clause based on include_deleted parameter
+            where_clause = "u.user_role != 'administrator'"
+            if not include_deleted:
+                where_clause += " AND u.is_deleted = 0"
+            
+            query = f'''
+                SELECT u.id, u.username, u.email, u.user_role, u.is_deleted,
+                       cs.message_count,
+                       cs.last_message_time,
+                       cs.unread_by_admin as unread_count,
+                       us.status,
+                       us.last_seen
+                FROM users u
+                LEFT JOIN conversation_summary cs ON u.id = cs.user_id
+                LEFT JOIN user_status us ON u.id = us.user_id
+                WHERE {where_clause}
+                ORDER BY 
+                    u.is_deleted ASC,
+                    CASE WHEN cs.last_message_time IS NULL THEN 0 ELSE 1 END,
+                    cs.last_message_time DESC, 
+                    u.username ASC
+            '''
+            cursor.execute(query)
             
-            if last_seen:
-                # Parse last_seen timestamp
-                if isinstance(last_seen, str):
-                    last_seen_dt = datetime.fromisoformat(last_seen.replace('Z', '+00:00'))
+            if online_user_ids is None:
+                # No presence service - one cutoff string compared against every row
+                cutoff = (datetime.now(timezone.utc) - timedelta(seconds=ONLINE_WINDOW_SECONDS)).strftime('%Y-%m-%d %H:%M:%S')
+            
+            users = []
+            for row in cursor.fetchall():
+                if online_user_ids is not None:
+                    is_online = row[0] in online_user_ids
                 else:
-                    last_seen_dt = last_seen
+                    is_online = bool(row[9]) and str(row[9])[:19].replace('T', ' ') >= cutoff
                 
-                # Check if last seen within last 5 seconds (faster offline detection)
-                now = datetime.now(timezone.utc)
-                time_diff = (now - last_seen_dt.replace(tzinfo=timezone.utc)).total_seconds()
-                is_online = time_diff < 5
-                print(f"[Status Check] User {row[1]}: last_seen={last_seen}, time_diff={time_diff:.1f}s, is_online={is_online}")
-            
-            users.append({
-                'id': row[0],
-                'username': row[1],
-                'email': row[2],
-                'role': row[3],
-                'is_deleted': row[4],
-                'message_count': row[5] or 0,
-                'last_message_time': row[6],
-                'unread_count': row[7] or 0,
-                'status': 'online' if is_online else 'offline',
-                'last_seen': row[9]
-            })
-        
-        conn.close()
+                users.append({
+                    'id': row[0],
+                    'username': row[1],
+                    'email': row[2],
+                    'role': row[3],
+                    'is_deleted': row[4],
+                    'message_count': row[5] or 0,
+                    'last_message_time': row[6],
+                    'unread_count': row[7] or 0,
+                    'status': 'online' if is_online else 'offline',
+                    'last_seen': row[9]
+                })
+        finally:
+            conn.close()
         return users
     
     # ============= Profile Methods =============
@@ -471,12 +1392,14 @@ class ChatAppDatabase:
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('''
-            SELECT first_name, last_name, bio, avatar_url
-            FROM user_profiles WHERE user_id = ?
-        ''', (user_id,))
-        profile = cursor.fetchone()
-        conn.close()
+        try:
+            cursor.execute('''
+                SELECT first_name, last_name, bio, avatar_url
+                FROM user_profiles WHERE user_id = ?
+            ''', (user_id,))
+            profile = cursor.fetchone()
+        finally:
+            conn.close()
         
         if profile:
             return {
@@ -489,10 +1412,7 @@ class ChatAppDatabase:
     
     def update_profile(self, user_id: int, profile_data: Dict[str, Any]) -> bool:
         """Update user profile"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
+        def write(cursor):
             cursor.execute('''
                 UPDATE user_profiles 
                 SET first_name = ?, last_name = ?, bio = ?, avatar_url = ?,
@@ -505,126 +1425,1001 @@ class ChatAppDatabase:
                 profile_data.get('avatar_url', ''),
                 user_id
             ))
-            conn.commit()
             return cursor.rowcount > 0
+        
+        return self._write(write)
+    
+    # ============= Messaging Methods =============
+    
+    def send_message(self, user_id: int, sender_type: str, message: str, 
+                    file_url: str = None, file_name: str = None, 
+                    file_size: int = None, reply_to: int = None) -> int:
+        """Send a message with optional file attachment and reply"""
+        def write(cursor):
+            cursor.execute('''
+                INSERT INTO admin_messages (user_id, sender_type, message, file_url, file_name, file_size, reply_to)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (user_id, sender_type, message, file_url, file_name, file_size, reply_to))
+            message_id = cursor.lastrowid
+            if file_url:
+                self._retain_upload(cursor, file_url)
+            
+            # Keep the conversation summary in step (same transaction)
+            cursor.execute('''
+                INSERT INTO conversation_summary (user_id, message_count, unread_by_admin, unread_by_user, version)
+                VALUES (?, 1, ?, ?, 1)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    version = conversation_summary.version + 1,
+                    message_count = conversation_summary.message_count + 1,
+                    unread_by_admin = conversation_summary.unread_by_admin + excluded.unread_by_admin,
+                    unread_by_user = conversation_summary.unread_by_user + excluded.unread_by_user
+            ''', (user_id, 1 if sender_type == 'user' else 0, 1 if sender_type == 'admin' else 0))
+            self._refresh_last_message_time(cursor, user_id)
+            return message_id
+        
+        return self._write(write)
+    
+    def get_messages(self, user_id: int, limit: int = 100, since_id: Optional[int] = None,
+                     before_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Get messages for a user in chronological order (keyset paging on id, no OFFSET)
+        - default: the newest `limit` messages
+        - since_id: only messages newer than since_id (oldest first, up to `limit`)
+        - before_id: the `limit` messages just older than before_id (for loading history)
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            columns = '''
+                SELECT id, user_id, sender_type, message, file_url, file_name, file_size,
+                       timestamp, is_read
+                FROM admin_messages
+            '''
+            if since_id is not None:
+                cursor.execute(columns + '''
+                    WHERE user_id = ? AND id > ?
+                    ORDER BY id ASC
+                    LIMIT ?
+                ''', (user_id, since_id, limit))
+                rows = cursor.fetchall()
+            else:
+                rows = self._history_page(cursor, columns, user_id, before_id, limit)
+                # Unread messages stay hot past the archive cutoff, so hot and archived ids interleave.
+                # The archive (every monthly partition on PostgreSQL) is only read when the page can
+                # reach archived_max_id: the hot rows ran out, or the oldest of them is older than it
+                cursor.execute('SELECT archived_max_id FROM conversation_summary WHERE user_id = ?', (user_id,))
+                summary = cursor.fetchone()
+                archived_max_id = summary[0] if summary else None
+                if archived_max_id is not None and (len(rows) < limit or rows[-1][0] < archived_max_id):
+                    archive_columns = columns.replace('FROM admin_messages', 'FROM admin_messages_archive')
+                    rows += self._history_page(cursor, archive_columns, user_id, before_id, limit)
+                    rows = sorted(rows, key=lambda row: row[0], reverse=True)[:limit]
+            
+            # Thumbnails / poster frames for attachments, so the history doesn't load the originals
+            previews = self._upload_previews(cursor, sorted({self._upload_filename(row[4]) for row in rows if row[4]}))
+            
+            messages = []
+            for row in rows:
+                preview = previews.get(self._upload_filename(row[4])) if row[4] else None
+                messages.append({
+                    'id': row[0],
+                    'user_id': row[1],
+                    'sender_type': row[2],
+                    'message': row[3],
+                    'file_url': row[4],
+                    'file_name': row[5],
+                    'file_size': row[6],
+                    'preview_url': f'/api/files/{preview}' if preview else None,
+                    'timestamp': row[7],
+                    'is_read': bool(row[8])
+                })
+        finally:
+            conn.close()
+        if since_id is not None:
+            return messages  # Already oldest first
+        return list(reversed(messages))  # Return in chronological order
+    
+    @staticmethod
+    def _history_page(cursor, columns: str, user_id: int, before_id: Optional[int], limit: int) -> list:
+        """Newest `limit` rows of one message table (older than before_id), newest first"""
+        if before_id is not None:
+            cursor.execute(columns + '''
+                WHERE user_id = ? AND id < ?
+                ORDER BY id DESC
+                LIMIT ?
+            ''', (user_id, before_id, limit))
+        else:
+            cursor.execute(columns + '''
+                WHERE user_id = ?
+                ORDER BY id DESC
+                LIMIT ?
+            ''', (user_id, limit))
+        return cursor.fetchall()
+    
+    def mark_messages_read(self, user_id: int) -> bool:
+        """Mark all admin messages as read for a user"""
+        def write(cursor):
+            cursor.execute('''
+                UPDATE admin_messages
+                SET is_read = 1
+                WHERE user_id = ? AND sender_type = 'admin' AND is_read = 0
+            ''', (user_id,))
+            if cursor.rowcount > 0:
+                cursor.execute('''
+                    UPDATE conversation_summary SET unread_by_user = 0, version = version + 1 WHERE user_id = ?
+                ''', (user_id,))
+            return True
+        
+        return self._write(write)
+    
+    def mark_user_messages_read_by_admin(self, user_id: int) -> bool:
+        """Mark all user messages as read by admin (when admin views user's conversation)"""
+        def write(cursor):
+            cursor.execute('''
+                UPDATE admin_messages
+                SET is_read = 1
+                WHERE user_id = ? AND sender_type = 'user' AND is_read = 0
+            ''', (user_id,))
+            if cursor.rowcount > 0:
+                cursor.execute('''
+                    UPDATE conversation_summary SET unread_by_admin = 0, version = version + 1 WHERE user_id = ?
+                ''', (user_id,))
+            return True
+        
+        return self._write(write)
+    
+    def get_unread_count(self, user_id: int, sender_type: str) -> int:
+        """Get count of unread messages"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('''
+                SELECT COUNT(*)
+                FROM admin_messages
+                WHERE user_id = ? AND sender_type = ? AND is_read = 0
+            ''', (user_id, sender_type))
+            
+            count = cursor.fetchone()[0]
+        finally:
+            conn.close()
+        return count
+    
+    def delete_message(self, message_id: int, user_id: int, role: str) -> Optional[int]:
+        """Delete a message; returns the user_id of the conversation it was in (None if nothing was deleted)"""
+        def write(cursor):
+            # Remember what is being deleted so the conversation summary can be adjusted
+            # (older messages may have been moved to the archive table)
+            table = 'admin_messages'
+            cursor.execute('SELECT user_id, sender_type, is_read, file_url FROM admin_messages WHERE id = ?', (message_id,))
+            target = cursor.fetchone()
+            if target is None:
+                table = 'admin_messages_archive'
+                cursor.execute('SELECT user_id, sender_type, is_read, file_url FROM admin_messages_archive WHERE id = ?', (message_id,))
+                target = cursor.fetchone()
+            
+            if role == 'administrator':
+                # Ken Tse can delete any message
+                cursor.execute(f'DELETE FROM {table} WHERE id = ?', (message_id,))
+            else:
+                # Regular user can only delete their own messages
+                cursor.execute(f'''
+                    DELETE FROM {table}
+                    WHERE id = ? AND user_id = ? AND sender_type = 'user'
+                ''', (message_id, user_id))
+            deleted = cursor.rowcount > 0
+            owner_id = None
+            
+            if deleted and target:
+                owner_id, sender_type, is_read, file_url = target
+                if file_url:
+                    self._release_uploads(cursor, {file_url: 1})
+                unread_column = 'unread_by_admin' if sender_type == 'user' else 'unread_by_user'
+                unread_delta = 0 if is_read else 1
+                cursor.execute(f'''
+                    UPDATE conversation_summary
+                    SET message_count = message_count - 1,
+                        {unread_column} = {unread_column} - ?,
+                        version = version + 1
+                    WHERE user_id = ?
+                ''', (unread_delta, owner_id))
+                self._refresh_last_message_time(cursor, owner_id)
+            
+            return owner_id
+        
+        return self._write(write)
+    
+    # ============= Message Archive =============
+    
+    def _create_archive_table(self, cursor):
+        """Cold tier for old, read messages (monthly range partitions on PostgreSQL)"""
+        if self.use_postgres:
+            # Partition key must be part of the primary key
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS admin_messages_archive (
+                    id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    sender_type VARCHAR(10) NOT NULL,
+                    message TEXT NOT NULL,
+                    is_read INTEGER DEFAULT 1,
+                    file_url TEXT,
+                    file_name TEXT,
+                    file_size INTEGER,
+                    reply_to INTEGER,
+                    timestamp TIMESTAMP NOT NULL,
+                    PRIMARY KEY (id, timestamp)
+                ) PARTITION BY RANGE (timestamp)
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS admin_messages_archive_default
+                PARTITION OF admin_messages_archive DEFAULT
+            ''')
+        else:
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS admin_messages_archive (
+                    id INTEGER PRIMARY KEY,
+                    user_id INTEGER NOT NULL,
+                    sender_type TEXT NOT NULL,
+                    message TEXT NOT NULL,
+                    is_read INTEGER DEFAULT 1,
+                    file_url TEXT,
+                    file_name TEXT,
+                    file_size INTEGER,
+                    reply_to INTEGER,
+                    timestamp DATETIME NOT NULL
+                )
+            ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_admin_messages_archive_user_id
+            ON admin_messages_archive (user_id, id)
+        ''')
+    
+    def _ensure_archive_partitions(self, cursor, cutoff: str):
+        """Create the monthly archive partitions that rows older than cutoff will land in"""
+        cursor.execute('SELECT MIN(timestamp) FROM admin_messages')
+        oldest = cursor.fetchone()[0]
+        if oldest is None:
+            return
+        if isinstance(oldest, str):
+            oldest = datetime.fromisoformat(oldest)
+        year, month = oldest.year, oldest.month
+        end = datetime.fromisoformat(cutoff)
+        while (year, month) <= (end.year, end.month):
+            next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+            cursor.execute(f'''
+                CREATE TABLE IF NOT EXISTS admin_messages_archive_{year}_{month:02d}
+                PARTITION OF admin_messages_archive
+                FOR VALUES FROM ('{year}-{month:02d}-01') TO ('{next_year}-{next_month:02d}-01')
+            ''')
+            year, month = next_year, next_month
+    
+    def archive_messages(self, cutoff: str, batch_size: int = 1000) -> int:
+        """Move up to batch_size read messages older than cutoff ('YYYY-MM-DD HH:MM:SS') to the archive"""
+        def write(cursor):
+            if self.use_postgres:
+                self._ensure_archive_partitions(cursor, cutoff)
+            # Unread messages stay hot so unread counts never touch the archive
+            cursor.execute('''
+                SELECT id FROM admin_messages
+                WHERE timestamp < ? AND is_read = 1
+                ORDER BY id
+                LIMIT ?
+            ''', (cutoff, batch_size))
+            ids = [row[0] for row in cursor.fetchall()]
+            if not ids:
+                return 0
+            placeholders = ', '.join('?' * len(ids))
+            # ON CONFLICT: another worker's archiver may have copied the same rows first
+            cursor.execute(f'''
+                INSERT INTO admin_messages_archive
+                    (id, user_id, sender_type, message, is_read, file_url, file_name, file_size, reply_to, timestamp)
+                SELECT id, user_id, sender_type, message, is_read, file_url, file_name, file_size, reply_to, timestamp
+                FROM admin_messages WHERE id IN ({placeholders})
+                ON CONFLICT DO NOTHING
+            ''', ids)
+            cursor.execute(f'''
+                SELECT user_id, MAX(id) FROM admin_messages
+                WHERE id IN ({placeholders})
+                GROUP BY user_id
+            ''', ids)
+            for user_id, max_id in cursor.fetchall():
+                cursor.execute('''
+                    UPDATE conversation_summary
+                    SET archived_max_id = ?
+                    WHERE user_id = ? AND (archived_max_id IS NULL OR archived_max_id < ?)
+                ''', (max_id, user_id, max_id))
+            cursor.execute(f'DELETE FROM admin_messages WHERE id IN ({placeholders})', ids)
+            moved = cursor.rowcount
+            return moved
+        
+        return self._write(write)
+    
+    def purge_archive(self, cutoff: str) -> int:
+        """Retention: drop archived messages older than cutoff (whole monthly partitions on PostgreSQL)"""
+        def write(cursor):
+            # Purged messages leave the conversation totals too
+            cursor.execute('''
+                SELECT user_id, COUNT(*) FROM admin_messages_archive
+                WHERE timestamp < ?
+                GROUP BY user_id
+            ''', (cutoff,))
+            purged_users = cursor.fetchall()
+            for user_id, count in purged_users:
+                cursor.execute('''
+                    UPDATE conversation_summary
+                    SET message_count = message_count - ?, version = version + 1
+                    WHERE user_id = ?
+                ''', (count, user_id))
+            cursor.execute('''
+                SELECT file_url, COUNT(*) FROM admin_messages_archive
+                WHERE timestamp < ? AND file_url IS NOT NULL
+                GROUP BY file_url
+            ''', (cutoff,))
+            self._release_uploads(cursor, dict(cursor.fetchall()))
+            
+            removed = 0
+            if self.use_postgres:
+                end = datetime.fromisoformat(cutoff)
+                cursor.execute('''
+                    SELECT c.relname FROM pg_inherits i
+                    JOIN pg_class c ON c.oid = i.inhrelid
+                    JOIN pg_class p ON p.oid = i.inhparent
+                    WHERE p.relname = 'admin_messages_archive'
+                ''')
+                for (name,) in cursor.fetchall():
+                    match = re.fullmatch(r'admin_messages_archive_(\d{4})_(\d{2})', name)
+                    if not match:
+                        continue
+                    year, month = int(match.group(1)), int(match.group(2))
+                    next_start = datetime(year + (month == 12), month % 12 + 1, 1)
+                    if next_start <= end:
+                        cursor.execute(f'SELECT COUNT(*) FROM {name}')
+                        removed += cursor.fetchone()[0]
+                        cursor.execute(f'DROP TABLE {name}')
+                # Rows in the default partition (or partial months) are deleted row by row
+            cursor.execute('DELETE FROM admin_messages_archive WHERE timestamp < ?', (cutoff,))
+            removed += max(cursor.rowcount, 0)
+            # A conversation whose whole history was purged has no last message time any more
+            for user_id, _ in purged_users:
+                self._refresh_last_message_time(cursor, user_id)
+                self._refresh_archived_max_id(cursor, user_id)
+            return removed
+        
+        return self._write(write)
+    
+    def get_archive_stats(self) -> Dict[str, Any]:
+        """Hot vs archived message counts"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('SELECT COUNT(*) FROM admin_messages')
+            hot = cursor.fetchone()[0]
+            cursor.execute('SELECT COUNT(*), MIN(timestamp) FROM admin_messages_archive')
+            archived, oldest = cursor.fetchone()
+            return {'hot_messages': hot, 'archived_messages': archived, 'oldest_archived': oldest}
+        finally:
+            conn.close()
+    
+    # ============= Search Methods =============
+    
+    def _create_search_index(self, cursor):
+        """Full-text index on admin_messages.message: FTS5 (SQLite) or a tsvector column (PostgreSQL)"""
+        if self.use_postgres:
+            cursor.execute('''
+                ALTER TABLE admin_messages ADD COLUMN IF NOT EXISTS search_vector tsvector
+                GENERATED ALWAYS AS (to_tsvector('simple', coalesce(message, ''))) STORED
+            ''')
+            return
+        
+        try:
+            # External-content table: the text lives only in admin_messages. user_id is indexed as a
+            # token so per-user searches intersect posting lists instead of filtering every match.
+            cursor.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS admin_messages_fts USING fts5(
+                    message, user_id,
+                    content='admin_messages', content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2'
+                )
+            ''')
+        except sqlite3.OperationalError as e:
+            print(f"⚠️  FTS5 not available ({e}) - message search falls back to LIKE")
+            return
+        
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS admin_messages_fts_insert AFTER INSERT ON admin_messages BEGIN
+                INSERT INTO admin_messages_fts (rowid, message, user_id) VALUES (new.id, new.message, new.user_id);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS admin_messages_fts_delete AFTER DELETE ON admin_messages BEGIN
+                INSERT INTO admin_messages_fts (admin_messages_fts, rowid, message, user_id)
+                VALUES ('delete', old.id, old.message, old.user_id);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS admin_messages_fts_update AFTER UPDATE OF message, user_id ON admin_messages BEGIN
+                INSERT INTO admin_messages_fts (admin_messages_fts, rowid, message, user_id)
+                VALUES ('delete', old.id, old.message, old.user_id);
+                INSERT INTO admin_messages_fts (rowid, message, user_id) VALUES (new.id, new.message, new.user_id);
+            END
+        ''')
+        
+        # Index messages written before the FTS table existed
+        cursor.execute('SELECT 1 FROM admin_messages_fts_docsize LIMIT 1')
+        if cursor.fetchone() is None:
+            cursor.execute('SELECT 1 FROM admin_messages LIMIT 1')
+            if cursor.fetchone() is not None:
+                cursor.execute("INSERT INTO admin_messages_fts (admin_messages_fts) VALUES ('rebuild')")
+                print("🔎 Built full-text index for existing messages")
+    
+    def _create_search_gin_index(self, cursor):
+        if self.use_postgres:
+            self.create_index(cursor, 'idx_admin_messages_search', 'admin_messages', 'USING GIN (search_vector)')
+    
+    def _create_archive_search_index(self, cursor):
+        """The same index on admin_messages_archive, so archived history stays searchable"""
+        if self.use_postgres:
+            cursor.execute('''
+                ALTER TABLE admin_messages_archive ADD COLUMN IF NOT EXISTS search_vector tsvector
+                GENERATED ALWAYS AS (to_tsvector('simple', coalesce(message, ''))) STORED
+            ''')
+            # Partitioned tables can't build indexes CONCURRENTLY; the archive only takes batch inserts
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_admin_messages_archive_search
+                ON admin_messages_archive USING GIN (search_vector)
+            ''')
+            return
+        
+        try:
+            cursor.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS admin_messages_archive_fts USING fts5(
+                    message, user_id,
+                    content='admin_messages_archive', content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2'
+                )
+            ''')
+        except sqlite3.OperationalError:
+            return  # No FTS5 - search uses LIKE on both tables
+        
+        # Archived rows are never edited: only inserts (archive_messages) and deletes need triggers
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS admin_messages_archive_fts_insert AFTER INSERT ON admin_messages_archive BEGIN
+                INSERT INTO admin_messages_archive_fts (rowid, message, user_id) VALUES (new.id, new.message, new.user_id);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS admin_messages_archive_fts_delete AFTER DELETE ON admin_messages_archive BEGIN
+                INSERT INTO admin_messages_archive_fts (admin_messages_archive_fts, rowid, message, user_id)
+                VALUES ('delete', old.id, old.message, old.user_id);
+            END
+        ''')
+        cursor.execute('SELECT 1 FROM admin_messages_archive LIMIT 1')
+        if cursor.fetchone() is not None:
+            cursor.execute("INSERT INTO admin_messages_archive_fts (admin_messages_archive_fts) VALUES ('rebuild')")
+            print("🔎 Built full-text index for archived messages")
+    
+    @staticmethod
+    def _search_terms(query: str) -> List[str]:
+        return re.findall(r'\w+', query.lower())[:16]
+    
+    @staticmethod
+    def _highlight(snippet: str) -> str:
+        """HTML-escape a snippet, then turn the match sentinels into <mark> tags"""
+        start, stop = SEARCH_HIGHLIGHT
+        return html.escape(snippet or '').replace(start, '<mark>').replace(stop, '</mark>')
+    
+    def search_messages(self, query: str, user_id: Optional[int] = None, limit: int = 20,
+                        cursor_after: Optional[tuple] = None) -> Dict[str, Any]:
+        """
+        Ranked full-text search, best match first.
+        user_id limits the search to one conversation; cursor_after is the (score, id) of the
+        last result of the previous page (keyset pagination).
+        """
+        terms = self._search_terms(query)
+        if not terms:
+            return {'results': [], 'next_cursor': None}
+        start, stop = SEARCH_HIGHLIGHT
+        
+        # Archived messages are searched too: one SELECT per table, ranked together. Each table
+        # scores against its own index, so archive and hot scores are close but not identical.
+        parts = []
+        params = []
+        if self.search_backend == 'fts5':
+            # Every term must match in the message column; the last one as a prefix (search-as-you-type)
+            match = ' AND '.join(f'message : "{t}"' for t in terms[:-1])
+            match = (match + ' AND ' if match else '') + f'message : "{terms[-1]}"*'
+            if user_id is not None:
+                match = f'user_id : "{int(user_id)}" AND {match}'
+            for table in ('admin_messages', 'admin_messages_archive'):
+                fts = f'{table}_fts'
+                parts.append(f'''
+                    SELECT m.id, m.user_id, m.sender_type, m.timestamp,
+                           snippet({fts}, 0, ?, ?, '…', 16) AS snippet, -bm25({fts}, 1.0, 0.0) AS score
+                    FROM {fts}
+                    JOIN {table} m ON m.id = {fts}.rowid
+                    WHERE {fts} MATCH ?
+                ''')
+                params += [start, stop, match]
+        elif self.search_backend == 'tsvector':
+            text = ' '.join(terms)
+            options = f'StartSel={start}, StopSel={stop}, MaxWords=24, MinWords=8, MaxFragments=2'
+            for table in ('admin_messages', 'admin_messages_archive'):
+                sql = f'''
+                    SELECT m.id, m.user_id, m.sender_type, m.timestamp,
+                           ts_headline('simple', m.message, plainto_tsquery('simple', ?), ?) AS snippet,
+                           ts_rank(m.search_vector, plainto_tsquery('simple', ?)) AS score
+                    FROM {table} m
+                    WHERE m.search_vector @@ plainto_tsquery('simple', ?)
+                '''
+                params += [text, options, text, text]
+                if user_id is not None:
+                    sql += ' AND m.user_id = ?'
+                    params.append(user_id)
+                parts.append(sql)
+        else:
+            # No FTS5 in this SQLite build - unranked substring match, newest first
+            for table in ('admin_messages', 'admin_messages_archive'):
+                sql = f'''
+                    SELECT m.id, m.user_id, m.sender_type, m.timestamp, SUBSTR(m.message, 1, 200) AS snippet, 0 AS score
+                    FROM {table} m WHERE 1 = 1
+                '''
+                for t in terms:
+                    sql += ' AND LOWER(m.message) LIKE ?'
+                    params.append(f'%{t}%')
+                if user_id is not None:
+                    sql += ' AND m.user_id = ?'
+                    params.append(user_id)
+                parts.append(sql)
+        
+        sql = f'SELECT id, user_id, sender_type, timestamp, snippet, score FROM ({" UNION ALL ".join(parts)}) matches'
+        if cursor_after is not None:
+            last_score, last_id = cursor_after
+            sql += ' WHERE score < ? OR (score = ? AND id < ?)'
+            params += [last_score, last_score, last_id]
+        sql += ' ORDER BY score DESC, id DESC LIMIT ?'
+        params.append(limit + 1)
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute(sql, tuple(params))
+            rows = cursor.fetchall()
+        finally:
+            conn.close()
+        
+        results = [{
+            'id': row[0],
+            'user_id': row[1],
+            'sender_type': row[2],
+            'timestamp': row[3],
+            'snippet': self._highlight(row[4]),
+            'score': row[5]
+        } for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = results[-1]
+            next_cursor = (last['score'], last['id'])
+        return {'results': results, 'next_cursor': next_cursor}
+    
+    # ============= Conversation Summary Methods =============
+    
+    def _refresh_last_message_time(self, cursor, user_id: int):
+        """Re-read the newest message time for a user (index lookup on user_id, timestamp)"""
+        cursor.execute('''
+            UPDATE conversation_summary
+            SET last_message_time = COALESCE(
+                (SELECT MAX(timestamp) FROM admin_messages WHERE user_id = ?),
+                (SELECT MAX(timestamp) FROM admin_messages_archive WHERE user_id = ?))
+            WHERE user_id = ?
+        ''', (user_id, user_id, user_id))
+    
+    def _refresh_archived_max_id(self, cursor, user_id: int):
+        cursor.execute('''
+            UPDATE conversation_summary
+            SET archived_max_id = (SELECT MAX(id) FROM admin_messages_archive WHERE user_id = ?)
+            WHERE user_id = ?
+        ''', (user_id, user_id))
+    
+    def rebuild_conversation_summary(self) -> int:
+        """Recompute every conversation summary row from admin_messages, returns rows written"""
+        return self._write(self._rebuild_conversation_summary)
+    
+    def _rebuild_conversation_summary(self, cursor) -> int:
+        cursor.execute('DELETE FROM conversation_summary')
+        cursor.execute('''
+            INSERT INTO conversation_summary
+                (user_id, message_count, last_message_time, unread_by_admin, unread_by_user)
+            SELECT user_id, COUNT(*), MAX(timestamp),
+                   SUM(CASE WHEN sender_type = 'user' AND is_read = 0 THEN 1 ELSE 0 END),
+                   SUM(CASE WHEN sender_type = 'admin' AND is_read = 0 THEN 1 ELSE 0 END)
+            FROM (
+                SELECT user_id, timestamp, sender_type, is_read FROM admin_messages
+                UNION ALL
+                SELECT user_id, timestamp, sender_type, is_read FROM admin_messages_archive
+            ) all_messages
+            WHERE 1 = 1
+            GROUP BY user_id
+            ON CONFLICT(user_id) DO NOTHING
+        ''')
+        if 'archived_max_id' in self._table_columns(cursor, 'conversation_summary'):  # Not yet in migration 9
+            self._fill_archived_max_id(cursor)
+        cursor.execute('SELECT COUNT(*) FROM conversation_summary')
+        return cursor.fetchone()[0]
+    
+    def _backfill_conversation_summary(self, cursor):
+        """Build the summary once for databases that have messages but no summary rows yet"""
+        cursor.execute('SELECT 1 FROM conversation_summary LIMIT 1')
+        has_summary = cursor.fetchone() is not None
+        cursor.execute('SELECT 1 FROM admin_messages LIMIT 1')
+        has_messages = cursor.fetchone() is not None
+        if has_messages and not has_summary:
+            count = self._rebuild_conversation_summary(cursor)
+            print(f"📊 Built conversation summary for {count} users")
+    
+    # ============= Upload Blobs =============
+    
+    def _create_upload_blobs_table(self, cursor):
+        """One row per stored file (see chatapp_uploads.UploadStore); ref_count = messages pointing at it"""
+        cursor.execute(self._sql('''
+            CREATE TABLE IF NOT EXISTS upload_blobs (
+                sha256 TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                ref_count INTEGER DEFAULT 0,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                last_used DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        '''))
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_upload_blobs_filename ON upload_blobs (filename)
+        ''')
+    
+    def _create_upload_sessions_tables(self, cursor):
+        """Resumable chunked uploads (see chatapp_uploads.UploadStore.create_session)"""
+        cursor.execute(self._sql('''
+            CREATE TABLE IF NOT EXISTS upload_sessions (
+                upload_id TEXT PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                filename TEXT NOT NULL,
+                extension TEXT,
+                size BIGINT NOT NULL,
+                chunk_size INTEGER NOT NULL,
+                sha256 TEXT,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                expires_at DATETIME NOT NULL
+            )
+        '''))
+        cursor.execute(self._sql('''
+            CREATE TABLE IF NOT EXISTS upload_session_chunks (
+                upload_id TEXT NOT NULL,
+                chunk_index INTEGER NOT NULL,
+                PRIMARY KEY (upload_id, chunk_index)
+            )
+        '''))
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_upload_sessions_expires ON upload_sessions (expires_at)
+        ''')
+    
+    def _add_upload_preview_columns(self, cursor):
+        self.ensure_columns(cursor, 'upload_blobs', UPLOAD_PREVIEW_COLUMNS)
+    
+    def _add_summary_archive_column(self, cursor):
+        self.ensure_columns(cursor, 'conversation_summary', SUMMARY_ARCHIVE_COLUMNS)
+        self._fill_archived_max_id(cursor)
+    
+    def _fill_archived_max_id(self, cursor):
+        """Set archived_max_id from admin_messages_archive for every conversation"""
+        cursor.execute('''
+            UPDATE conversation_summary
+            SET archived_max_id = (
+                SELECT MAX(id) FROM admin_messages_archive
+                WHERE admin_messages_archive.user_id = conversation_summary.user_id)
+        ''')
+    
+    @staticmethod
+    def _upload_filename(file_url: str) -> str:
+        """'/api/files/<name>?...' -> '<name>'"""
+        return file_url.split('?', 1)[0].rsplit('/', 1)[-1]
+    
+    def _retain_upload(self, cursor, file_url: str):
+        cursor.execute('''
+            UPDATE upload_blobs SET ref_count = ref_count + 1 WHERE filename = ?
+        ''', (self._upload_filename(file_url),))
+    
+    def _release_uploads(self, cursor, counts: Dict[str, int]):
+        """Drop message references ({file_url: messages}); files from before the blob store are ignored"""
+        for file_url, count in counts.items():
+            cursor.execute('''
+                UPDATE upload_blobs SET ref_count = ref_count - ? WHERE filename = ?
+            ''', (count, self._upload_filename(file_url)))
+    
+    def _user_upload_refs(self, cursor, user_id: int) -> Dict[str, int]:
+        counts = {}
+        for table in ('admin_messages', 'admin_messages_archive'):
+            cursor.execute(f'''
+                SELECT file_url, COUNT(*) FROM {table}
+                WHERE user_id = ? AND file_url IS NOT NULL
+                GROUP BY file_url
+            ''', (user_id,))
+            for file_url, count in cursor.fetchall():
+                counts[file_url] = counts.get(file_url, 0) + count
+        return counts
+    
+    def get_upload_blob(self, sha256: str) -> Optional[Dict[str, Any]]:
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('''
+                SELECT sha256, filename, size, ref_count FROM upload_blobs WHERE sha256 = ?
+            ''', (sha256,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return {'sha256': row[0], 'filename': row[1], 'size': row[2], 'ref_count': row[3]}
         finally:
             conn.close()
     
-    # ============= Messaging Methods =============
+    def register_upload_blob(self, sha256: str, filename: str, size: int) -> Dict[str, Any]:
+        """Record a newly stored blob; returns the stored row (the first writer's if two raced)"""
+        def write(cursor):
+            cursor.execute('''
+                INSERT INTO upload_blobs (sha256, filename, size) VALUES (?, ?, ?)
+                ON CONFLICT(sha256) DO UPDATE SET last_used = CURRENT_TIMESTAMP
+            ''', (sha256, filename, size))
+            cursor.execute('''
+                SELECT sha256, filename, size, ref_count FROM upload_blobs WHERE sha256 = ?
+            ''', (sha256,))
+            row = cursor.fetchone()
+            return {'sha256': row[0], 'filename': row[1], 'size': row[2], 'ref_count': row[3]}
+        
+        return self._write(write)
+    
+    def touch_upload_blob(self, sha256: str):
+        """Mark a blob as just uploaded again, so garbage collection leaves it alone until it's sent"""
+        def write(cursor):
+            cursor.execute('''
+                UPDATE upload_blobs SET last_used = CURRENT_TIMESTAMP WHERE sha256 = ?
+            ''', (sha256,))
+        
+        self._write(write)
+    
+    def delete_unreferenced_upload_blobs(self, idle_before: str) -> List[str]:
+        """Forget blobs with no references that haven't been uploaded since idle_before; returns their
+        filenames (and their previews')"""
+        def write(cursor):
+            cursor.execute('''
+                SELECT sha256, filename, preview FROM upload_blobs
+                WHERE ref_count <= 0 AND last_used < ?
+            ''', (idle_before,))
+            rows = cursor.fetchall()
+            for sha256, _, _ in rows:
+                cursor.execute('DELETE FROM upload_blobs WHERE sha256 = ?', (sha256,))
+            return [name for _, filename, preview in rows for name in (filename, preview) if name]
+        
+        return self._write(write)
+    
+    def get_upload_blobs_without_preview(self, limit: int) -> List[Dict[str, Any]]:
+        """Blobs no preview has been attempted for yet (oldest first)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('''
+                SELECT sha256, filename FROM upload_blobs
+                WHERE preview_state IS NULL
+                ORDER BY created_at
+                LIMIT ?
+            ''', (limit,))
+            return [{'sha256': row[0], 'filename': row[1]} for row in cursor.fetchall()]
+        finally:
+            conn.close()
+    
+    def claim_upload_preview(self, sha256: str) -> bool:
+        """Mark a blob's preview as being generated; False if another worker already claimed it"""
+        def write(cursor):
+            cursor.execute('''
+                UPDATE upload_blobs SET preview_state = 'working'
+                WHERE sha256 = ? AND preview_state IS NULL
+            ''', (sha256,))
+            return cursor.rowcount > 0
+        
+        return self._write(write)
+    
+    def finish_upload_preview(self, sha256: str, state: str, preview: Optional[str] = None):
+        def write(cursor):
+            cursor.execute('''
+                UPDATE upload_blobs SET preview_state = ?, preview = ? WHERE sha256 = ?
+            ''', (state, preview, sha256))
+        
+        self._write(write)
     
-    def send_message(self, user_id: int, sender_type: str, message: str, 
-                    file_url: str = None, file_name: str = None, 
-                    file_size: int = None, reply_to: int = None) -> int:
-        """Send a message with optional file attachment and reply"""
+    def _upload_previews(self, cursor, filenames: List[str]) -> Dict[str, str]:
+        """{blob filename: preview filename} for the given blobs that have a preview ready"""
+        if not filenames:
+            return {}
+        placeholders = ','.join('?' * len(filenames))
+        cursor.execute(f'''
+            SELECT filename, preview FROM upload_blobs
+            WHERE filename IN ({placeholders}) AND preview_state = 'ready'
+        ''', filenames)
+        return dict(cursor.fetchall())
+    
+    def create_upload_session(self, upload_id: str, user_id: int, filename: str, extension: str, size: int,
+                              chunk_size: int, sha256: Optional[str], expires_at: str):
+        def write(cursor):
+            cursor.execute('''
+                INSERT INTO upload_sessions
+                    (upload_id, user_id, filename, extension, size, chunk_size, sha256, expires_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(upload_id) DO NOTHING
+            ''', (upload_id, user_id, filename, extension, size, chunk_size, sha256, expires_at))
+        
+        self._write(write)
+    
+    def get_upload_session(self, upload_id: str) -> Optional[Dict[str, Any]]:
         conn = self.get_connection()
         cursor = conn.cursor()
         
         try:
             cursor.execute('''
-                INSERT INTO admin_messages (user_id, sender_type, message, file_url, file_name, file_size, reply_to)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (user_id, sender_type, message, file_url, file_name, file_size, reply_to))
-            conn.commit()
-            return cursor.lastrowid
+                SELECT upload_id, user_id, filename, extension, size, chunk_size, sha256, expires_at
+                FROM upload_sessions WHERE upload_id = ?
+            ''', (upload_id,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            columns = ['upload_id', 'user_id', 'filename', 'extension', 'size', 'chunk_size', 'sha256', 'expires_at']
+            return dict(zip(columns, row))
         finally:
             conn.close()
     
-    def get_messages(self, user_id: int, limit: int = 100) -> List[Dict[str, Any]]:
-        """Get messages for a user"""
+    def add_upload_chunk(self, upload_id: str, chunk_index: int):
+        def write(cursor):
+            cursor.execute('''
+                INSERT INTO upload_session_chunks (upload_id, chunk_index) VALUES (?, ?)
+                ON CONFLICT(upload_id, chunk_index) DO NOTHING
+            ''', (upload_id, chunk_index))
+        
+        self._write(write)
+    
+    def get_upload_chunks(self, upload_id: str) -> List[int]:
+        """Indexes of the chunks received so far"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('''
-            SELECT id, user_id, sender_type, message, file_url, file_name, file_size,
-                   timestamp, is_read
-            FROM admin_messages
-            WHERE user_id = ?
-            ORDER BY timestamp DESC
-            LIMIT ?
-        ''', (user_id, limit))
+        try:
+            cursor.execute('''
+                SELECT chunk_index FROM upload_session_chunks WHERE upload_id = ? ORDER BY chunk_index
+            ''', (upload_id,))
+            return [row[0] for row in cursor.fetchall()]
+        finally:
+            conn.close()
+    
+    def delete_upload_session(self, upload_id: str) -> bool:
+        """Remove a session; False if it was already gone (another request completed it)"""
+        def write(cursor):
+            cursor.execute('DELETE FROM upload_session_chunks WHERE upload_id = ?', (upload_id,))
+            cursor.execute('DELETE FROM upload_sessions WHERE upload_id = ?', (upload_id,))
+            return cursor.rowcount > 0
         
-        messages = []
-        for row in cursor.fetchall():
-            messages.append({
-                'id': row[0],
-                'user_id': row[1],
-                'sender_type': row[2],
-                'message': row[3],
-                'file_url': row[4],
-                'file_name': row[5],
-                'file_size': row[6],
-                'timestamp': row[7],
-                'is_read': bool(row[8])
-            })
+        return self._write(write)
+    
+    def delete_expired_upload_sessions(self, now: str) -> List[str]:
+        """Remove sessions that expired before now; returns their upload_ids"""
+        def write(cursor):
+            cursor.execute('SELECT upload_id FROM upload_sessions WHERE expires_at < ?', (now,))
+            expired = [row[0] for row in cursor.fetchall()]
+            for upload_id in expired:
+                cursor.execute('DELETE FROM upload_session_chunks WHERE upload_id = ?', (upload_id,))
+                cursor.execute('DELETE FROM upload_sessions WHERE upload_id = ?', (upload_id,))
+            return expired
         
-        conn.close()
-        return list(reversed(messages))  # Return in chronological order
+        return self._write(write)
     
-    def mark_messages_read(self, user_id: int) -> bool:
-        """Mark all admin messages as read for a user"""
+    # ============= Version Stamps (ETag) =============
+    
+    def _bump_version(self, cursor, name: str):
+        """Increment a data_versions counter inside the caller's transaction"""
+        cursor.execute('''
+            INSERT INTO data_versions (name, version) VALUES (?, 1)
+            ON CONFLICT(name) DO UPDATE SET version = data_versions.version + 1
+        ''', (name,))
+    
+    def _conversation_stamp(self, cursor, user_id: int) -> tuple:
+        cursor.execute('''
+            SELECT version, message_count, unread_by_admin, unread_by_user, last_message_time
+            FROM conversation_summary WHERE user_id = ?
+        ''', (user_id,))
+        row = cursor.fetchone()
+        return tuple(row) if row else ()
+    
+    def _admin_list_stamp(self, cursor) -> tuple:
+        cursor.execute("SELECT version FROM data_versions WHERE name = 'users'")
+        row = cursor.fetchone()
+        users_version = row[0] if row else 0
+        cursor.execute('''
+            SELECT COUNT(*), SUM(version), SUM(message_count), SUM(unread_by_admin)
+            FROM conversation_summary
+        ''')
+        return (users_version,) + tuple(cursor.fetchone())
+    
+    def _missed_calls_stamp(self, cursor, user_id: int) -> tuple:
+        cursor.execute('''
+            SELECT COUNT(*), MAX(id), SUM(seen_by_callee)
+            FROM call_history
+            WHERE callee_id = ? AND call_status = 'missed'
+        ''', (user_id,))
+        return tuple(cursor.fetchone())
+    
+    def get_conversation_stamp(self, user_id: int) -> tuple:
+        """Changes whenever the user's messages or their read state change (primary key lookup)"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
         try:
-            cursor.execute('''
-                UPDATE admin_messages
-                SET is_read = 1
-                WHERE user_id = ? AND sender_type = 'admin' AND is_read = 0
-            ''', (user_id,))
-            conn.commit()
-            return True
+            return self._conversation_stamp(cursor, user_id)
         finally:
             conn.close()
     
-    def mark_user_messages_read_by_admin(self, user_id: int) -> bool:
-        """Mark all user messages as read by admin (when admin views user's conversation)"""
+    def get_admin_list_stamp(self) -> tuple:
+        """Changes whenever any user account or any conversation summary changes"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
         try:
-            cursor.execute('''
-                UPDATE admin_messages
-                SET is_read = 1
-                WHERE user_id = ? AND sender_type = 'user' AND is_read = 0
-            ''', (user_id,))
-            conn.commit()
-            return True
+            return self._admin_list_stamp(cursor)
         finally:
             conn.close()
     
-    def get_unread_count(self, user_id: int, sender_type: str) -> int:
-        """Get count of unread messages"""
+    def get_missed_calls_stamp(self, user_id: int) -> tuple:
+        """Changes when a missed call is added, removed or marked seen (index range on callee_id, call_status)"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('''
-            SELECT COUNT(*)
-            FROM admin_messages
-            WHERE user_id = ? AND sender_type = ? AND is_read = 0
-        ''', (user_id, sender_type))
-        
-        count = cursor.fetchone()[0]
-        conn.close()
-        return count
+        try:
+            return self._missed_calls_stamp(cursor, user_id)
+        finally:
+            conn.close()
     
-    def delete_message(self, message_id: int, user_id: int, role: str) -> bool:
-        """Delete a message"""
+    def get_sync_stamps(self, user_id: int, conversation_id: Optional[int] = None,
+                        is_admin: bool = False, status_user_id: Optional[int] = None) -> Dict[str, Any]:
+        """Every version stamp /api/sync compares, read over one connection
+        - conversation: stamp of conversation_id's messages (omitted when None)
+        - admin_list / missed_calls: only for the administrator
+        - status: user_status row of status_user_id (omitted when None)"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
         try:
-            if role == 'administrator':
-                # Ken Tse can delete any message
-                cursor.execute('DELETE FROM admin_messages WHERE id = ?', (message_id,))
-            else:
-                # Regular user can only delete their own messages
+            stamps = {}
+            if conversation_id is not None:
+                stamps['conversation'] = self._conversation_stamp(cursor, conversation_id)
+            if is_admin:
+                stamps['admin_list'] = self._admin_list_stamp(cursor)
+                stamps['missed_calls'] = self._missed_calls_stamp(cursor, user_id)
+            if status_user_id is not None:
                 cursor.execute('''
-                    DELETE FROM admin_messages
-                    WHERE id = ? AND user_id = ? AND sender_type = 'user'
-                ''', (message_id, user_id))
-            
+                    SELECT status, last_seen, current_call_with FROM user_status WHERE user_id = ?
+                ''', (status_user_id,))
+                row = cursor.fetchone()
+                stamps['status'] = ({'status': row[0], 'last_seen': row[1], 'current_call_with': row[2]} if row
+                                    else {'status': 'offline', 'last_seen': None, 'current_call_with': None})
+            return stamps
+        finally:
+            conn.close()
+    
+    def notify(self, channel: str, payload: str):
+        """pg_notify - delivered to every connection LISTENing on channel (PostgreSQL only)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('SELECT pg_notify(?, ?)', (channel, payload))
             conn.commit()
-            return cursor.rowcount > 0
         finally:
             conn.close()
     
@@ -635,28 +2430,28 @@ class ChatAppDatabase:
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('''
-            SELECT DISTINCT u.id, u.username, u.email,
-                   (SELECT COUNT(*) FROM admin_messages 
-                    WHERE user_id = u.id AND sender_type = 'user' AND is_read = 0) as unread_count,
-                   (SELECT MAX(timestamp) FROM admin_messages WHERE user_id = u.id) as last_message
-            FROM users u
-            INNER JOIN admin_messages am ON u.id = am.user_id
-            WHERE u.is_deleted = 0
-            ORDER BY last_message DESC
-        ''')
-        
-        conversations = []
-        for row in cursor.fetchall():
-            conversations.append({
-                'user_id': row[0],
-                'username': row[1],
-                'email': row[2],
-                'unread_count': row[3],
-                'last_message': row[4]
-            })
-        
-        conn.close()
+        try:
+            cursor.execute('''
+                SELECT u.id, u.username, u.email,
+                       cs.unread_by_admin as unread_count,
+                       cs.last_message_time as last_message
+                FROM conversation_summary cs
+                INNER JOIN users u ON u.id = cs.user_id
+                WHERE u.is_deleted = 0 AND cs.message_count > 0
+                ORDER BY cs.last_message_time DESC
+            ''')
+            
+            conversations = []
+            for row in cursor.fetchall():
+                conversations.append({
+                    'user_id': row[0],
+                    'username': row[1],
+                    'email': row[2],
+                    'unread_count': row[3],
+                    'last_message': row[4]
+                })
+        finally:
+            conn.close()
         return conversations
     
     def get_all_users(self, include_deleted: bool = False) -> List[Dict[str, Any]]:
@@ -664,82 +2459,81 @@ class ChatAppDatabase:
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        where_clause = '' if include_deleted else 'WHERE u.is_deleted = 0'
-        
-        cursor.execute(f'''
-            SELECT u.id, u.username, u.email, u.user_role, u.created_at,
-                   p.first_name, p.last_name, u.is_deleted
-            FROM users u
-            LEFT JOIN user_profiles p ON u.id = p.user_id
-            {where_clause}
-            ORDER BY u.created_at DESC
-        ''')
-        
-        users = []
-        for row in cursor.fetchall():
-            users.append({
-                'id': row[0],
-                'username': row[1],
-                'email': row[2],
-                'role': row[3],
-                'created_at': row[4],
-                'first_name': row[5] or '',
-                'last_name': row[6] or '',
-                'is_deleted': bool(row[7])
-            })
-        
-        conn.close()
+        try:
+            where_clause = '' if include_deleted else 'WHERE u.is_deleted = 0'
+            
+            cursor.execute(f'''
+                SELECT u.id, u.username, u.email, u.user_role, u.created_at,
+                       p.first_name, p.last_name, u.is_deleted
+                FROM users u
+                LEFT JOIN user_profiles p ON u.id = p.user_id
+                {where_clause}
+                ORDER BY u.created_at DESC
+            ''')
+            
+            users = []
+            for row in cursor.fetchall():
+                users.append({
+                    'id': row[0],
+                    'username': row[1],
+                    'email': row[2],
+                    'role': row[3],
+                    'created_at': row[4],
+                    'first_name': row[5] or '',
+                    'last_name': row[6] or '',
+                    'is_deleted': bool(row[7])
+                })
+        finally:
+            conn.close()
         return users
     
     # ============= Admin User Management Methods =============
     
     def soft_delete_user(self, user_id: int) -> bool:
         """Soft delete a user (mark as deleted)"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
+        def write(cursor):
             cursor.execute('''
                 UPDATE users SET is_deleted = 1, updated_at = CURRENT_TIMESTAMP
                 WHERE id = ?
             ''', (user_id,))
-            conn.commit()
-            return cursor.rowcount > 0
-        finally:
-            conn.close()
+            updated = cursor.rowcount
+            self._bump_version(cursor, 'users')
+            return updated > 0
+        
+        return self._write(write)
     
     def restore_user(self, user_id: int) -> bool:
         """Restore a soft-deleted user"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
+        def write(cursor):
             print(f"[Restore User] Restoring user_id: {user_id}")
             cursor.execute('''
                 UPDATE users SET is_deleted = 0, updated_at = CURRENT_TIMESTAMP
                 WHERE id = ?
             ''', (user_id,))
-            conn.commit()
-            print(f"[Restore User] Updated {cursor.rowcount} rows")
-            return cursor.rowcount > 0
+            updated = cursor.rowcount
+            self._bump_version(cursor, 'users')
+            print(f"[Restore User] Updated {updated} rows")
+            return updated > 0
+        
+        try:
+            return self._write(write)
         except Exception as e:
             print(f"[Restore User] ERROR: {e}")
             raise
-        finally:
-            conn.close()
     
     def permanent_delete_user(self, user_id: int) -> bool:
         """Permanently delete a user and all their data"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
+        def write(cursor):
             print(f"[Permanent Delete] Starting delete for user_id: {user_id}")
             
             # Delete in order: messages, profile, user
+            self._release_uploads(cursor, self._user_upload_refs(cursor, user_id))
             cursor.execute('DELETE FROM admin_messages WHERE user_id = ?', (user_id,))
             messages_deleted = cursor.rowcount
+            cursor.execute('DELETE FROM admin_messages_archive WHERE user_id = ?', (user_id,))
+            messages_deleted += cursor.rowcount
             print(f"[Permanent Delete] Deleted {messages_deleted} messages")
+            cursor.execute('DELETE FROM conversation_summary WHERE user_id = ?', (user_id,))
             
             cursor.execute('DELETE FROM user_profiles WHERE user_id = ?', (user_id,))
             profiles_deleted = cursor.rowcount
@@ -748,61 +2542,58 @@ class ChatAppDatabase:
             cursor.execute('DELETE FROM users WHERE id = ?', (user_id,))
             users_deleted = cursor.rowcount
             print(f"[Permanent Delete] Deleted {users_deleted} users")
+            self._bump_version(cursor, 'users')
             
-            conn.commit()
-            print(f"[Permanent Delete] Commit successful, returning {users_deleted > 0}")
+            print(f"[Permanent Delete] Returning {users_deleted > 0}")
             return users_deleted > 0
+        
+        try:
+            return self._write(write)
         except Exception as e:
             print(f"[Permanent Delete] ERROR: {e}")
             raise
-        finally:
-            conn.close()
     
     def bulk_delete_deleted_users(self) -> int:
         """Permanently delete all soft-deleted users"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
+        def write(cursor):
             # Get IDs of deleted users
             cursor.execute('SELECT id FROM users WHERE is_deleted = 1')
             deleted_user_ids = [row[0] for row in cursor.fetchall()]
             
             count = 0
             for user_id in deleted_user_ids:
+                self._release_uploads(cursor, self._user_upload_refs(cursor, user_id))
                 cursor.execute('DELETE FROM admin_messages WHERE user_id = ?', (user_id,))
+                cursor.execute('DELETE FROM admin_messages_archive WHERE user_id = ?', (user_id,))
+                cursor.execute('DELETE FROM conversation_summary WHERE user_id = ?', (user_id,))
                 cursor.execute('DELETE FROM user_profiles WHERE user_id = ?', (user_id,))
                 cursor.execute('DELETE FROM users WHERE id = ?', (user_id,))
                 count += 1
+            if count:
+                self._bump_version(cursor, 'users')
             
-            conn.commit()
             return count
-        finally:
-            conn.close()
+        
+        return self._write(write)
     
     def update_user_role(self, user_id: int, role: str) -> bool:
         """Update user role"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
+        def write(cursor):
             cursor.execute('''
                 UPDATE users SET user_role = ?, updated_at = CURRENT_TIMESTAMP
                 WHERE id = ?
             ''', (role, user_id))
-            conn.commit()
-            return cursor.rowcount > 0
-        finally:
-            conn.close()
+            updated = cursor.rowcount
+            self._bump_version(cursor, 'users')
+            return updated > 0
+        
+        return self._write(write)
     
     # ============= User Status Methods =============
     
     def update_user_status(self, user_id: int, status: str, current_call_with: Optional[int] = None):
         """Update user online/offline/busy status"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
+        def write(cursor):
             cursor.execute('''
                 INSERT INTO user_status (user_id, status, last_seen, current_call_with)
                 VALUES (?, ?, CURRENT_TIMESTAMP, ?)
@@ -811,9 +2602,8 @@ class ChatAppDatabase:
                     last_seen = excluded.last_seen,
                     current_call_with = excluded.current_call_with
             ''', (user_id, status, current_call_with))
-            conn.commit()
-        finally:
-            conn.close()
+        
+        self._write(write)
     
     def get_user_status(self, user_id: int) -> Dict[str, Any]:
         """Get user status"""
@@ -838,45 +2628,58 @@ class ChatAppDatabase:
         finally:
             conn.close()
     
-    def heartbeat(self, user_id: int):
-        """Update last_seen timestamp (called every 10s by client)"""
+    def record_heartbeats(self, last_seen: Dict[int, str]):
+        """Write a batch of heartbeats (user_id -> UTC 'YYYY-MM-DD HH:MM:SS') in one transaction"""
+        def write(cursor):
+            for user_id, seen in last_seen.items():
+                cursor.execute('''
+                    INSERT INTO user_status (user_id, status, last_seen)
+                    VALUES (?, 'online', ?)
+                    ON CONFLICT(user_id) DO UPDATE SET
+                        last_seen = excluded.last_seen
+                ''', (user_id, seen))
+        
+        self._write(write)
+    
+    def get_recently_seen_user_ids(self, since: str) -> set:
+        """User ids whose last_seen is at or after since (UTC 'YYYY-MM-DD HH:MM:SS')"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
         try:
+            cursor.execute('SELECT user_id FROM user_status WHERE last_seen >= ?', (since,))
+            return {row[0] for row in cursor.fetchall()}
+        finally:
+            conn.close()
+    
+    def heartbeat(self, user_id: int):
+        """Update last_seen timestamp (called every 10s by client)"""
+        def write(cursor):
             cursor.execute('''
                 INSERT INTO user_status (user_id, status, last_seen)
                 VALUES (?, 'online', CURRENT_TIMESTAMP)
                 ON CONFLICT(user_id) DO UPDATE SET
                     last_seen = CURRENT_TIMESTAMP
             ''', (user_id,))
-            conn.commit()
-        finally:
-            conn.close()
+        
+        self._write(write)
     
     # ============= Call History Methods =============
     
     def log_call_attempt(self, caller_id: int, callee_id: int) -> int:
         """Log a new call attempt, returns call_id"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
+        def write(cursor):
             cursor.execute('''
-                INSERT INTO call_history (caller_id, callee_id, call_status)
-                VALUES (?, ?, 'ongoing')
+                INSERT INTO call_history (caller_id, callee_id, call_status, call_time)
+                VALUES (?, ?, 'ongoing', CURRENT_TIMESTAMP)
             ''', (caller_id, callee_id))
-            conn.commit()
             return cursor.lastrowid
-        finally:
-            conn.close()
+        
+        return self._write(write)
     
     def update_call_status(self, call_id: int, status: str, duration: Optional[int] = None):
         """Update call status (answered, missed, rejected, dropped)"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
+        def write(cursor):
             if status == 'answered' and duration is None:
                 # Call was just answered
                 cursor.execute('''
@@ -898,10 +2701,8 @@ class ChatAppDatabase:
                     SET call_status = ?, ended_at = CURRENT_TIMESTAMP
                     WHERE id = ?
                 ''', (status, call_id))
-            
-            conn.commit()
-        finally:
-            conn.close()
+        
+        self._write(write)
     
     def get_missed_calls(self, user_id: int) -> List[Dict[str, Any]]:
         """Get all missed calls for a user (admin)"""
@@ -930,18 +2731,14 @@ class ChatAppDatabase:
     
     def mark_missed_call_seen(self, call_id: int):
         """Mark missed call as seen"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
+        def write(cursor):
             cursor.execute('''
                 UPDATE call_history
                 SET seen_by_callee = 1
                 WHERE id = ?
             ''', (call_id,))
-            conn.commit()
-        finally:
-            conn.close()
+        
+        self._write(write)
     
     def get_call_history_for_user(self, user1_id: int, user2_id: int, limit: int = 10) -> List[Dict[str, Any]]:
         """Get call history between two users"""
@@ -968,6 +2765,71 @@ class ChatAppDatabase:
         finally:
             conn.close()
     
+    # ============= Call Signal Methods =============
+    
+    def push_call_signal(self, recipient_id: int, payload: str, expires_ms: int, max_queue: int) -> int:
+        """Queue a signal for a recipient, keeping only their newest max_queue (returns how many were dropped)"""
+        def write(cursor):
+            cursor.execute('''
+                INSERT INTO call_signals (recipient_id, payload, expires_ms)
+                VALUES (?, ?, ?)
+            ''', (recipient_id, payload, expires_ms))
+            cursor.execute('''
+                DELETE FROM call_signals
+                WHERE recipient_id = ? AND id NOT IN (
+                    SELECT id FROM call_signals WHERE recipient_id = ?
+                    ORDER BY id DESC LIMIT ?
+                )
+            ''', (recipient_id, recipient_id, max_queue))
+            return max(cursor.rowcount, 0)
+        
+        return self._write(write)
+    
+    def drain_call_signals(self, recipient_id: int) -> List[tuple]:
+        """Atomically take all queued signals for a recipient, oldest first, as (payload, expires_ms)"""
+        def write(cursor):
+            if self.use_postgres or sqlite3.sqlite_version_info >= (3, 35, 0):
+                cursor.execute('''
+                    DELETE FROM call_signals WHERE recipient_id = ?
+                    RETURNING id, payload, expires_ms
+                ''', (recipient_id,))
+                rows = sorted(cursor.fetchall())
+            else:
+                # Old SQLite without RETURNING - _write holds the write lock, so two workers can't read the same rows
+                cursor.execute('''
+                    SELECT id, payload, expires_ms FROM call_signals
+                    WHERE recipient_id = ? ORDER BY id
+                ''', (recipient_id,))
+                rows = cursor.fetchall()
+                if rows:
+                    cursor.execute('''
+                        DELETE FROM call_signals WHERE recipient_id = ? AND id <= ?
+                    ''', (recipient_id, rows[-1][0]))
+            return [(row[1], row[2]) for row in rows]
+        
+        return self._write(write)
+    
+    def purge_expired_call_signals(self, now_ms: int) -> int:
+        """Delete signals nobody collected before they expired"""
+        def write(cursor):
+            cursor.execute('DELETE FROM call_signals WHERE expires_ms <= ?', (now_ms,))
+            return cursor.rowcount
+        
+        return self._write(write)
+    
+    def get_call_signal_counts(self) -> Dict[int, int]:
+        """Queued signal count per recipient (for debugging)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('''
+                SELECT recipient_id, COUNT(*) FROM call_signals GROUP BY recipient_id
+            ''')
+            return {row[0]: row[1] for row in cursor.fetchall()}
+        finally:
+            conn.close()
+    
     # ============= Restoration Request Methods =============
     
     def check_deleted_user(self, username: str) -> Optional[Dict[str, Any]]:
@@ -996,18 +2858,14 @@ class ChatAppDatabase:
     
     def submit_restoration_request(self, username: str, email: str, message: str) -> int:
         """Submit a restoration request for a deleted account"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
+        def write(cursor):
             cursor.execute('''
                 INSERT INTO restoration_requests (username, email, message)
                 VALUES (?, ?, ?)
             ''', (username, email, message))
-            conn.commit()
             return cursor.lastrowid
-        finally:
-            conn.close()
+        
+        return self._write(write)
     
     def get_restoration_requests(self, status: Optional[str] = None) -> List[Dict[str, Any]]:
         """Get restoration requests, optionally filtered by status"""
@@ -1051,10 +2909,7 @@ class ChatAppDatabase:
     
     def approve_restoration_request(self, request_id: int, admin_id: int) -> bool:
         """Approve restoration request and restore the user"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
+        def write(cursor):
             # Get request details
             cursor.execute('''
                 SELECT username FROM restoration_requests WHERE id = ? AND status = 'pending'
@@ -1070,6 +2925,7 @@ class ChatAppDatabase:
             cursor.execute('''
                 UPDATE users SET is_deleted = 0 WHERE username = ?
             ''', (username,))
+            self._bump_version(cursor, 'users')
             
             # Mark request as approved
             cursor.execute('''
@@ -1078,23 +2934,18 @@ class ChatAppDatabase:
                 WHERE id = ?
             ''', (admin_id, request_id))
             
-            conn.commit()
             return True
-        finally:
-            conn.close()
+        
+        return self._write(write)
     
     def deny_restoration_request(self, request_id: int, admin_id: int) -> bool:
         """Deny restoration request"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
+        def write(cursor):
             cursor.execute('''
                 UPDATE restoration_requests
                 SET status = 'denied', reviewed_at = CURRENT_TIMESTAMP, reviewed_by = ?
                 WHERE id = ? AND status = 'pending'
             ''', (admin_id, request_id))
-            conn.commit()
             return cursor.rowcount > 0
-        finally:
-            conn.close()
+        
+        return self._write(write)
@@ -0,0 +1,175 @@
+"""
+ChatApp Logging - level-gated, structured logging that never blocks a request
+Loggers live under 'chatapp.' (get_logger('signals') -> 'chatapp.signals'). Records below
+LOG_LEVEL are dropped by the level check before any formatting - call with %-style arguments
+(log.debug('signal from %s', user_id)), not f-strings, so a silenced line costs one comparison.
+
+Enabled records go onto a bounded queue; a listener thread per process formats them
+(JSON lines by default) and writes them to stdout. When the queue is full, records are
+dropped and counted instead of making the request wait.
+
+Polling endpoints log through SampledLogger, which lets through one call in LOG_POLL_SAMPLE.
+
+Server access logs (werkzeug, uvicorn, gunicorn) print each request's path with its query
+string; RedactQueryFilter masks credentials there (?ticket= for the signal stream).
+"""
+
+import atexit
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import sys
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Any
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()  # DEBUG shows per-signal / sampled polling lines
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')  # 'json' (one object per line) or 'text'
+LOG_POLL_SAMPLE = int(os.getenv('LOG_POLL_SAMPLE', '100'))  # Polling endpoints log 1 in this many calls at DEBUG
+LOG_QUEUE_MAX = 10000  # Records waiting for the writer thread; more are dropped
+ACCESS_LOGGERS = ('werkzeug', 'uvicorn.access', 'gunicorn.access')  # Loggers that print request URLs
+SECRET_QUERY_PARAMS = ('token', 'ticket')  # Query parameters masked in those lines
+
+# LogRecord attributes that aren't user-supplied `extra` fields
+_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg, pid plus any extra={...} fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'pid': record.process,
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_FIELDS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class RedactQueryFilter(logging.Filter):
+    """Replace the values of SECRET_QUERY_PARAMS in a record's message and string arguments"""
+
+    def __init__(self, params=SECRET_QUERY_PARAMS):
+        super().__init__()
+        names = '|'.join(re.escape(param) for param in params)
+        self._pattern = re.compile(rf'([?&](?:{names})=)[^&\s"\']*')
+
+    def redact(self, value):
+        return self._pattern.sub(r'\1[redacted]', value) if isinstance(value, str) else value
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.msg = self.redact(record.msg)
+        if isinstance(record.args, tuple):
+            record.args = tuple(self.redact(arg) for arg in record.args)
+        elif isinstance(record.args, dict):
+            record.args = {key: self.redact(value) for key, value in record.args.items()}
+        return True
+
+
+class QueueLogHandler(logging.handlers.QueueHandler):
+    """Hands records to a per-process writer thread (started lazily - gunicorn forks after import)"""
+
+    def __init__(self, target: logging.Handler, maxsize: int = LOG_QUEUE_MAX):
+        super().__init__(None)
+        self.target = target
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._pid = None
+        self._listener_lock = threading.Lock()
+        self.listener = None
+
+    def _ensure_listener(self):
+        if self._pid == os.getpid():
+            return
+        with self._listener_lock:
+            if self._pid == os.getpid():
+                return
+            # A forked child gets a fresh queue: the parent's writer thread didn't survive the fork
+            self.queue = queue.Queue(self.maxsize)
+            self.listener = logging.handlers.QueueListener(self.queue, self.target)
+            self.listener.start()
+            atexit.register(self.listener.stop)  # Write what's queued on a clean exit
+            self._pid = os.getpid()
+
+    def emit(self, record: logging.LogRecord):
+        self._ensure_listener()
+        super().emit(record)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Merge the arguments now (they may change later); leave the JSON encoding to the writer"""
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {'queued': self.queue.qsize() if self.queue is not None else 0, 'dropped': self.dropped}
+
+
+class SampledLogger:
+    """DEBUG lines for polling endpoints: 1 call in `every` is logged (tagged with sampled=every)"""
+
+    def __init__(self, logger: logging.Logger, every: int = LOG_POLL_SAMPLE):
+        self.logger = logger
+        self.every = max(1, every)
+        self._calls = itertools.count()
+
+    def debug(self, msg: str, *args):
+        if self.logger.isEnabledFor(logging.DEBUG) and next(self._calls) % self.every == 0:
+            self.logger.debug(msg, *args, extra={'sampled': self.every})
+
+
+_handler = None
+
+
+def configure_logging(level: str = LOG_LEVEL, log_format: str = LOG_FORMAT) -> QueueLogHandler:
+    """Attach the queue handler to the 'chatapp' logger (once per process; later calls return it)"""
+    global _handler
+    if _handler is not None:
+        return _handler
+    stream = logging.StreamHandler(sys.stdout)
+    if log_format == 'json':
+        stream.setFormatter(JsonFormatter())
+    elif log_format == 'text':
+        stream.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    else:
+        raise ValueError(f"Unknown LOG_FORMAT '{log_format}' (expected 'json' or 'text')")
+    _handler = QueueLogHandler(stream)
+    redact = RedactQueryFilter()
+    for name in ACCESS_LOGGERS:
+        logging.getLogger(name).addFilter(redact)
+    logger = logging.getLogger('chatapp')
+    logger.setLevel(level)
+    logger.addHandler(_handler)
+    logger.propagate = False
+    return _handler
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f'chatapp.{name}')
+
+
+def logging_stats() -> Dict[str, Any]:
+    """Writer queue depth and dropped records for this process"""
+    if _handler is None:
+        return {'configured': False}
+    return dict(_handler.stats(), configured=True, level=logging.getLevelName(logging.getLogger('chatapp').level))
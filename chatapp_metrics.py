@@ -0,0 +1,213 @@
+"""
+ChatApp Metrics - per-route request timing, exported at /metrics in Prometheus text format
+Every request records its route, status, latency, response size, CPU time and the SQL
+statements it ran (counted by chatapp_database.query_stats). Each worker process keeps its
+numbers in memory and writes them to METRICS_DIR/<pid>.json every METRICS_FLUSH_INTERVAL
+seconds; /metrics adds up the files of every live worker, so any worker can answer a scrape.
+
+Files not rewritten for METRICS_STALE_SECONDS belong to workers that are gone and are deleted,
+which Prometheus sees as a counter reset (rate() handles those).
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, Any, List, Tuple
+
+METRICS_DIR = os.getenv('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'chatapp_metrics'))  # Shared by the workers on one host
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '5'))  # Seconds between writes of this worker's file
+METRICS_STALE_SECONDS = max(60.0, METRICS_FLUSH_INTERVAL * 10)  # A worker file this old is from a dead process
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100)
+
+# name -> (help, buckets); observed once per request, labelled by method and route
+HISTOGRAMS = {
+    'chatapp_http_request_duration_seconds': ('Time to produce the response (long polls include their wait)', LATENCY_BUCKETS),
+    'chatapp_http_response_size_bytes': ('Response body size (0 when streamed)', SIZE_BUCKETS),
+    'chatapp_http_request_db_queries': ('SQL statements executed per request', QUERY_BUCKETS),
+    'chatapp_http_request_db_seconds': ('Time spent in SQL statements per request', LATENCY_BUCKETS),
+}
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels) -> str:
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _bucket_index(buckets: Tuple[float, ...], value: float) -> int:
+    for i, bound in enumerate(buckets):
+        if value <= bound:
+            return i
+    return len(buckets)  # +Inf
+
+
+class RequestMetrics:
+    """Per-process request counters and histograms, merged across workers through METRICS_DIR"""
+
+    def __init__(self, directory: str = METRICS_DIR, flush_interval: float = METRICS_FLUSH_INTERVAL):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pid = None
+        self._requests = {}  # (method, route, status) -> count
+        self._cpu = {}  # (method, route) -> CPU seconds
+        self._histograms = {}  # (name, method, route) -> [count per bucket (+Inf last), sum]
+        self._in_progress = 0
+
+    def _ensure_flusher(self):
+        """Start this process's flush thread (lazily - gunicorn forks after import)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                # Forked: the parent's numbers are already in its own file
+                self._requests, self._cpu, self._histograms, self._in_progress = {}, {}, {}, 0
+            self._pid = os.getpid()
+        os.makedirs(self.directory, exist_ok=True)
+        threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True).start()
+
+    def started(self):
+        """A request began (requests_in_progress)"""
+        self._ensure_flusher()
+        with self._lock:
+            self._in_progress += 1
+
+    def finished(self):
+        with self._lock:
+            self._in_progress -= 1
+
+    def observe(self, method: str, route: str, status: int, seconds: float, size: int,
+                db_queries: int, db_seconds: float, cpu_seconds: float = None):
+        """Record one finished request"""
+        self._ensure_flusher()
+        values = (
+            ('chatapp_http_request_duration_seconds', seconds),
+            ('chatapp_http_response_size_bytes', size),
+            ('chatapp_http_request_db_queries', db_queries),
+            ('chatapp_http_request_db_seconds', db_seconds),
+        )
+        with self._lock:
+            key = (method, route, str(status))
+            self._requests[key] = self._requests.get(key, 0) + 1
+            if cpu_seconds is not None:
+                self._cpu[(method, route)] = self._cpu.get((method, route), 0.0) + cpu_seconds
+            for name, value in values:
+                buckets = HISTOGRAMS[name][1]
+                histogram = self._histograms.get((name, method, route))
+                if histogram is None:
+                    histogram = self._histograms[(name, method, route)] = [0] * (len(buckets) + 1) + [0.0]
+                histogram[_bucket_index(buckets, value)] += 1
+                histogram[-1] += value
+
+    # ============= Worker Files =============
+
+    def _snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'requests': [list(key) + [count] for key, count in self._requests.items()],
+                'cpu': [list(key) + [seconds] for key, seconds in self._cpu.items()],
+                'histograms': [list(key) + [list(values)] for key, values in self._histograms.items()],
+                'in_progress': self._in_progress,
+            }
+
+    def _path(self, pid: int) -> str:
+        return os.path.join(self.directory, f'{pid}.json')
+
+    def flush(self):
+        """Write this worker's numbers (atomically - readers never see half a file)"""
+        path = self._path(os.getpid())
+        partial = f'{path}.tmp'
+        with open(partial, 'w') as f:
+            json.dump(self._snapshot(), f)
+        os.replace(partial, path)
+
+    def _flush_loop(self):
+        while True:
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"❌ [Metrics] Could not write {self._path(os.getpid())}: {e}")
+            time.sleep(self.flush_interval)
+
+    def _worker_snapshots(self) -> List[Dict[str, Any]]:
+        """This worker's live numbers plus the latest file of every other live worker"""
+        snapshots = [self._snapshot()]
+        own = f'{os.getpid()}.json'
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return snapshots
+        now = time.time()
+        for name in names:
+            if not name.endswith('.json') or name == own:
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if now - os.path.getmtime(path) > METRICS_STALE_SECONDS:
+                    os.unlink(path)  # Worker exited (or a previous run)
+                    continue
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue  # Removed or replaced while we looked
+        return snapshots
+
+    # ============= Exposition =============
+
+    def render(self) -> str:
+        """All workers' metrics in the Prometheus text exposition format (version 0.0.4)"""
+        requests, cpu, histograms, in_progress = {}, {}, {}, 0
+        snapshots = self._worker_snapshots()
+        for snapshot in snapshots:
+            for method, route, status, count in snapshot['requests']:
+                requests[(method, route, status)] = requests.get((method, route, status), 0) + count
+            for method, route, seconds in snapshot['cpu']:
+                cpu[(method, route)] = cpu.get((method, route), 0.0) + seconds
+            for name, method, route, values in snapshot['histograms']:
+                merged = histograms.get((name, method, route))
+                if merged is None:
+                    histograms[(name, method, route)] = list(values)
+                else:
+                    histograms[(name, method, route)] = [a + b for a, b in zip(merged, values)]
+            in_progress += snapshot['in_progress']
+
+        lines = [
+            '# HELP chatapp_http_requests_total Requests handled, by route and status',
+            '# TYPE chatapp_http_requests_total counter',
+        ]
+        for (method, route, status), count in sorted(requests.items()):
+            lines.append(f'chatapp_http_requests_total{_labels(method=method, route=route, status=status)} {count}')
+        lines += [
+            '# HELP chatapp_http_request_cpu_seconds_total CPU time of the thread handling the request (Flask routes)',
+            '# TYPE chatapp_http_request_cpu_seconds_total counter',
+        ]
+        for (method, route), seconds in sorted(cpu.items()):
+            lines.append(f'chatapp_http_request_cpu_seconds_total{_labels(method=method, route=route)} {seconds:.6f}')
+        for name, (help_text, buckets) in HISTOGRAMS.items():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+            for (metric, method, route), values in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + ('+Inf',), values[:-1]):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_labels(method=method, route=route, le=bound)} {cumulative}')
+                lines.append(f'{name}_sum{_labels(method=method, route=route)} {values[-1]:.6f}')
+                lines.append(f'{name}_count{_labels(method=method, route=route)} {cumulative}')
+        lines += [
+            '# HELP chatapp_http_requests_in_progress Requests being handled (long polls included)',
+            '# TYPE chatapp_http_requests_in_progress gauge',
+            f'chatapp_http_requests_in_progress {in_progress}',
+            '# HELP chatapp_metrics_workers Worker processes reporting',
+            '# TYPE chatapp_metrics_workers gauge',
+            f'chatapp_metrics_workers {len(snapshots)}',
+        ]
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,273 @@
+"""
+ChatApp Notify - wakes long-polling requests when a conversation changes
+Writers publish keys ('conversation:<user_id>', 'conversations'); /api/messages?wait= and
+/api/sync park on the keys they care about and return as soon as one is published, in
+this process or any other gunicorn worker.
+
+Backends:
+    postgres - pg_notify on publish; one LISTEN connection per worker process wakes its waiters
+    file     - keys appended to a small file next to the SQLite database; each worker
+               tails it (SQLite's stand-in for LISTEN/NOTIFY - workers share one host)
+    memory   - in-process only (single worker)
+
+Threads block in wait(); coroutines (chatapp_asgi) await wait_async(), which parks on an
+asyncio future instead of a thread, so idle connections cost no thread each.
+"""
+
+import asyncio
+import os
+import select
+import threading
+import time
+from typing import Dict, Any, Iterable, Tuple
+
+NOTIFY_BACKEND = os.getenv('NOTIFY_BACKEND', 'auto')  # 'auto' (postgres, else file), 'postgres', 'file' or 'memory'
+NOTIFY_CHANNEL = 'chatapp_changes'  # PostgreSQL LISTEN/NOTIFY channel
+NOTIFY_FILE_POLL_INTERVAL = float(os.getenv('NOTIFY_FILE_POLL_INTERVAL', '0.1'))  # Seconds between checks of the notify file
+NOTIFY_FILE_MAX = 1024 * 1024  # The notify file is truncated once it grows past this many bytes
+NOTIFY_RECONNECT_DELAY = 5  # Seconds before a failed LISTEN connection is retried
+
+
+def conversation_keys(user_id: int) -> Tuple[str, str]:
+    """Keys published when a user's conversation changes (the admin list listens to the second)"""
+    return (f'conversation:{user_id}', 'conversations')
+
+
+def _resolve(future: asyncio.Future):
+    """Runs on the waiter's event loop"""
+    if not future.done():
+        future.set_result(True)
+
+
+class ChangeNotifier:
+    """Per-key sequence numbers plus a condition waiters park on (in-process wakeups)"""
+
+    backend = 'memory'
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._seq = {}  # key -> times published
+        self._epoch = 0  # Bumped when every waiter must re-check (missed notifications)
+        self._waiting = 0
+        self._async_waiters = {}  # key -> {(loop, future)} for wait_async
+        self._stats = {'published': 0, 'wakeups': 0, 'timeouts': 0}
+
+    def publish(self, keys: Iterable[str]):
+        """Wake everyone waiting on any of keys"""
+        self._count_publish()
+        self._wake(keys)
+
+    def _wake(self, keys: Iterable[str]):
+        with self._cond:
+            for key in keys:
+                self._seq[key] = self._seq.get(key, 0) + 1
+                for loop, future in self._async_waiters.get(key, ()):
+                    loop.call_soon_threadsafe(_resolve, future)
+            self._cond.notify_all()
+
+    def _count_publish(self):
+        with self._cond:
+            self._stats['published'] += 1
+
+    def _wake_all(self):
+        with self._cond:
+            self._epoch += 1
+            for waiters in self._async_waiters.values():
+                for loop, future in waiters:
+                    loop.call_soon_threadsafe(_resolve, future)
+            self._cond.notify_all()
+
+    def _version(self, keys: Tuple[str, ...]) -> tuple:
+        return (self._epoch,) + tuple(self._seq.get(key, 0) for key in keys)
+
+    def snapshot(self, keys: Iterable[str]) -> tuple:
+        """Take before checking for changes; wait() returns at once if a key was published since"""
+        self._ensure_listener()
+        with self._cond:
+            return self._version(tuple(keys))
+
+    def wait(self, keys: Iterable[str], since: tuple, timeout: float) -> bool:
+        """Block until one of keys is published after snapshot `since`, or timeout; True if woken"""
+        keys = tuple(keys)
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._waiting += 1
+            try:
+                while self._version(keys) == since:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        return False
+                    self._cond.wait(remaining)
+                self._stats['wakeups'] += 1
+                return True
+            finally:
+                self._waiting -= 1
+
+    async def wait_async(self, keys: Iterable[str], since: tuple, timeout: float) -> bool:
+        """wait() for coroutines: awaits a future the publishing thread resolves; True if woken"""
+        keys = tuple(keys)
+        loop = asyncio.get_running_loop()
+        waiter = (loop, loop.create_future())
+        with self._cond:
+            if self._version(keys) != since:
+                self._stats['wakeups'] += 1
+                return True
+            for key in keys:
+                self._async_waiters.setdefault(key, set()).add(waiter)
+            self._waiting += 1
+        try:
+            await asyncio.wait_for(waiter[1], timeout)
+            woken = True
+        except asyncio.TimeoutError:
+            woken = False
+        finally:
+            with self._cond:
+                self._waiting -= 1
+                for key in keys:
+                    waiters = self._async_waiters.get(key)
+                    if waiters is not None:
+                        waiters.discard(waiter)
+                        if not waiters:
+                            del self._async_waiters[key]
+        with self._cond:
+            self._stats['wakeups' if woken else 'timeouts'] += 1
+        return woken
+
+    def _ensure_listener(self):
+        """Cross-process backends start their listener here"""
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return dict(self._stats, backend=self.backend, waiting=self._waiting)
+
+
+class _ListeningNotifier(ChangeNotifier):
+    """Runs one listener thread per process (started lazily - gunicorn forks after import)"""
+
+    def __init__(self):
+        super().__init__()
+        self._listener_pid = None
+
+    def _ensure_listener(self):
+        if self._listener_pid == os.getpid():
+            return
+        with self._cond:
+            if self._listener_pid == os.getpid():
+                return
+            self._listener_pid = os.getpid()
+            start = self._listen_from()
+        threading.Thread(target=self._listen, args=(start,), name=f'{self.backend}-notify', daemon=True).start()
+
+    def _listen_from(self):
+        """Taken before the first snapshot() returns, so the listener misses nothing published after it"""
+        return None
+
+    def _listen(self, start):
+        raise NotImplementedError
+
+
+class PostgresChangeNotifier(_ListeningNotifier):
+    """pg_notify on publish (delivered to every worker, this one included); LISTEN per process"""
+
+    backend = 'postgres'
+
+    def __init__(self, db):
+        super().__init__()
+        self.db = db
+
+    def publish(self, keys):
+        keys = tuple(keys)
+        self._count_publish()
+        self._wake(keys)  # Local waiters don't need the round trip
+        try:
+            self.db.notify(NOTIFY_CHANNEL, ','.join(keys))
+        except Exception as e:
+            print(f"❌ [Notify] pg_notify failed: {e}")
+
+    def _listen(self, start):
+        import psycopg2
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(self.db.db_url)
+                conn.autocommit = True
+                conn.cursor().execute(f'LISTEN {NOTIFY_CHANNEL}')
+                self._wake_all()  # Anything published while we weren't listening
+                while True:
+                    select.select([conn], [], [], 60)
+                    conn.poll()  # Raises if the connection dropped
+                    while conn.notifies:
+                        self._wake(conn.notifies.pop(0).payload.split(','))
+            except Exception as e:
+                print(f"❌ [Notify] LISTEN connection failed: {e}")
+                time.sleep(NOTIFY_RECONNECT_DELAY)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+
+class FileChangeNotifier(_ListeningNotifier):
+    """Keys appended (one line per publish) to a file every worker tails"""
+
+    backend = 'file'
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = str(path)
+
+    def publish(self, keys):
+        keys = tuple(keys)
+        self._count_publish()
+        self._wake(keys)
+        line = (','.join(keys) + '\n').encode('utf-8')
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)  # O_APPEND: small writes from several workers don't interleave
+            if os.fstat(fd).st_size > NOTIFY_FILE_MAX:
+                os.truncate(self.path, 0)  # Readers see the file shrink and re-check everything
+        finally:
+            os.close(fd)
+
+    def _listen_from(self):
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def _listen(self, offset):
+        while True:
+            time.sleep(NOTIFY_FILE_POLL_INTERVAL)
+            try:
+                size = os.path.getsize(self.path)
+            except FileNotFoundError:
+                continue
+            if size == offset:
+                continue
+            if size < offset:
+                offset = 0
+                self._wake_all()
+                continue
+            with open(self.path, 'rb') as f:
+                f.seek(offset)
+                data = f.read(size - offset)
+            complete = data.rfind(b'\n') + 1  # Leave a half-written line for next time
+            offset += complete
+            keys = set()
+            for line in data[:complete].decode('utf-8', 'replace').splitlines():
+                keys.update(line.split(','))
+            if keys:
+                self._wake(keys)
+
+
+def create_change_notifier(db, backend: str = NOTIFY_BACKEND) -> ChangeNotifier:
+    """Build the configured notifier (NOTIFY_BACKEND=auto|postgres|file|memory)"""
+    if backend == 'auto':
+        backend = 'postgres' if db.use_postgres else 'file'
+    if backend == 'postgres':
+        return PostgresChangeNotifier(db)
+    if backend == 'file':
+        return FileChangeNotifier(f'{db.db_path}.notify')
+    if backend != 'memory':
+        raise ValueError(f"Unknown NOTIFY_BACKEND '{backend}' (expected 'auto', 'postgres', 'file' or 'memory')")
+    return ChangeNotifier()
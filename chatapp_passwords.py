@@ -0,0 +1,155 @@
+"""
+ChatApp Passwords - bcrypt hashing off the request thread
+bcrypt costs tens to hundreds of ms of CPU per call. Hashes and checks run in a small
+worker pool; when PASSWORD_HASH_MAX_PENDING jobs are already queued, new ones are
+rejected with PasswordHasherBusy (the API answers 429) instead of stalling every worker thread.
+"""
+
+import os
+import threading
+import time
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Any
+
+import bcrypt
+
+PASSWORD_HASH_EXECUTOR = os.getenv('PASSWORD_HASH_EXECUTOR', 'process')  # 'process', 'thread' or 'inline'
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', '2'))  # Pool size per gunicorn worker
+PASSWORD_HASH_MAX_PENDING = int(os.getenv('PASSWORD_HASH_MAX_PENDING', '16'))  # Queued + running jobs before 429
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', '12'))  # Cost factor; older hashes are upgraded at next login
+PASSWORD_HASH_RETRY_AFTER = 2  # Seconds suggested to clients that get a 429
+
+
+class PasswordHasherBusy(Exception):
+    """Too many password hashes already queued"""
+
+
+# Module-level so they can be sent to worker processes
+
+def _hash_password(password: bytes, rounds: int) -> bytes:
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def _check_password(password: bytes, password_hash: bytes) -> bool:
+    return bcrypt.checkpw(password, password_hash)
+
+
+def _pool_context():
+    """Never fork next to other threads (request handlers, listeners): the child could inherit a
+    lock one of them held. Single-threaded callers (scripts) fork; everything else gets forkserver
+    (spawn where unavailable). The fork server preloads only this module, not __main__.
+
+    forkserver/spawn children still re-run a script __main__ (not gunicorn's or uvicorn's, which
+    are guarded); chatapp_simple.py's development launcher removes its __file__ for that reason."""
+    methods = multiprocessing.get_all_start_methods()
+    if threading.active_count() == 1 and 'fork' in methods:
+        return multiprocessing.get_context('fork')
+    if 'forkserver' not in methods:
+        return multiprocessing.get_context('spawn')
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload([__name__])
+    return context
+
+
+def hash_rounds(password_hash: str) -> int:
+    """Cost factor of a '$2b$12$...' hash (0 if it can't be read)"""
+    try:
+        return int(password_hash.split('$')[2])
+    except (IndexError, ValueError):
+        return 0
+
+
+class PasswordHasher:
+    """Bounded bcrypt worker pool with latency metrics"""
+
+    def __init__(self, executor: str = PASSWORD_HASH_EXECUTOR, workers: int = PASSWORD_HASH_WORKERS,
+                 max_pending: int = PASSWORD_HASH_MAX_PENDING, rounds: int = BCRYPT_ROUNDS):
+        if executor not in ('process', 'thread', 'inline'):
+            raise ValueError(f"Unknown PASSWORD_HASH_EXECUTOR '{executor}' (expected 'process', 'thread' or 'inline')")
+        self.executor = executor
+        self.workers = max(workers, 1)
+        self.max_pending = max_pending
+        self.rounds = rounds
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pool_pid = None
+        self._pending = 0
+        self._latency = {'hash': deque(maxlen=200), 'check': deque(maxlen=200)}  # Recent durations in ms
+        self._stats = {'hash': 0, 'check': 0, 'rejected': 0, 'rehashed': 0, 'pool_restarts': 0}
+
+    def hash(self, password: str) -> str:
+        """bcrypt hash of password at the configured cost"""
+        return self._run('hash', _hash_password, password.encode('utf-8'), self.rounds).decode('utf-8')
+
+    def check(self, password: str, password_hash: str) -> bool:
+        return self._run('check', _check_password, password.encode('utf-8'), password_hash.encode('utf-8'))
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        """True when the hash was made with a different cost factor than BCRYPT_ROUNDS"""
+        return hash_rounds(password_hash) != self.rounds
+
+    def record_rehash(self):
+        with self._lock:
+            self._stats['rehashed'] += 1
+
+    def _get_pool(self):
+        # A pool inherited across fork (gunicorn preload) has no live workers - start a new one
+        if self._pool is None or self._pool_pid != os.getpid():
+            if self.executor == 'process':
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=_pool_context())
+            else:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='bcrypt')
+            self._pool_pid = os.getpid()
+        return self._pool
+
+    def _run(self, op: str, func, *args):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._stats['rejected'] += 1
+                raise PasswordHasherBusy(f"{self._pending} password hashes already pending")
+            self._pending += 1
+            pool = None if self.executor == 'inline' else self._get_pool()
+        start = time.perf_counter()
+        try:
+            if pool is None:
+                result = func(*args)
+            else:
+                try:
+                    result = pool.submit(func, *args).result()
+                except BrokenProcessPool:
+                    # A worker process died (OOM kill etc.) - replace the pool and retry once
+                    with self._lock:
+                        if self._pool is pool:
+                            self._pool = None
+                            self._stats['pool_restarts'] += 1
+                        pool = self._get_pool()
+                    result = pool.submit(func, *args).result()
+            return result
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            with self._lock:
+                self._pending -= 1
+                self._stats[op] += 1
+                self._latency[op].append(elapsed_ms)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            latency = {op: self._summarize(samples) for op, samples in self._latency.items()}
+            return dict(self._stats, pending=self._pending, max_pending=self.max_pending,
+                        executor=self.executor, workers=self.workers, rounds=self.rounds, latency_ms=latency)
+
+    @staticmethod
+    def _summarize(samples) -> Dict[str, Any]:
+        if not samples:
+            return {'count': 0}
+        ordered = sorted(samples)
+        return {
+            'count': len(ordered),
+            'avg': round(sum(ordered) / len(ordered), 1),
+            'p50': round(ordered[len(ordered) // 2], 1),
+            'p95': round(ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)], 1),
+            'max': round(ordered[-1], 1)
+        }
@@ -0,0 +1,126 @@
+"""
+ChatApp Presence - in-memory online/offline tracking
+Heartbeats only touch a dict; a background thread writes them to user_status in one
+batched transaction every PRESENCE_FLUSH_INTERVAL seconds. Other gunicorn workers' users
+are picked up from user_status (refreshed at most once per flush interval).
+"""
+
+import os
+import atexit
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Any, Optional, Set
+
+PRESENCE_FLUSH_INTERVAL = float(os.getenv('PRESENCE_FLUSH_INTERVAL', '5'))  # Seconds between batched user_status writes
+PRESENCE_ONLINE_WINDOW = float(os.getenv('PRESENCE_ONLINE_WINDOW', '15'))  # Online if seen this recently (client heartbeat is every 10s)
+
+
+def format_timestamp(epoch: float) -> str:
+    """Same UTC 'YYYY-MM-DD HH:MM:SS' format that CURRENT_TIMESTAMP stores"""
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class PresenceService:
+    """Tracks last-seen per user in memory and flushes to the database in batches"""
+
+    def __init__(self, db, flush_interval: float = PRESENCE_FLUSH_INTERVAL,
+                 online_window: float = PRESENCE_ONLINE_WINDOW):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.online_window = online_window
+        self._lock = threading.Lock()
+        self._last_seen = {}  # user_id -> epoch seconds, heartbeats received by this worker
+        self._dirty = {}  # user_id -> epoch seconds, not yet written to user_status
+        self._shared_online = set()  # online according to user_status (all workers)
+        self._shared_refreshed = 0.0
+        self._flusher_pid = None
+        self._stats = {'heartbeats': 0, 'flushes': 0, 'rows_flushed': 0, 'flush_errors': 0, 'shared_refreshes': 0}
+
+    def touch(self, user_id: int):
+        """Record a heartbeat - O(1), no database access"""
+        now = time.time()
+        with self._lock:
+            self._last_seen[user_id] = now
+            self._dirty[user_id] = now
+            self._stats['heartbeats'] += 1
+        self._ensure_flusher()
+
+    def last_seen(self, user_id: int) -> Optional[float]:
+        with self._lock:
+            return self._last_seen.get(user_id)
+
+    def is_online(self, user_id: int) -> bool:
+        """O(1) check against this worker's heartbeats, then the shared snapshot"""
+        seen = self.last_seen(user_id)
+        if seen is not None and time.time() - seen < self.online_window:
+            return True
+        return user_id in self._shared_online_set()
+
+    def online_set(self) -> Set[int]:
+        """Every user currently online, across all workers"""
+        cutoff = time.time() - self.online_window
+        with self._lock:
+            local = {user_id for user_id, seen in self._last_seen.items() if seen >= cutoff}
+        return local | self._shared_online_set()
+
+    def _shared_online_set(self) -> Set[int]:
+        now = time.time()
+        with self._lock:
+            if now - self._shared_refreshed < self.flush_interval:
+                return self._shared_online
+            self._shared_refreshed = now  # Only one thread refreshes per interval
+        online = self.db.get_recently_seen_user_ids(format_timestamp(now - self.online_window))
+        with self._lock:
+            self._shared_online = online
+            self._stats['shared_refreshes'] += 1
+        return online
+
+    def flush(self):
+        """Write pending heartbeats to user_status in one transaction"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+        if not dirty:
+            return
+        try:
+            self.db.record_heartbeats({user_id: format_timestamp(seen) for user_id, seen in dirty.items()})
+            with self._lock:
+                self._stats['flushes'] += 1
+                self._stats['rows_flushed'] += len(dirty)
+        except Exception as e:
+            print(f"⚠️  [Presence] Flush failed, will retry: {e}")
+            with self._lock:
+                self._stats['flush_errors'] += 1
+                for user_id, seen in dirty.items():
+                    # Keep any newer heartbeat that arrived meanwhile
+                    if self._dirty.get(user_id, 0) < seen:
+                        self._dirty[user_id] = seen
+
+    def _prune(self):
+        """Forget users not seen for a long time so the dict stays small"""
+        cutoff = time.time() - self.online_window * 10
+        with self._lock:
+            for user_id in [u for u, seen in self._last_seen.items() if seen < cutoff]:
+                del self._last_seen[user_id]
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+            self._prune()
+
+    def _ensure_flusher(self):
+        """Start the flush thread lazily, once per process (gunicorn forks after import)"""
+        if self._flusher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+        threading.Thread(target=self._run, name='presence-flush', daemon=True).start()
+        atexit.register(self.flush)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats, tracked=len(self._last_seen), pending=len(self._dirty),
+                        flush_interval=self.flush_interval, online_window=self.online_window)
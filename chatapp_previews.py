@@ -0,0 +1,159 @@
+"""
+ChatApp Previews - thumbnails and video poster frames for uploaded files
+A small worker pool (started alongside the app) turns each newly stored image blob into a
+downscaled <sha256>.thumb.jpg and each video into a <sha256>.poster.jpg beside it in uploads/.
+Uploads only queue the work, so generation never delays the upload response; get_messages
+returns the preview URL once it exists and clients fetch kilobytes instead of the original.
+
+Previews need local tooling: Pillow for images, ffmpeg (on PATH) for videos. Without them
+the blobs are marked as having no preview and the app behaves as before.
+"""
+
+import os
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Any, Optional
+
+try:
+    from PIL import Image, ImageOps
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+    print("⚠️ Pillow not installed - image thumbnails disabled")
+
+FFMPEG = shutil.which('ffmpeg')
+
+PREVIEW_WORKERS = int(os.getenv('PREVIEW_WORKERS', '2'))  # Generator threads per process (0 disables previews)
+PREVIEW_MAX_SIZE = int(os.getenv('PREVIEW_MAX_SIZE', '480'))  # Longest side of a thumbnail, in pixels
+PREVIEW_QUALITY = 80  # JPEG quality of thumbnails
+PREVIEW_FFMPEG_TIMEOUT = 30  # Seconds before a poster frame extraction is abandoned
+PREVIEW_BACKLOG_BATCH = 200  # Blobs without a preview picked up at startup (uploads from before, or lost on restart)
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+VIDEO_EXTENSIONS = {'mp4', 'webm', 'mov', 'avi'}
+
+
+class PreviewGenerator:
+    """Background thumbnail / poster frame generation for upload blobs"""
+
+    def __init__(self, db, folder: Path, workers: int = PREVIEW_WORKERS, max_size: int = PREVIEW_MAX_SIZE):
+        self.db = db
+        self.folder = Path(folder)
+        self.workers = workers
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._pid = None
+        self._executor = None
+        self._stats = {'queued': 0, 'generated': 0, 'skipped': 0, 'failed': 0, 'bytes_written': 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0
+
+    @staticmethod
+    def preview_name(sha256: str, filename: str) -> Optional[str]:
+        """Preview filename for a blob, or None when this type can't be previewed here"""
+        extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+        if extension in IMAGE_EXTENSIONS and PIL_AVAILABLE:
+            return f'{sha256}.thumb.jpg'
+        if extension in VIDEO_EXTENSIONS and FFMPEG:
+            return f'{sha256}.poster.jpg'
+        return None
+
+    def _pool(self) -> ThreadPoolExecutor:
+        """The executor for this process (a forked worker starts its own)"""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='upload-preview')
+                    self._pid = os.getpid()
+        return self._executor
+
+    def start(self):
+        """Start the pool and queue blobs still waiting for a preview (no-op when disabled)"""
+        if not self.enabled or self._pid == os.getpid():
+            return
+        self._pool().submit(self._queue_backlog)
+
+    def submit(self, blob: Dict[str, Any]):
+        """Queue a newly stored blob; returns immediately"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._stats['queued'] += 1
+        self._pool().submit(self.generate, blob['sha256'], blob['filename'])
+
+    def _queue_backlog(self):
+        try:
+            backlog = self.db.get_upload_blobs_without_preview(PREVIEW_BACKLOG_BATCH)
+        except Exception as e:
+            print(f"❌ [Previews] Could not load backlog: {e}")
+            return
+        if backlog:
+            print(f"🖼️  [Previews] Queued {len(backlog)} uploads without a preview")
+        for blob in backlog:
+            self.submit(blob)
+
+    def generate(self, sha256: str, filename: str) -> Optional[str]:
+        """Write the preview for one blob and record it; returns the preview filename"""
+        if not self.db.claim_upload_preview(sha256):
+            return None  # Another worker has it, or it's already done
+        preview = self.preview_name(sha256, filename)
+        if preview is None:
+            self.db.finish_upload_preview(sha256, 'none')
+            with self._lock:
+                self._stats['skipped'] += 1
+            return None
+
+        source = self.folder / filename
+        target = self.folder / preview
+        partial = self.folder / '.tmp' / f'{preview}.{os.getpid()}.{threading.get_ident()}.jpg'
+        try:
+            if preview.endswith('.thumb.jpg'):
+                self._thumbnail(source, partial)
+            else:
+                self._poster_frame(source, partial)
+            os.replace(partial, target)
+        except Exception as e:
+            partial.unlink(missing_ok=True)
+            self.db.finish_upload_preview(sha256, 'failed')
+            with self._lock:
+                self._stats['failed'] += 1
+            print(f"❌ [Previews] {filename}: {e}")
+            return None
+
+        self.db.finish_upload_preview(sha256, 'ready', preview)
+        with self._lock:
+            self._stats['generated'] += 1
+            self._stats['bytes_written'] += target.stat().st_size
+        return preview
+
+    def _thumbnail(self, source: Path, target: Path):
+        """Downscale (first frame of) an image to max_size on its longest side, as JPEG"""
+        with Image.open(source) as image:
+            image.draft('RGB', (self.max_size, self.max_size))  # JPEG: decode at reduced scale
+            image = ImageOps.exif_transpose(image)
+            if image.mode not in ('RGB', 'L'):
+                image = image.convert('RGBA')
+                background = Image.new('RGB', image.size, (255, 255, 255))
+                background.paste(image, mask=image.getchannel('A'))
+                image = background
+            image.thumbnail((self.max_size, self.max_size))
+            image.save(target, 'JPEG', quality=PREVIEW_QUALITY, optimize=True)
+
+    def _poster_frame(self, source: Path, target: Path):
+        """Grab a frame one second in (the first frame for shorter clips), scaled down"""
+        scale = f"scale='min({self.max_size},iw)':-2"
+        for seek in ('1', '0'):
+            result = subprocess.run([FFMPEG, '-nostdin', '-loglevel', 'error', '-y', '-ss', seek, '-i', str(source),
+                                     '-frames:v', '1', '-vf', scale, '-q:v', '4', '-f', 'image2', str(target)],
+                                    capture_output=True, timeout=PREVIEW_FFMPEG_TIMEOUT)
+            if target.exists() and target.stat().st_size > 0:
+                return
+        raise RuntimeError(f"ffmpeg produced no frame: {result.stderr.decode(errors='replace').strip()[:200]}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats, enabled=self.enabled, images=PIL_AVAILABLE, videos=bool(FFMPEG))
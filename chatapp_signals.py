@@ -0,0 +1,244 @@
+"""
+ChatApp Signals - WebRTC signaling queues (offer / answer / ICE / hangup)
+Each recipient has a bounded queue; signals expire after a TTL so stale ICE candidates
+from abandoned calls are never delivered.
+
+Backends:
+    memory   - in-process queues (single gunicorn worker)
+    database - call_signals table shared by every worker process (any number of workers);
+               waiters park on the change notifier's signals:<user_id> key and only read the
+               table when woken (or once per wait as a fallback)
+"""
+
+import os
+import json
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Any
+
+SIGNAL_STORE = os.getenv('SIGNAL_STORE', 'memory')  # 'memory' or 'database'
+SIGNAL_QUEUE_MAX = int(os.getenv('SIGNAL_QUEUE_MAX', '200'))  # Max pending signals per recipient
+SIGNAL_TTL = float(os.getenv('SIGNAL_TTL', '60'))  # Seconds an offer/answer/hangup stays deliverable
+SIGNAL_ICE_TTL = float(os.getenv('SIGNAL_ICE_TTL', '30'))  # ICE candidates go stale faster
+SIGNAL_DB_POLL_INTERVAL = float(os.getenv('SIGNAL_DB_POLL_INTERVAL', '0.5'))  # Cross-worker check interval while waiting (no notifier)
+SIGNAL_SWEEP_INTERVAL = 30  # Seconds between purges of abandoned queues
+
+
+class SignalStore:
+    """Base class - per-recipient signal queues with TTL expiry"""
+
+    def __init__(self, max_queue: int = SIGNAL_QUEUE_MAX, ttl: float = SIGNAL_TTL,
+                 ice_ttl: float = SIGNAL_ICE_TTL):
+        self.max_queue = max_queue
+        self.ttl = ttl
+        self.ice_ttl = ice_ttl
+        self._lock = threading.Lock()
+        self._waiters = {}  # recipient_id -> [Condition, waiter count], for local wakeups
+        self._stats = {'pushed': 0, 'delivered': 0, 'expired': 0, 'dropped': 0}
+
+    def ttl_for(self, signal: Dict[str, Any]) -> float:
+        signal_type = signal.get('type') if isinstance(signal, dict) else None
+        return self.ice_ttl if signal_type == 'ice' else self.ttl
+
+    def make_entry(self, sender_id: int, signal: Dict[str, Any]) -> Dict[str, Any]:
+        """Entry format returned to clients (same as the original polling endpoint)"""
+        return {
+            'from': sender_id,
+            'signal': signal,
+            'timestamp': datetime.now().isoformat()
+        }
+
+    def push(self, recipient_id: int, sender_id: int, signal: Dict[str, Any]):
+        """Queue a signal for recipient_id and wake anyone waiting for it"""
+        raise NotImplementedError
+
+    def drain(self, recipient_id: int) -> List[Dict[str, Any]]:
+        """Take every live signal queued for recipient_id, oldest first"""
+        raise NotImplementedError
+
+    def wait(self, recipient_id: int, timeout: float) -> List[Dict[str, Any]]:
+        """Drain, blocking up to timeout seconds for the first signal to arrive"""
+        raise NotImplementedError
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Queue sizes and counters (for the debug endpoint)"""
+        raise NotImplementedError
+
+    # Local wakeups - one condition per recipient that currently has a waiting stream
+
+    def _notify(self, recipient_id: int):
+        with self._lock:
+            waiter = self._waiters.get(recipient_id)
+            if waiter:
+                waiter[0].notify_all()
+
+    def _register_waiter(self, recipient_id: int) -> threading.Condition:
+        waiter = self._waiters.get(recipient_id)
+        if waiter is None:
+            waiter = self._waiters[recipient_id] = [threading.Condition(self._lock), 0]
+        waiter[1] += 1
+        return waiter[0]
+
+    def _unregister_waiter(self, recipient_id: int):
+        waiter = self._waiters[recipient_id]
+        waiter[1] -= 1
+        if waiter[1] == 0:
+            del self._waiters[recipient_id]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats, waiting_recipients=len(self._waiters))
+
+
+class InMemorySignalStore(SignalStore):
+    """Bounded in-process queues - only correct with a single worker process"""
+
+    backend = 'memory'
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._queues = {}  # recipient_id -> deque of (expires_at, entry)
+        self._last_sweep = time.monotonic()
+
+    def push(self, recipient_id, sender_id, signal):
+        now = time.monotonic()
+        item = (now + self.ttl_for(signal), self.make_entry(sender_id, signal))
+        with self._lock:
+            queue = self._queues.get(recipient_id)
+            if queue is None:
+                queue = self._queues[recipient_id] = deque(maxlen=self.max_queue)
+            if len(queue) == self.max_queue:
+                self._stats['dropped'] += 1  # deque drops the oldest entry
+            queue.append(item)
+            self._stats['pushed'] += 1
+            waiter = self._waiters.get(recipient_id)
+            if waiter:
+                waiter[0].notify_all()
+            if now - self._last_sweep > SIGNAL_SWEEP_INTERVAL:
+                self._sweep(now)
+
+    def _drain_locked(self, recipient_id):
+        # O(1) take: swap the whole queue out, then filter what expired
+        queue = self._queues.pop(recipient_id, None)
+        if not queue:
+            return []
+        now = time.monotonic()
+        signals = [entry for expires_at, entry in queue if expires_at > now]
+        self._stats['expired'] += len(queue) - len(signals)
+        self._stats['delivered'] += len(signals)
+        return signals
+
+    def _sweep(self, now):
+        """Forget queues whose newest signal has expired (recipient stopped collecting)"""
+        self._last_sweep = now
+        for recipient_id in [r for r, q in self._queues.items() if not q or q[-1][0] <= now]:
+            self._stats['expired'] += len(self._queues.pop(recipient_id))
+
+    def drain(self, recipient_id):
+        with self._lock:
+            return self._drain_locked(recipient_id)
+
+    def wait(self, recipient_id, timeout):
+        with self._lock:
+            signals = self._drain_locked(recipient_id)
+            if signals:
+                return signals
+            cond = self._register_waiter(recipient_id)
+            try:
+                cond.wait(timeout)
+            finally:
+                self._unregister_waiter(recipient_id)
+            return self._drain_locked(recipient_id)
+
+    def snapshot(self):
+        with self._lock:
+            queues = {str(k): len(v) for k, v in self._queues.items()}
+        return {'backend': self.backend, 'queues': queues, 'stats': self.stats()}
+
+
+class DatabaseSignalStore(SignalStore):
+    """
+    Queues in the call_signals table, so a signal posted to one worker reaches a
+    recipient connected to another. With a change notifier, waiters sleep until the
+    signals:<recipient_id> key is published (in any worker) and drain only then, plus
+    once when the wait times out. Without one they re-check the table every
+    SIGNAL_DB_POLL_INTERVAL (woken instantly for signals pushed in the same process).
+    """
+
+    backend = 'database'
+
+    def __init__(self, db, notifier=None, poll_interval: float = SIGNAL_DB_POLL_INTERVAL, **kwargs):
+        super().__init__(**kwargs)
+        self.db = db
+        self.notifier = notifier
+        self.poll_interval = poll_interval
+        self._last_sweep = time.monotonic()
+
+    def push(self, recipient_id, sender_id, signal):
+        now = time.time()
+        payload = json.dumps(self.make_entry(sender_id, signal))
+        expires_ms = int((now + self.ttl_for(signal)) * 1000)
+        dropped = self.db.push_call_signal(recipient_id, payload, expires_ms, self.max_queue)
+        with self._lock:
+            self._stats['pushed'] += 1
+            self._stats['dropped'] += dropped
+            sweep_due = time.monotonic() - self._last_sweep > SIGNAL_SWEEP_INTERVAL
+            if sweep_due:
+                self._last_sweep = time.monotonic()
+        if sweep_due:
+            expired = self.db.purge_expired_call_signals(int(now * 1000))
+            with self._lock:
+                self._stats['expired'] += max(expired, 0)
+        self._notify(recipient_id)
+
+    def drain(self, recipient_id):
+        rows = self.db.drain_call_signals(recipient_id)
+        if not rows:
+            return []
+        now_ms = int(time.time() * 1000)
+        signals = [json.loads(payload) for payload, expires_ms in rows if expires_ms > now_ms]
+        with self._lock:
+            self._stats['expired'] += len(rows) - len(signals)
+            self._stats['delivered'] += len(signals)
+        return signals
+
+    def wait(self, recipient_id, timeout):
+        deadline = time.monotonic() + timeout
+        if self.notifier is not None:
+            keys = (f'signals:{recipient_id}',)
+            while True:
+                since = self.notifier.snapshot(keys)  # Before draining, so a push in between still wakes us
+                signals = self.drain(recipient_id)
+                remaining = deadline - time.monotonic()
+                if signals or remaining <= 0:
+                    return signals
+                self.notifier.wait(keys, since, remaining)
+        signals = self.drain(recipient_id)
+        while not signals:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            with self._lock:
+                cond = self._register_waiter(recipient_id)
+                try:
+                    cond.wait(min(self.poll_interval, remaining))
+                finally:
+                    self._unregister_waiter(recipient_id)
+            signals = self.drain(recipient_id)
+        return signals
+
+    def snapshot(self):
+        queues = {str(k): v for k, v in self.db.get_call_signal_counts().items()}
+        return {'backend': self.backend, 'queues': queues, 'stats': self.stats()}
+
+
+def create_signal_store(db, backend: str = SIGNAL_STORE, notifier=None) -> SignalStore:
+    """Build the configured signal store (SIGNAL_STORE=memory|database); the database
+    store waits on notifier (which must publish signals:<user_id> on every push)"""
+    if backend == 'database':
+        return DatabaseSignalStore(db, notifier=notifier)
+    if backend != 'memory':
+        raise ValueError(f"Unknown SIGNAL_STORE '{backend}' (expected 'memory' or 'database')")
+    return InMemorySignalStore()
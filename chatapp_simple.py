@@ -4,21 +4,53 @@ One-to-many messaging: Ken Tse can chat with multiple users individually
 No AI, just human-to-human communication with file support
 """
 
-from flask import Flask, request, jsonify, send_from_directory
+if __name__ == '__main__':
+    # Development server (python chatapp_simple.py): run the app from the imported module and leave
+    # this copy of the file as a bare launcher without __file__. multiprocessing children (the bcrypt
+    # pool) re-run a script __main__ from its file; without one they never load the app.
+    import sys
+    del __file__
+    import chatapp_simple
+    sys.exit(chatapp_simple.main())
+
+from flask import Flask, Request, request, jsonify, send_from_directory, send_file, Response, stream_with_context
 from flask_cors import CORS
-from chatapp_database import ChatAppDatabase
+from chatapp_database import ChatAppDatabase, query_stats
+from chatapp_signals import create_signal_store
+from chatapp_presence import PresenceService, format_timestamp
+from chatapp_passwords import PasswordHasherBusy, PASSWORD_HASH_RETRY_AFTER
+from chatapp_tokens import TokenCache
+from chatapp_archive import MessageArchiver
+from chatapp_uploads import UploadStore, UploadSessionError
+from chatapp_previews import PreviewGenerator
+from chatapp_notify import create_change_notifier, conversation_keys
+from chatapp_metrics import RequestMetrics
+from chatapp_logging import configure_logging, get_logger, logging_stats, SampledLogger
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
+from werkzeug.security import safe_join
 from functools import wraps
 from dotenv import load_dotenv
 import jwt
+import json
+import hashlib
+import hmac
+import mimetypes
 import os
-import uuid
+import re
+import time
 from datetime import datetime, timedelta
 from pathlib import Path
+from urllib.parse import quote
 
 # Load environment variables
 load_dotenv()
 
+# JSON lines on stdout, written by a background thread (LOG_LEVEL=DEBUG for per-call detail)
+configure_logging()
+signal_log = get_logger('signals')
+poll_log = SampledLogger(get_logger('polling'))
+
 app = Flask(__name__)
 CORS(app)
 
@@ -28,14 +60,43 @@ UPLOAD_FOLDER = Path('uploads')
 UPLOAD_FOLDER.mkdir(exist_ok=True)
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'mp4', 'webm', 'mov', 'mp3', 'wav', 'm4a', 'pdf', 'docx', 'txt'}
+MAX_MESSAGES_PER_PAGE = 500
+SIGNAL_STREAM_KEEPALIVE = 15  # Seconds between SSE keep-alive comments
+SIGNAL_STREAM_MAX_AGE = int(os.getenv('SIGNAL_STREAM_MAX_AGE', '300'))  # Client reconnects after this many seconds
+SIGNAL_STREAM_TICKET_TTL = int(os.getenv('SIGNAL_STREAM_TICKET_TTL', '60'))  # Seconds a ?ticket= for the stream URL is valid
+SIGNAL_STREAM_PURPOSE = 'signal_stream'  # TokenCache purpose of those tickets
+FILE_OFFLOAD = os.getenv('FILE_OFFLOAD', '').lower()  # 'x-accel' (nginx) or 'x-sendfile' (Apache/lighttpd); empty = gunicorn sendfile
+FILE_OFFLOAD_PREFIX = os.getenv('FILE_OFFLOAD_PREFIX', '/protected-uploads/')  # nginx internal location aliased to uploads/
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600  # Content-addressed uploads never change
+LONG_POLL_MAX_WAIT = float(os.getenv('LONG_POLL_MAX_WAIT', '30'))  # Longest ?wait= a request may park for
+LONG_POLL_RECHECK = float(os.getenv('LONG_POLL_RECHECK', '10'))  # Re-check while parked (presence, missed notifications)
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')  # /metrics requires 'Authorization: Bearer <token>'; unset = administrator JWT only
 
 app.config['SECRET_KEY'] = SECRET_KEY
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE
+app.config['USE_X_SENDFILE'] = FILE_OFFLOAD == 'x-sendfile'
 
 # Initialize database
 db = ChatAppDatabase()
 
+# Wakes long-polling requests when a conversation changes (pg LISTEN/NOTIFY, or a shared file on SQLite)
+notifier = create_change_notifier(db)
+
+# Verified JWTs, so polling requests skip the HMAC check; misses check the account in the database
+token_cache = TokenCache(SECRET_KEY, load_user=db.get_user_by_id, notifier=notifier)
+
+# Uploaded files, stored once per distinct content; thumbnails are made in the background
+previews = PreviewGenerator(db, UPLOAD_FOLDER)
+upload_store = UploadStore(db, UPLOAD_FOLDER, on_stored=previews.submit)
+
+class UploadRequest(Request):
+    """Multipart file parts stream straight into a hashing temp file in the upload folder"""
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return upload_store.spool()
+
+app.request_class = UploadRequest
+
 # ============= Auto-create Admin Account =============
 
 def ensure_admin_exists():
@@ -57,12 +118,53 @@ def ensure_admin_exists():
 # Create admin on startup
 ensure_admin_exists()
 
+# Move old read messages out of the hot table (MESSAGE_ARCHIVE_AFTER_DAYS=0 disables)
+archiver = MessageArchiver(db)
+archiver.start()
+
+# Thumbnail / poster frame workers (PREVIEW_WORKERS=0 disables)
+previews.start()
+
 # ============= Helper Functions =============
 
 def allowed_file(filename):
     """Check if file extension is allowed"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def is_sha256(value):
+    return isinstance(value, str) and re.fullmatch(r'[0-9a-fA-F]{64}', value) is not None
+
+def upload_response(blob, original_filename):
+    """JSON body for /api/upload and a completed chunked upload"""
+    return {
+        'success': True,
+        'filename': blob['filename'],
+        'original_filename': original_filename,
+        'file_size': blob['size'],
+        'file_url': f"/api/files/{blob['filename']}",
+        'sha256': blob['sha256'],
+        'duplicate': blob['duplicate']
+    }
+
+def disposition_filename(filename):
+    """Content-Disposition filename parameter (RFC 5987 form for non-ASCII names)"""
+    try:
+        filename.encode('ascii')
+        return {'filename': filename}
+    except UnicodeEncodeError:
+        return {'filename*': f"UTF-8''{quote(filename)}"}
+
+def upload_session_response(session):
+    """JSON body describing a chunked upload session"""
+    return {
+        'upload_id': session['upload_id'],
+        'size': session['size'],
+        'chunk_size': session['chunk_size'],
+        'chunks': session['chunks'],
+        'received': session['received'],
+        'expires_at': str(session['expires_at'])
+    }
+
 def require_auth(f):
     """Decorator to require authentication"""
     @wraps(f)
@@ -74,7 +176,7 @@ def require_auth(f):
         try:
             if token.startswith('Bearer '):
                 token = token[7:]
-            data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
+            data = token_cache.decode(token)
             request.user_id = data['user_id']
             request.user_role = data.get('role', 'user')
         except jwt.ExpiredSignatureError:
@@ -95,6 +197,76 @@ def require_admin(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def message_query_args(args=None):
+    """Parse since_id / before_id / limit paging parameters for message endpoints (args: request.args)"""
+    if args is None:
+        args = request.args
+    
+    def int_arg(name):
+        value = args.get(name)
+        return int(value) if value not in (None, '') else None
+    
+    since_id = int_arg('since_id')
+    before_id = int_arg('before_id')
+    limit = int_arg('limit') or 100
+    return {
+        'since_id': since_id,
+        'before_id': before_id,
+        'limit': max(1, min(limit, MAX_MESSAGES_PER_PAGE))
+    }
+
+def stamp_etag(stamp):
+    return hashlib.md5(repr(stamp).encode('utf-8')).hexdigest()
+
+def conditional_json(stamp, build):
+    """JSON response with an ETag derived from a cheap version stamp; 304 without calling build() if unchanged"""
+    etag = stamp_etag(stamp)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag)
+    # Private per user; browsers revalidate every poll and send If-None-Match automatically
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def wait_seconds(value):
+    """?wait=N long-poll timeout, capped at LONG_POLL_MAX_WAIT (ValueError if not a number)"""
+    if value in (None, ''):
+        return 0
+    return max(0.0, min(float(value), LONG_POLL_MAX_WAIT))
+
+def long_poll(keys, wait, check):
+    """
+    Run check() -> (ready, result) until ready or `wait` seconds pass; in between, park until
+    one of the notifier keys is published (re-checking every LONG_POLL_RECHECK seconds regardless).
+    Returns the last result.
+    """
+    deadline = time.monotonic() + wait
+    while True:
+        since = notifier.snapshot(keys)
+        ready, result = check()
+        remaining = deadline - time.monotonic()
+        if ready or remaining <= 0:
+            return result
+        notifier.wait(keys, since, min(LONG_POLL_RECHECK, remaining))
+
+def messages_poll_check(user_id, paging, if_none_match):
+    """long_poll check() for /api/messages: -> (ready, (stamp, messages - None while the client's ETag is current))"""
+    def check():
+        stamp = ('messages', user_id, sorted(paging.items()), db.get_conversation_stamp(user_id))
+        if if_none_match.contains(stamp_etag(stamp)):
+            return False, (stamp, None)
+        messages = db.get_messages(user_id, **paging)
+        return bool(messages) or paging['since_id'] is None, (stamp, messages)
+    return check
+
+def password_busy_response():
+    """429 when the bcrypt pool is saturated (login/signup storm)"""
+    response = jsonify({'error': 'Server busy, please try again in a moment'})
+    response.headers['Retry-After'] = str(PASSWORD_HASH_RETRY_AFTER)
+    return response, 429
+
 # ============= Authentication Endpoints =============
 
 @app.route('/api/auth/signup', methods=['POST'])
@@ -136,6 +308,8 @@ def signup():
             'user': {'id': user_id, 'username': username, 'email': email}
         }), 201
     
+    except PasswordHasherBusy:
+        return password_busy_response()
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -173,6 +347,8 @@ def login():
             'admin_id': admin_id
         }), 200
     
+    except PasswordHasherBusy:
+        return password_busy_response()
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -215,6 +391,8 @@ def change_password():
         else:
             return jsonify({'error': 'Failed to update password'}), 500
     
+    except PasswordHasherBusy:
+        return password_busy_response()
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -315,10 +493,22 @@ def update_profile():
 @app.route('/api/messages', methods=['GET'])
 @require_auth
 def get_messages():
-    """Get messages for current user"""
+    """
+    Get messages for current user (?since_id= for new messages, ?before_id=&limit= for older history)
+    ?wait=N long-polls: while there is nothing new (If-None-Match still current, or no messages
+    after since_id) the request waits up to N seconds for a change to the conversation.
+    """
     try:
-        messages = db.get_messages(request.user_id)
-        return jsonify(messages), 200
+        try:
+            paging = message_query_args()
+            wait = wait_seconds(request.args.get('wait'))
+        except ValueError:
+            return jsonify({'error': 'since_id, before_id, limit and wait must be numbers'}), 400
+        
+        check = messages_poll_check(request.user_id, paging, request.if_none_match)
+        stamp, messages = long_poll(conversation_keys(request.user_id)[:1], wait, check)
+        return conditional_json(stamp, lambda: messages if messages is not None else
+                                db.get_messages(request.user_id, **paging))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -328,6 +518,7 @@ def mark_messages_read():
     """Mark all messages as read for current user"""
     try:
         success = db.mark_messages_read(request.user_id)
+        notifier.publish(conversation_keys(request.user_id))  # Read receipts for the admin
         return jsonify({'success': success}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -354,6 +545,7 @@ def send_message():
             target_user_id, sender_type, message,
             file_url, file_name, file_size, reply_to
         )
+        notifier.publish(conversation_keys(target_user_id))  # Wake long polls on every worker
         
         return jsonify({
             'message': 'Message sent successfully',
@@ -370,8 +562,8 @@ def get_unread_count():
     try:
         # Users see unread from admin, admin sees unread from users
         sender_type = 'user' if request.user_role == 'administrator' else 'admin'
-        count = db.get_unread_count(request.user_id, sender_type)
-        return jsonify({'count': count}), 200
+        stamp = ('unread', request.user_id, sender_type, db.get_conversation_stamp(request.user_id))
+        return conditional_json(stamp, lambda: {'count': db.get_unread_count(request.user_id, sender_type)})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -380,9 +572,10 @@ def get_unread_count():
 def delete_message(message_id):
     """Delete a message"""
     try:
-        success = db.delete_message(message_id, request.user_id, request.user_role)
+        owner_id = db.delete_message(message_id, request.user_id, request.user_role)
         
-        if success:
+        if owner_id is not None:
+            notifier.publish(conversation_keys(owner_id))  # The user's page and the admin list, whoever deleted it
             return jsonify({'message': 'Message deleted successfully'}), 200
         else:
             return jsonify({'error': 'Failed to delete message'}), 500
@@ -390,6 +583,39 @@ def delete_message(message_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# ============= Search Endpoints =============
+
+@app.route('/api/search/messages', methods=['GET'])
+@require_auth
+def search_messages():
+    """Full-text message search, best match first (?q=, ?limit=, ?cursor= from next_cursor; admin may pass ?user_id=)"""
+    try:
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({'error': 'q is required'}), 400
+        try:
+            limit = max(1, min(int(request.args.get('limit', '20')), 100))
+            cursor_after = None
+            if request.args.get('cursor'):
+                score, last_id = request.args['cursor'].rsplit(':', 1)
+                cursor_after = (float(score), int(last_id))
+            # Regular users only ever search their own conversation
+            if request.user_role == 'administrator':
+                user_id = int(request.args['user_id']) if request.args.get('user_id') else None
+            else:
+                user_id = request.user_id
+        except ValueError:
+            return jsonify({'error': 'Invalid limit, cursor or user_id'}), 400
+        
+        page = db.search_messages(query, user_id=user_id, limit=limit, cursor_after=cursor_after)
+        next_cursor = page['next_cursor']
+        return jsonify({
+            'results': page['results'],
+            'next_cursor': f'{next_cursor[0]!r}:{next_cursor[1]}' if next_cursor else None
+        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # ============= Admin Endpoints (Ken Tse) =============
 
 @app.route('/api/admin/conversations', methods=['GET'])
@@ -414,8 +640,10 @@ def get_admin_users():
         include_deleted = request.args.get('include_deleted', 'false').lower() == 'true'
         
         # Get all users
-        users = db.get_all_users_for_admin(include_deleted=include_deleted)
-        return jsonify(users), 200
+        online_user_ids = presence.online_set()
+        stamp = ('admin_users', include_deleted, sorted(online_user_ids), db.get_admin_list_stamp())
+        return conditional_json(stamp, lambda: db.get_all_users_for_admin(include_deleted=include_deleted,
+                                                                          online_user_ids=online_user_ids))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -430,6 +658,7 @@ def delete_user(user_id):
         
         success = db.soft_delete_user(user_id)
         if success:
+            token_cache.invalidate_user(user_id)
             return jsonify({'success': True, 'message': 'User deleted successfully'}), 200
         else:
             return jsonify({'error': 'Failed to delete user'}), 500
@@ -444,6 +673,7 @@ def restore_user(user_id):
         print(f"[API Restore] Request to restore user_id: {user_id}")
         success = db.restore_user(user_id)
         if success:
+            token_cache.invalidate_user(user_id)
             print(f"[API Restore] Success - user {user_id} restored")
             return jsonify({'success': True, 'message': 'User restored'}), 200
         else:
@@ -467,6 +697,8 @@ def permanent_delete_user(user_id):
         
         success = db.permanent_delete_user(user_id)
         if success:
+            token_cache.invalidate_user(user_id)
+            upload_store.collect_garbage()
             print(f"[API Permanent Delete] Success - user {user_id} permanently deleted")
             return jsonify({'success': True, 'message': 'User permanently deleted'}), 200
         else:
@@ -482,6 +714,8 @@ def bulk_delete_deleted_users():
     """Permanently delete all soft-deleted users (Ken Tse only)"""
     try:
         deleted_count = db.bulk_delete_deleted_users()
+        if deleted_count:
+            upload_store.collect_garbage()
         return jsonify({
             'success': True,
             'message': f'Permanently deleted {deleted_count} users',
@@ -509,6 +743,7 @@ def change_user_role(user_id):
         
         success = db.update_user_role(user_id, new_role)
         if success:
+            token_cache.invalidate_user(user_id)
             return jsonify({'success': True, 'message': f'User role changed to {new_role}'}), 200
         else:
             return jsonify({'error': 'Failed to change user role'}), 500
@@ -518,9 +753,13 @@ def change_user_role(user_id):
 @app.route('/api/admin/users/<int:user_id>/messages', methods=['GET'])
 @require_admin
 def get_user_messages(user_id):
-    """Get messages for a specific user (Ken Tse only)"""
+    """Get messages for a specific user (Ken Tse only) - same paging parameters as /api/messages"""
     try:
-        messages = db.get_messages(user_id)
+        try:
+            paging = message_query_args()
+        except ValueError:
+            return jsonify({'error': 'since_id, before_id and limit must be integers'}), 400
+        messages = db.get_messages(user_id, **paging)
         return jsonify(messages), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -531,6 +770,7 @@ def mark_user_messages_read(user_id):
     """Mark all messages from a specific user as read (Ken Tse only)"""
     try:
         success = db.mark_user_messages_read_by_admin(user_id)
+        notifier.publish(conversation_keys(user_id))
         return jsonify({'success': success}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -540,7 +780,7 @@ def mark_user_messages_read(user_id):
 @app.route('/api/upload', methods=['POST'])
 @require_auth
 def upload_file():
-    """Upload a file"""
+    """Upload a file (identical content is stored once and gets the same URL)"""
     try:
         if 'file' not in request.files:
             return jsonify({'error': 'No file provided'}), 400
@@ -553,41 +793,178 @@ def upload_file():
         if not allowed_file(file.filename):
             return jsonify({'error': 'File type not allowed'}), 400
         
-        # Generate unique filename with original extension
+        # The body has already been hashed while it streamed in - keep the blob or drop the duplicate
         original_filename = secure_filename(file.filename)
-        unique_id = str(uuid.uuid4())
         file_extension = original_filename.rsplit('.', 1)[1].lower() if '.' in original_filename else ''
-        unique_filename = f"{unique_id}.{file_extension}" if file_extension else unique_id
-        
-        filepath = app.config['UPLOAD_FOLDER'] / unique_filename
-        file.save(filepath)
+        blob = upload_store.save(file.stream, file_extension)
+        status = 200 if blob['duplicate'] else 201
         
-        file_size = filepath.stat().st_size
-        
-        return jsonify({
-            'success': True,
-            'filename': unique_filename,
-            'original_filename': original_filename,
-            'file_size': file_size,
-            'file_url': f'/api/files/{unique_filename}'
-        }), 201
+        return jsonify(upload_response(blob, original_filename)), status
     
+    except RequestEntityTooLarge:
+        return jsonify({'error': 'File too large'}), 413
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# ============= Chunked Upload Endpoints =============
+# POST /api/upload/sessions -> PUT .../chunks/<n> (any order, retry freely) -> POST .../complete
+
+@app.route('/api/upload/sessions', methods=['POST'])
+@require_auth
+def create_upload_session():
+    """Start a resumable upload: {filename, size, sha256 (optional, checked against the assembled file)}
+    Every upload sends its bytes - dedup happens after they arrive, so knowing a hash gives no access"""
+    try:
+        data = request.get_json(silent=True) or {}
+        original_filename = secure_filename(data.get('filename') or '')
+        if not original_filename or not allowed_file(original_filename):
+            return jsonify({'error': 'File type not allowed'}), 400
+        try:
+            size = int(data.get('size'))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'size must be an integer'}), 400
+        sha256 = data.get('sha256')
+        if sha256 is not None and not is_sha256(sha256):
+            return jsonify({'error': 'Invalid SHA-256'}), 400
+        
+        file_extension = original_filename.rsplit('.', 1)[1].lower() if '.' in original_filename else ''
+        session = upload_store.create_session(request.user_id, original_filename, file_extension, size, sha256)
+        return jsonify(upload_session_response(session)), 201
+    except UploadSessionError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/upload/sessions/<upload_id>', methods=['GET'])
+@require_auth
+def get_upload_session(upload_id):
+    """Which chunks have arrived (to resume after a dropped connection)"""
+    session = upload_store.get_session(upload_id, request.user_id)
+    if session is None:
+        return jsonify({'error': 'Upload session not found or expired'}), 404
+    return jsonify(upload_session_response(session)), 200
+
+@app.route('/api/upload/sessions/<upload_id>/chunks/<int:index>', methods=['PUT'])
+@require_auth
+def put_upload_chunk(upload_id, index):
+    """Raw chunk bytes at offset index * chunk_size; X-Chunk-SHA256 must match them"""
+    try:
+        checksum = request.headers.get('X-Chunk-SHA256', '')
+        if not is_sha256(checksum):
+            return jsonify({'error': 'X-Chunk-SHA256 header required'}), 400
+        session = upload_store.get_session(upload_id, request.user_id)
+        if session is None:
+            return jsonify({'error': 'Upload session not found or expired'}), 404
+        upload_store.write_chunk(session, index, request.stream, checksum)
+        return jsonify({'success': True, 'index': index}), 200
+    except UploadSessionError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/upload/sessions/<upload_id>/complete', methods=['POST'])
+@require_auth
+def complete_upload_session(upload_id):
+    """Assemble and store the file once every chunk has arrived - same response as /api/upload"""
+    try:
+        session = upload_store.get_session(upload_id, request.user_id)
+        if session is None:
+            return jsonify({'error': 'Upload session not found or expired'}), 404
+        blob = upload_store.complete_session(session)
+        status = 200 if blob['duplicate'] else 201
+        return jsonify(upload_response(blob, session['filename'])), status
+    except UploadSessionError as e:
+        return jsonify({'error': str(e)}), 409
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/upload/sessions/<upload_id>', methods=['DELETE'])
+@require_auth
+def abort_upload_session(upload_id):
+    """Cancel a chunked upload and delete what was received"""
+    session = upload_store.get_session(upload_id, request.user_id)
+    if session is None:
+        return jsonify({'error': 'Upload session not found or expired'}), 404
+    upload_store.abort_session(session)
+    return jsonify({'success': True}), 200
+
 @app.route('/api/files/<filename>')
 def get_file(filename):
-    """Serve uploaded file"""
-    try:
-        original_filename = request.args.get('original_name', filename)
-        return send_from_directory(
-            app.config['UPLOAD_FOLDER'], 
-            filename,
+    """Serve uploaded file - byte ranges (206), conditional GETs, and for content-addressed
+    files a strong ETag (the SHA-256) with a year-long immutable Cache-Control"""
+    path = safe_join(str(upload_store.folder.resolve()), filename)
+    if path is None or not os.path.isfile(path):
+        return jsonify({'error': 'File not found'}), 404
+    
+    original_filename = request.args.get('original_name', filename)
+    sha256 = upload_store.content_hash(filename)
+    
+    if FILE_OFFLOAD == 'x-accel':
+        # nginx streams the bytes (and handles Range) from an internal location
+        if sha256 and sha256 in request.if_none_match:
+            response = Response(status=304)
+        else:
+            response = Response(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+            response.headers['X-Accel-Redirect'] = FILE_OFFLOAD_PREFIX + filename
+            response.headers.set('Content-Disposition', 'inline', **disposition_filename(original_filename))
+    else:
+        # Range and If-None-Match are handled by werkzeug; full responses go out through
+        # wsgi.file_wrapper, which gunicorn sends with sendfile(2)
+        response = send_file(
+            path,
             as_attachment=False,  # Allow inline viewing
-            download_name=original_filename
+            download_name=original_filename,
+            conditional=True,
+            etag=sha256 or True
         )
-    except FileNotFoundError:
-        return jsonify({'error': 'File not found'}), 404
+    
+    if sha256:
+        response.set_etag(sha256)
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    return response
+
+# ============= Request Metrics =============
+
+# Per-route timing, sizes and SQL statement counts, summed over every worker at /metrics
+request_metrics = RequestMetrics()
+
+@app.before_request
+def start_request_metrics():
+    request.metrics_start = time.perf_counter()
+    request.metrics_cpu = time.thread_time()
+    request.metrics_queries = query_stats.track_request()
+    request_metrics.started()
+
+@app.after_request
+def record_request_metrics(response):
+    if hasattr(request, 'metrics_start'):
+        queries, query_ms = request.metrics_queries
+        request_metrics.observe(
+            request.method, request.url_rule.rule if request.url_rule else '<unmatched>', response.status_code,
+            time.perf_counter() - request.metrics_start, response.content_length or 0,
+            queries, query_ms / 1000, time.thread_time() - request.metrics_cpu)
+    return response
+
+@app.teardown_request
+def finish_request_metrics(error=None):
+    if hasattr(request, 'metrics_start'):
+        request_metrics.finished()
+
+def render_metrics():
+    return Response(request_metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus text exposition of the request metrics, all workers combined.
+    Scrapers send METRICS_TOKEN; with no token configured only the administrator may read it."""
+    if not METRICS_TOKEN:
+        return require_admin(render_metrics)()
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {METRICS_TOKEN}'):
+        return jsonify({'error': 'Invalid metrics token'}), 401
+    return render_metrics()
 
 # ============= Health Check =============
 
@@ -596,6 +973,39 @@ def health_check():
     """Health check endpoint"""
     return jsonify({'status': 'ok', 'message': 'ChatApp is running'}), 200
 
+@app.route('/api/admin/db-stats')
+@require_admin
+def db_stats():
+    """Database connection pool metrics for this worker process (Ken Tse only)"""
+    try:
+        return jsonify({'pid': os.getpid(), 'pool': db.pool_stats(), 'presence': presence.stats(),
+                        'passwords': db.passwords.stats(), 'tokens': token_cache.stats(),
+                        'archive': dict(archiver.stats(), **db.get_archive_stats()),
+                        'uploads': upload_store.stats(),
+                        'previews': previews.stats(),
+                        'notify': notifier.stats(),
+                        'logging': logging_stats()}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/db-stats/queries', methods=['GET', 'DELETE'])
+@require_admin
+def db_query_stats():
+    """Per-statement call count / time / rows for this worker (?sort=total_ms|calls|p99_ms&limit=50, DELETE resets)"""
+    try:
+        if request.method == 'DELETE':
+            db.reset_query_stats()
+            return jsonify({'success': True}), 200
+        sort = request.args.get('sort', 'total_ms')
+        if sort not in ('total_ms', 'calls', 'mean_ms', 'p99_ms', 'max_ms', 'rows'):
+            return jsonify({'error': 'Invalid sort'}), 400
+        limit = request.args.get('limit', '50')
+        if not limit.isdigit():
+            return jsonify({'error': 'limit must be an integer'}), 400
+        return jsonify(dict(db.query_stats(sort, int(limit)), pid=os.getpid())), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/favicon.ico')
 def favicon():
     """Prevent favicon 404"""
@@ -618,24 +1028,36 @@ def signup_page():
 
 # ============= Voice Call & Status Endpoints =============
 
+# Heartbeats are kept in memory and written to user_status in batches
+presence = PresenceService(db)
+
 @app.route('/api/status/heartbeat', methods=['POST'])
 @require_auth
 def heartbeat():
     """Update user's last seen timestamp"""
     try:
         user_id = request.user_id
-        db.heartbeat(user_id)
+        presence.touch(user_id)
         return jsonify({'success': True}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def user_status_payload(user_id, status):
+    """A user_status row merged with heartbeats this worker hasn't flushed yet"""
+    seen = presence.last_seen(user_id)
+    if seen is not None:
+        if status['last_seen'] is None:
+            status['status'] = 'online'  # First heartbeat creates the row as online
+        status['last_seen'] = format_timestamp(seen)
+    status['online'] = presence.is_online(user_id)
+    return status
+
 @app.route('/api/status/user/<int:user_id>', methods=['GET'])
 @require_auth
 def get_user_status(user_id):
     """Get user's online status"""
     try:
-        status = db.get_user_status(user_id)
-        return jsonify(status), 200
+        return jsonify(user_status_payload(user_id, db.get_user_status(user_id))), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -673,6 +1095,7 @@ def initiate_call():
         if callee_status['status'] in ['in_call', 'busy']:
             call_id = db.log_call_attempt(caller_id, callee_id)
             db.update_call_status(call_id, 'missed')
+            notifier.publish((f'calls:{callee_id}',))
             return jsonify({
                 'success': False,
                 'reason': 'busy',
@@ -683,6 +1106,7 @@ def initiate_call():
         if callee_status['status'] == 'offline':
             call_id = db.log_call_attempt(caller_id, callee_id)
             db.update_call_status(call_id, 'missed')
+            notifier.publish((f'calls:{callee_id}',))
             return jsonify({
                 'success': False,
                 'reason': 'offline',
@@ -769,8 +1193,8 @@ def get_missed_calls():
     """Get missed calls for current user (admin)"""
     try:
         user_id = request.user_id
-        missed_calls = db.get_missed_calls(user_id)
-        return jsonify(missed_calls), 200
+        stamp = ('missed_calls', user_id, db.get_missed_calls_stamp(user_id))
+        return conditional_json(stamp, lambda: db.get_missed_calls(user_id))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -785,7 +1209,8 @@ def mark_call_seen(call_id):
         return jsonify({'error': str(e)}), 500
 
 # WebRTC signaling endpoint (for offer/answer/ICE candidates)
-call_signals = {}  # In-memory store for signaling (use Redis in production)
+# SIGNAL_STORE=database shares queues between gunicorn workers; the default is in-process memory
+signal_store = create_signal_store(db, notifier=notifier)
 
 @app.route('/api/call/signal', methods=['POST'])
 @require_auth
@@ -797,29 +1222,27 @@ def signal():
         target_user_id = data.get('target_user_id')
         signal_data = data.get('signal')
         
-        print(f"[SIGNAL] From user {user_id} to user {target_user_id}")
-        print(f"[SIGNAL] Signal type: {signal_data.get('type') if signal_data else 'none'}")
-        print(f"[SIGNAL] Current call_signals keys: {list(call_signals.keys())}")
-        
         if not target_user_id or not signal_data:
             return jsonify({'error': 'target_user_id and signal required'}), 400
         
-        # Store signal for target user to retrieve
-        if target_user_id not in call_signals:
-            call_signals[target_user_id] = []
-            print(f"[SIGNAL] Created new signal queue for user {target_user_id}")
+        try:
+            target_user_id = int(target_user_id)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Invalid target_user_id'}), 400
         
-        call_signals[target_user_id].append({
-            'from': user_id,
-            'signal': signal_data,
-            'timestamp': datetime.now().isoformat()
-        })
+        # Validated before anything is queued: a bad signal is a 400, never a 500 after delivery
+        signal_type = signal_data.get('type') if isinstance(signal_data, dict) else None
+        if not isinstance(signal_type, str):
+            return jsonify({'error': 'signal must be an object with a type'}), 400
         
-        print(f"[SIGNAL] Stored! Queue for user {target_user_id} now has {len(call_signals[target_user_id])} signals")
+        # Store signal for target user and wake any connected stream
+        signal_store.push(target_user_id, user_id, signal_data)
+        notifier.publish((f'signals:{target_user_id}',))  # Wakes streams and syncs parked in any worker
+        signal_log.debug('Signal %s from user %s to user %s', signal_type, user_id, target_user_id)
         
         return jsonify({'success': True}), 200
     except Exception as e:
-        print(f"[SIGNAL ERROR] {str(e)}")
+        signal_log.error('Signal from user %s failed: %s', request.user_id, e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/call/signals', methods=['GET'])
@@ -829,34 +1252,184 @@ def get_signals():
     try:
         user_id = request.user_id
         
-        print(f"[GET SIGNALS] User {user_id} polling for signals")
-        print(f"[GET SIGNALS] Current call_signals keys: {list(call_signals.keys())}")
-        print(f"[GET SIGNALS] Signals for user {user_id}: {len(call_signals.get(user_id, []))} signals")
-        
         # Get and clear signals for this user
-        signals = call_signals.get(user_id, [])
-        if user_id in call_signals:
-            call_signals[user_id] = []
-            print(f"[GET SIGNALS] Cleared signals for user {user_id}")
+        signals = signal_store.drain(user_id)
+        if signals:
+            signal_log.debug('Delivered %s signals to user %s', len(signals), user_id)
+        else:
+            poll_log.debug('Signal poll from user %s: nothing pending', user_id)
         
         return jsonify(signals), 200
     except Exception as e:
-        print(f"[GET SIGNALS ERROR] {str(e)}")
+        signal_log.error('Signal poll from user %s failed: %s', request.user_id, e)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/call/signals/ticket', methods=['POST'])
+@require_auth
+def signal_stream_ticket():
+    """Short-lived ticket for the signal stream URL, so the login token never goes in a query string"""
+    ticket = token_cache.ticket(request.user_id, SIGNAL_STREAM_PURPOSE, SIGNAL_STREAM_TICKET_TTL)
+    return jsonify({'ticket': ticket, 'expires_in': SIGNAL_STREAM_TICKET_TTL}), 200
+
+@app.route('/api/call/signals/stream', methods=['GET'])
+def stream_signals():
+    """Push pending signals to the client as Server-Sent Events (polling /api/call/signals is the fallback)"""
+    # EventSource cannot set headers: browsers pass a ticket from /api/call/signals/ticket instead
+    token, purpose = request.args.get('ticket'), SIGNAL_STREAM_PURPOSE
+    if not token:
+        token, purpose = request.headers.get('Authorization', ''), None
+        if token.startswith('Bearer '):
+            token = token[7:]
+    if not token:
+        return jsonify({'error': 'No token provided'}), 401
+    try:
+        data = token_cache.decode(token, purpose)
+    except jwt.ExpiredSignatureError:
+        return jsonify({'error': 'Token expired'}), 401
+    except jwt.InvalidTokenError:
+        return jsonify({'error': 'Invalid token'}), 401
+    user_id = data['user_id']
+    
+    def generate():
+        # Ask the browser to reconnect quickly when the stream ends
+        yield 'retry: 1000\n\n'
+        deadline = time.monotonic() + SIGNAL_STREAM_MAX_AGE
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            signals = signal_store.wait(user_id, min(SIGNAL_STREAM_KEEPALIVE, remaining))
+            if signals:
+                yield f"data: {json.dumps(signals)}\n\n"
+            else:
+                yield ': keep-alive\n\n'
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # Disable proxy buffering so events arrive immediately
+    })
+
+# ============= Sync Endpoint =============
+
+def sync_section(updates, cursors, name, stamp, build):
+    """Put build() in updates[name] unless the client's cursor for name already matches stamp"""
+    cursor = hashlib.md5(repr(stamp).encode('utf-8')).hexdigest()
+    if cursors.get(name) != cursor:
+        updates[name] = build()
+    updates['cursors'][name] = cursor
+
+def collect_sync(user_id, is_admin, cursors, since_id, conversation_id, status_user_id, drain_signals):
+    """One pass of /api/sync -> (anything changed, response body); each pass counts as a heartbeat"""
+    presence.touch(user_id)
+    stamps = db.get_sync_stamps(user_id, conversation_id, is_admin, status_user_id)
+    updates = {'cursors': {}}
+    
+    if conversation_id is not None:
+        def build_messages():
+            if since_id is not None:
+                new_messages = db.get_messages(conversation_id, limit=MAX_MESSAGES_PER_PAGE, since_id=since_id)
+                if new_messages:
+                    return {'items': new_messages, 'full': False}
+            # No new rows, so something was read or deleted - resend the page
+            return {'items': db.get_messages(conversation_id), 'full': True}
+        
+        sync_section(updates, cursors, 'messages', (conversation_id, stamps['conversation']), build_messages)
+        if not is_admin:
+            # conversation_summary.unread_by_user, already part of the stamp
+            unread = stamps['conversation'][3] if stamps['conversation'] else 0
+            sync_section(updates, cursors, 'unread', unread, lambda: unread)
+    
+    if is_admin:
+        online_user_ids = presence.online_set()
+        sync_section(updates, cursors, 'users', stamps['admin_list'],
+                     lambda: db.get_all_users_for_admin(online_user_ids=online_user_ids))
+        sync_section(updates, cursors, 'presence', sorted(online_user_ids),
+                     lambda: {'online': sorted(online_user_ids)})
+        sync_section(updates, cursors, 'missed_calls', stamps['missed_calls'],
+                     lambda: db.get_missed_calls(user_id))
+    
+    if status_user_id is not None:
+        status = user_status_payload(status_user_id, stamps['status'])
+        sync_section(updates, cursors, 'status',
+                     (status_user_id, status['status'], status['online'], status['current_call_with']),
+                     lambda: dict(status, user_id=status_user_id))
+    
+    if drain_signals:
+        signals = signal_store.drain(user_id)
+        if signals:
+            updates['signals'] = signals
+    
+    poll_log.debug('Sync for user %s: %s sections changed', user_id, len(updates) - 1)
+    return len(updates) > 1, updates
+
+def sync_arguments(data, user_id, is_admin):
+    """
+    Parse a /api/sync body -> (collect_sync keyword arguments, wait, notifier keys to park on)
+    Raises ValueError when a field isn't a number.
+    """
+    try:
+        conversation_id = user_id
+        if is_admin:
+            conversation_id = int(data['conversation_id']) if data.get('conversation_id') is not None else None
+        args = {
+            'user_id': user_id,
+            'is_admin': is_admin,
+            'cursors': dict(data.get('cursors') or {}),
+            'since_id': int(data['since_id']) if data.get('since_id') is not None else None,
+            'conversation_id': conversation_id,
+            'status_user_id': int(data['status_user_id']) if data.get('status_user_id') is not None else None,
+            'drain_signals': data.get('signals')
+        }
+        wait = wait_seconds(data.get('wait'))
+    except (TypeError, ValueError):
+        raise ValueError('since_id, conversation_id, status_user_id and wait must be numbers')
+    keys = ('conversations', f'calls:{user_id}') if is_admin else conversation_keys(user_id)[:1]
+    if args['drain_signals']:
+        keys += (f'signals:{user_id}',)  # Wake as soon as a call signal arrives, not at the timeout
+    return args, wait, keys
+
+@app.route('/api/sync', methods=['POST'])
+@require_auth
+def sync():
+    """
+    One poll for everything the client shows; also counts as a heartbeat. JSON body:
+    - cursors: the cursors from the previous sync response ({} the first time)
+    - since_id: newest message id the client has (new messages only; omit for a full page)
+    - conversation_id: conversation to follow (administrator only; users follow their own)
+    - status_user_id: user whose status to report (users pass the admin)
+    - signals: true to also drain pending call signals (clients without the signal stream)
+    - wait: seconds to long-poll while nothing changed (see long_poll)
+    Only sections whose cursor changed are returned: messages {items, full}, unread,
+    users, presence {online}, status, missed_calls, plus signals when any are pending.
+    """
+    try:
+        try:
+            args, wait, keys = sync_arguments(request.get_json(silent=True) or {}, request.user_id,
+                                              request.user_role == 'administrator')
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        return jsonify(long_poll(keys, wait, lambda: collect_sync(**args))), 200
+    except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-# DEBUG endpoint to inspect call_signals
+# DEBUG endpoint to inspect the signal queues
 @app.route('/api/debug/signals', methods=['GET'])
 def debug_signals():
-    """Debug endpoint to see all signals in memory"""
+    """Debug endpoint to see queued signal counts per recipient"""
+    snapshot = signal_store.snapshot()
     return jsonify({
-        'call_signals': {str(k): v for k, v in call_signals.items()},
-        'keys': list(call_signals.keys()),
-        'count': len(call_signals)
+        'backend': snapshot['backend'],
+        'call_signals': snapshot['queues'],
+        'keys': list(snapshot['queues'].keys()),
+        'count': len(snapshot['queues']),
+        'stats': snapshot['stats']
     }), 200
 
 # ============= Main =============
 
-if __name__ == '__main__':
+def main():
+    """Flask development server (production runs under gunicorn / uvicorn, see DEPLOYMENT.md)"""
     # Get port from environment variable (for Railway/Render) or use 5001 locally
     port = int(os.environ.get('PORT', 5001))
     print(f"Starting ChatApp server on port {port}...")
@@ -866,5 +1439,5 @@ if __name__ == '__main__':
     print("💬 No AI - just human-to-human communication")
     print(f"🌐 Server running on: http://0.0.0.0:{port}")
     print("=" * 50)
-    # Disable reloader to prevent multiple processes (needed for in-memory signal storage)
+    # Disable reloader to prevent multiple processes (needed for in-memory signal storage, see SIGNAL_STORE)
     app.run(debug=True, host='0.0.0.0', port=port, use_reloader=False)
@@ -0,0 +1,134 @@
+"""
+ChatApp Tokens - cache of verified JWTs for require_auth
+Every polling request carries the same token; after the first HMAC check its claims are
+served from a bounded LRU (keyed by SHA-256 of the token) until the token's exp.
+
+The account is the source of truth, not the token: on a miss the user is looked up
+(load_user) - soft-deleted or removed users are refused, and the role comes from the
+database rather than the JWT claims. Admin actions publish 'account:<user_id>' on the
+change notifier; every worker's entries for that user then fail their version check and
+are looked up again, so a revocation or role change holds across processes and restarts.
+
+Tickets are short-lived JWTs carrying a 'purpose' claim, for URLs that cannot send a header
+(EventSource): decode() only accepts a token whose purpose matches the one asked for, so a
+ticket seen in a URL is no login token and a login token is no ticket.
+"""
+
+import os
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Any, Optional
+
+import jwt
+
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', '10000'))  # Max verified tokens kept per worker process
+
+
+def account_key(user_id: int) -> str:
+    """Notifier key published when a user's role or deleted flag changes"""
+    return f'account:{user_id}'
+
+
+class TokenCache:
+    """Bounded LRU of decoded JWT claims, checked against the user's account"""
+
+    def __init__(self, secret_key: str, load_user: Callable[[int], Optional[Dict[str, Any]]] = None,
+                 notifier=None, max_size: int = TOKEN_CACHE_SIZE, algorithms=('HS256',)):
+        self.secret_key = secret_key
+        self.load_user = load_user  # user_id -> {'role': ...}, None when deleted
+        self.notifier = notifier
+        self.max_size = max_size
+        self.algorithms = list(algorithms)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # token digest -> (claims, exp, notifier version)
+        self._stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evicted': 0, 'invalidated': 0, 'rejected': 0}
+
+    def _version(self, user_id) -> Optional[tuple]:
+        return self.notifier.snapshot((account_key(user_id),)) if self.notifier is not None else None
+
+    def ticket(self, user_id: int, purpose: str, ttl_seconds: int) -> str:
+        """A JWT for user_id that only decode(token, purpose) accepts, valid for ttl_seconds"""
+        return jwt.encode({
+            'user_id': user_id,
+            'purpose': purpose,
+            'exp': datetime.utcnow() + timedelta(seconds=ttl_seconds)
+        }, self.secret_key, algorithm=self.algorithms[0])
+
+    @staticmethod
+    def _check_purpose(claims: Dict[str, Any], purpose: Optional[str]):
+        if claims.get('purpose') != purpose:
+            raise jwt.InvalidTokenError('Token is not valid here')
+
+    def lookup(self, token: str, purpose: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Cached claims for token, or None when it must be decoded (no database access)"""
+        key = hashlib.sha256(token.encode('utf-8')).digest()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            claims, exp, version = entry
+            if exp is not None and exp <= time.time():
+                del self._entries[key]
+                self._stats['expired'] += 1
+                raise jwt.ExpiredSignatureError('Signature has expired')
+        self._check_purpose(claims, purpose)
+        if version != self._version(claims.get('user_id')):
+            with self._lock:
+                if self._entries.pop(key, None) is not None:
+                    self._stats['invalidated'] += 1
+                self._stats['misses'] += 1
+            return None
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+        return claims
+
+    def decode(self, token: str, purpose: Optional[str] = None) -> Dict[str, Any]:
+        """Verified claims for token; raises the same jwt errors as jwt.decode
+        (InvalidTokenError too when its purpose isn't `purpose` - None for login tokens)"""
+        claims = self.lookup(token, purpose)
+        if claims is not None:
+            return claims
+        return self.verify(token, purpose)
+
+    def verify(self, token: str, purpose: Optional[str] = None) -> Dict[str, Any]:
+        """Cache miss: check the signature, purpose and account, then cache the claims"""
+        claims = jwt.decode(token, self.secret_key, algorithms=self.algorithms)
+        self._check_purpose(claims, purpose)
+        user_id = claims.get('user_id')
+        version = self._version(user_id)  # Before the lookup: a change after it fails the next check
+        if self.load_user is not None:
+            user = self.load_user(user_id)
+            if user is None:
+                with self._lock:
+                    self._stats['rejected'] += 1
+                raise jwt.InvalidTokenError('User has been deleted')
+            claims = dict(claims, role=user.get('role') or 'user')
+        key = hashlib.sha256(token.encode('utf-8')).digest()
+        with self._lock:
+            self._entries[key] = (claims, claims.get('exp'), version)
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._stats['evicted'] += 1
+        return claims
+
+    def invalidate_user(self, user_id: int):
+        """Make every worker re-check user_id's tokens (role change, soft delete, restore)"""
+        with self._lock:
+            stale = [key for key, (claims, _, _) in self._entries.items() if claims.get('user_id') == user_id]
+            for key in stale:
+                del self._entries[key]
+            self._stats['invalidated'] += len(stale)
+        if self.notifier is not None:
+            self.notifier.publish((account_key(user_id),))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses']
+            return dict(self._stats, size=len(self._entries), max_size=self.max_size,
+                        hit_rate=round(self._stats['hits'] / lookups, 3) if lookups else None)
@@ -0,0 +1,247 @@
+"""
+ChatApp Uploads - content-addressed, deduplicated file store
+Upload bodies are streamed by werkzeug straight into a HashingSpool (a temp file in
+uploads/.tmp that computes SHA-256 as chunks arrive). The blob is stored once as
+<sha256>.<ext>; a repeat upload of the same content just discards the spool and returns
+the existing URL. upload_blobs.ref_count counts the messages pointing at each blob, and
+collect_garbage() removes blobs nothing references any more. Newly stored blobs are handed
+to on_stored (the preview generator) without waiting for it.
+
+Large files can be sent in resumable chunks instead: create a session, PUT each chunk
+(written with pwrite at its offset into a sparse temp file and checked against its SHA-256),
+then complete it. Sessions live in the database so any worker can take any chunk; abandoned
+ones expire after UPLOAD_SESSION_TTL_SECONDS.
+"""
+
+import os
+import re
+import hashlib
+import tempfile
+import threading
+import uuid
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+from typing import Callable, Dict, Any, Optional
+
+UPLOAD_GC_GRACE_SECONDS = int(os.getenv('UPLOAD_GC_GRACE_SECONDS', '600'))  # Keep unreferenced blobs this long (uploaded, not sent yet)
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', str(4 * 1024 * 1024)))  # Bytes per chunk of a chunked upload
+UPLOAD_SESSION_TTL_SECONDS = int(os.getenv('UPLOAD_SESSION_TTL_SECONDS', '86400'))  # Abandoned chunked uploads are deleted after this
+CHUNKED_UPLOAD_MAX_SIZE = int(os.getenv('CHUNKED_UPLOAD_MAX_SIZE', str(500 * 1024 * 1024)))  # Largest file accepted in chunks
+UPLOAD_READ_SIZE = 64 * 1024  # Bytes read from a request body / file at a time
+
+
+def utc_timestamp(offset_seconds: float = 0) -> str:
+    return (datetime.now(timezone.utc) + timedelta(seconds=offset_seconds)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class UploadSessionError(Exception):
+    """A chunked upload request that can't be applied (bad chunk, missing chunks, checksum mismatch)"""
+
+
+class HashingSpool:
+    """Writable temp file that hashes everything written to it (used as werkzeug's upload stream)"""
+
+    def __init__(self, directory: Path):
+        fd, self.path = tempfile.mkstemp(dir=directory, suffix='.part')
+        self.file = os.fdopen(fd, 'w+b')
+        self.hash = hashlib.sha256()
+        self.size = 0
+        self.kept = False
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+    def write(self, data) -> int:
+        self.hash.update(data)
+        self.size += len(data)
+        return self.file.write(data)
+
+    def close(self):
+        """Close and delete the temp file unless the store moved it into place"""
+        self.file.close()
+        if not self.kept:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+
+class UploadStore:
+    """Blobs on disk named by content hash, tracked in the upload_blobs table"""
+
+    def __init__(self, db, folder: Path, on_stored: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self.db = db
+        self.folder = Path(folder)
+        self.on_stored = on_stored
+        self.spool_folder = self.folder / '.tmp'
+        self.spool_folder.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._stats = {'stored': 0, 'duplicates': 0, 'bytes_stored': 0, 'bytes_deduplicated': 0, 'collected': 0,
+                       'sessions': 0, 'chunks': 0, 'expired_sessions': 0}
+
+    def spool(self) -> HashingSpool:
+        return HashingSpool(self.spool_folder)
+
+    @staticmethod
+    def content_hash(filename: str) -> Optional[str]:
+        """The SHA-256 a blob filename is named after (None for files from before the blob store)"""
+        stem = filename.split('.', 1)[0]
+        return stem.lower() if re.fullmatch(r'[0-9a-fA-F]{64}', stem) else None
+
+    def lookup(self, sha256: str) -> Optional[Dict[str, Any]]:
+        """Stored blob with this hash (and its file still on disk), or None"""
+        blob = self.db.get_upload_blob(sha256.lower())
+        if blob is None or not (self.folder / blob['filename']).exists():
+            return None
+        return blob
+
+    def save(self, spool: HashingSpool, extension: str = '') -> Dict[str, Any]:
+        """Keep a fully written spool as a blob, or drop it if the content is already stored"""
+        spool.flush()
+        blob = self._store(spool.path, spool.hash.hexdigest(), spool.size, extension)
+        spool.kept = not blob['duplicate']
+        return blob
+
+    def save_file(self, path: str, extension: str = '', expected_sha256: Optional[str] = None) -> Dict[str, Any]:
+        """Hash a finished file and store it; the file is moved into place or deleted"""
+        digest = hashlib.sha256()
+        size = 0
+        with open(path, 'rb') as f:
+            while True:
+                data = f.read(UPLOAD_READ_SIZE)
+                if not data:
+                    break
+                digest.update(data)
+                size += len(data)
+        sha256 = digest.hexdigest()
+        if expected_sha256 and sha256 != expected_sha256.lower():
+            os.unlink(path)
+            raise UploadSessionError('File checksum does not match the declared SHA-256')
+        blob = self._store(path, sha256, size, extension)
+        if blob['duplicate']:
+            os.unlink(path)
+        return blob
+
+    def _store(self, path: str, sha256: str, size: int, extension: str) -> Dict[str, Any]:
+        """Move path into place as <sha256>.<ext> unless that content is already stored"""
+        existing = self.lookup(sha256)
+        if existing is not None:
+            self.db.touch_upload_blob(sha256)
+            with self._lock:
+                self._stats['duplicates'] += 1
+                self._stats['bytes_deduplicated'] += existing['size']
+            return dict(existing, duplicate=True)
+
+        filename = f'{sha256}.{extension}' if extension else sha256
+        os.replace(path, self.folder / filename)
+        stored = self.db.register_upload_blob(sha256, filename, size)
+        if stored['filename'] != filename:
+            # Another worker stored the same content (under another extension) first
+            (self.folder / filename).unlink(missing_ok=True)
+        elif self.on_stored is not None:
+            self.on_stored(stored)
+        with self._lock:
+            self._stats['stored'] += 1
+            self._stats['bytes_stored'] += size
+        return dict(stored, duplicate=False)
+
+    # ============= Chunked Uploads =============
+
+    def _session_path(self, upload_id: str) -> Path:
+        return self.spool_folder / f'{upload_id}.upload'
+
+    def create_session(self, user_id: int, filename: str, extension: str, size: int,
+                       sha256: Optional[str] = None) -> Dict[str, Any]:
+        """Start a chunked upload: a sparse temp file of the final size plus a session row"""
+        self.expire_sessions()
+        if size <= 0 or size > CHUNKED_UPLOAD_MAX_SIZE:
+            raise UploadSessionError(f'File size must be between 1 byte and {CHUNKED_UPLOAD_MAX_SIZE} bytes')
+        upload_id = uuid.uuid4().hex
+        with open(self._session_path(upload_id), 'wb') as f:
+            f.truncate(size)  # No blocks allocated until chunks are written
+        self.db.create_upload_session(upload_id, user_id, filename, extension, size, UPLOAD_CHUNK_SIZE,
+                                      sha256.lower() if sha256 else None,
+                                      utc_timestamp(UPLOAD_SESSION_TTL_SECONDS))
+        with self._lock:
+            self._stats['sessions'] += 1
+        return self.get_session(upload_id, user_id)
+
+    def get_session(self, upload_id: str, user_id: int) -> Optional[Dict[str, Any]]:
+        """The user's live session with its received chunk indexes, or None"""
+        session = self.db.get_upload_session(upload_id)
+        if session is None or session['user_id'] != user_id or str(session['expires_at']) < utc_timestamp():
+            return None
+        session['chunks'] = -(-session['size'] // session['chunk_size'])
+        session['received'] = self.db.get_upload_chunks(upload_id)
+        return session
+
+    def write_chunk(self, session: Dict[str, Any], index: int, stream, checksum: str):
+        """pwrite chunk index from stream at its offset; recorded only if its SHA-256 matches"""
+        if not 0 <= index < session['chunks']:
+            raise UploadSessionError(f"Chunk index must be between 0 and {session['chunks'] - 1}")
+        offset = index * session['chunk_size']
+        expected = min(session['chunk_size'], session['size'] - offset)
+        digest = hashlib.sha256()
+        written = 0
+        fd = os.open(self._session_path(session['upload_id']), os.O_WRONLY)
+        try:
+            while written < expected:
+                data = stream.read(min(UPLOAD_READ_SIZE, expected - written))
+                if not data:
+                    break
+                os.pwrite(fd, data, offset + written)
+                digest.update(data)
+                written += len(data)
+            oversized = bool(stream.read(1))
+        finally:
+            os.close(fd)
+        if written != expected or oversized:
+            raise UploadSessionError(f'Chunk {index} must be exactly {expected} bytes')
+        if digest.hexdigest() != checksum.lower():
+            raise UploadSessionError(f'Chunk {index} checksum mismatch')
+        self.db.add_upload_chunk(session['upload_id'], index)
+        with self._lock:
+            self._stats['chunks'] += 1
+
+    def complete_session(self, session: Dict[str, Any]) -> Dict[str, Any]:
+        """Store the assembled file once every chunk has arrived"""
+        missing = sorted(set(range(session['chunks'])) - set(session['received']))
+        if missing:
+            raise UploadSessionError(f'Missing chunks: {missing[:20]}')
+        if not self.db.delete_upload_session(session['upload_id']):
+            raise UploadSessionError('Upload already completed')
+        return self.save_file(str(self._session_path(session['upload_id'])), session['extension'],
+                              session['sha256'])
+
+    def abort_session(self, session: Dict[str, Any]):
+        self.db.delete_upload_session(session['upload_id'])
+        self._session_path(session['upload_id']).unlink(missing_ok=True)
+
+    def expire_sessions(self) -> int:
+        """Delete chunked uploads past their expiry (run whenever a new one starts)"""
+        expired = self.db.delete_expired_upload_sessions(utc_timestamp())
+        for upload_id in expired:
+            self._session_path(upload_id).unlink(missing_ok=True)
+        with self._lock:
+            self._stats['expired_sessions'] += len(expired)
+        return len(expired)
+
+    def collect_garbage(self, grace_seconds: int = UPLOAD_GC_GRACE_SECONDS) -> int:
+        """Delete blobs no message references (idle for grace_seconds) and their previews; returns files removed"""
+        idle_before = utc_timestamp(-grace_seconds)
+        removed = 0
+        for filename in self.db.delete_unreferenced_upload_blobs(idle_before):
+            try:
+                (self.folder / filename).unlink()
+                removed += 1
+            except FileNotFoundError:
+                pass
+        if removed:
+            print(f"🧹 [Uploads] Removed {removed} unreferenced files")
+        with self._lock:
+            self._stats['collected'] += removed
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats)
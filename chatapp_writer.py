@@ -0,0 +1,135 @@
+"""
+ChatApp Writer - single background writer thread with group commit
+Request threads submit write jobs (functions taking a cursor); the writer runs every job
+that is queued in one transaction, each inside its own SAVEPOINT so a failing job only
+rolls back itself, then commits once. One fsync covers the whole batch.
+"""
+
+import contextvars
+import functools
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, Any, Callable, Optional
+
+
+class WriteQueue:
+    """Serializes writes through one thread and commits them in batches"""
+
+    def __init__(self, get_connection: Callable, begin_sql: Optional[str] = None,
+                 window_ms: float = 0, max_batch: int = 200, name: str = 'db-writer'):
+        self.get_connection = get_connection
+        self.begin_sql = begin_sql  # e.g. 'BEGIN IMMEDIATE' for SQLite; PostgreSQL begins implicitly
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self.name = name
+        self._lock = threading.Lock()
+        self._state = (None, queue.Queue())  # (pid, job queue of that process's writer thread)
+        self._stats = {'jobs': 0, 'failed': 0, 'batches': 0, 'largest_batch': 0, 'commit_failures': 0,
+                       'total_batch_ms': 0.0}
+
+    def submit(self, fn: Callable, *args) -> Future:
+        """Queue fn(cursor, *args); the future resolves after the batch commits"""
+        jobs = self._ensure_thread()
+        future = Future()
+        # Run in the submitter's context, so per-request statement counts include the job
+        jobs.put((functools.partial(contextvars.copy_context().run, fn), args, future))
+        return future
+
+    def run(self, fn: Callable, *args):
+        """Submit and wait for the result (re-raises the job's exception)"""
+        return self.submit(fn, *args).result()
+
+    def _ensure_thread(self) -> queue.Queue:
+        """This process's job queue, starting its writer thread first if needed.
+        Threads don't survive fork - each gunicorn worker starts its own writer. pid and queue are
+        published together once the thread runs, so no submitter pairs this pid with the parent's queue."""
+        pid, jobs = self._state
+        if pid == os.getpid():
+            return jobs
+        with self._lock:
+            pid, jobs = self._state
+            if pid != os.getpid():
+                jobs = queue.Queue()
+                threading.Thread(target=self._run, args=(jobs,), name=self.name, daemon=True).start()
+                self._state = (os.getpid(), jobs)
+        return jobs
+
+    def _collect(self, jobs: queue.Queue) -> list:
+        batch = [jobs.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(jobs.get(timeout=remaining))
+                else:
+                    batch.append(jobs.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self, jobs: queue.Queue):
+        while True:
+            batch = self._collect(jobs)
+            try:
+                self._commit_batch(batch)
+            except Exception as e:
+                print(f"❌ [{self.name}] Batch failed: {e}")
+
+    def _commit_batch(self, batch: list):
+        start = time.perf_counter()
+        outcomes = []
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            if self.begin_sql:
+                cursor.execute(self.begin_sql)
+            for fn, args, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                cursor.execute('SAVEPOINT write_job')
+                try:
+                    outcomes.append((future, fn(cursor, *args), None))
+                    cursor.execute('RELEASE SAVEPOINT write_job')
+                except Exception as e:
+                    cursor.execute('ROLLBACK TO SAVEPOINT write_job')
+                    cursor.execute('RELEASE SAVEPOINT write_job')
+                    outcomes.append((future, None, e))
+            conn.commit()
+        except Exception as e:
+            # Nothing in the batch was committed
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            with self._lock:
+                self._stats['commit_failures'] += 1
+                self._stats['failed'] += len(batch)
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            conn.close()
+
+        with self._lock:
+            self._stats['batches'] += 1
+            self._stats['jobs'] += len(outcomes)
+            self._stats['failed'] += sum(1 for _, _, error in outcomes if error is not None)
+            self._stats['largest_batch'] = max(self._stats['largest_batch'], len(outcomes))
+            self._stats['total_batch_ms'] += (time.perf_counter() - start) * 1000
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            batches = self._stats['batches']
+            return dict(self._stats, queued=self._state[1].qsize(), window_ms=self.window * 1000,
+                        avg_batch_size=round(self._stats['jobs'] / batches, 2) if batches else 0.0,
+                        avg_batch_ms=round(self._stats['total_batch_ms'] / batches, 3) if batches else 0.0)
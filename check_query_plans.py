@@ -0,0 +1,19 @@
+"""
+Check that every hot polling query uses an index (no full table scans)
+Run against the configured database: python check_query_plans.py
+Exits with status 1 if any query still scans a whole table.
+"""
+import sys
+from chatapp_database import ChatAppDatabase
+
+db = ChatAppDatabase()
+
+print("\n" + "="*70)
+print("🔍 HOT QUERY PLANS")
+print("="*70)
+
+ok = db.report_query_plans()
+
+print("="*70)
+print("✅ All hot queries use indexes" if ok else "❌ Some queries scan whole tables - check INDEXES in chatapp_database.py")
+sys.exit(0 if ok else 1)
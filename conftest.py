@@ -0,0 +1,51 @@
+"""Shared pytest fixtures: the Flask app, imported once into a scratch directory
+
+chatapp_simple opens integrated_users.db and uploads/ relative to the working directory
+when it is imported, so the first test that needs it moves there first.
+"""
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+os.environ.setdefault('PASSWORD_HASH_EXECUTOR', 'thread')  # No process pool inside the test run
+os.environ.setdefault('PREVIEW_WORKERS', '0')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+os.environ.setdefault('SECRET_KEY', 'pytest-only-secret-key-of-at-least-32-bytes')
+
+
+@pytest.fixture(scope='session')
+def chatapp():
+    """The chatapp_simple module, with its database and uploads in a temp directory"""
+    if 'chatapp_simple' not in sys.modules:
+        os.chdir(tempfile.mkdtemp(prefix='chatapp_test_'))
+    import chatapp_simple
+    return chatapp_simple
+
+
+@pytest.fixture
+def client(chatapp):
+    return chatapp.app.test_client()
+
+
+@pytest.fixture
+def signup(client):
+    """signup() -> (user_id, Authorization headers) for a new account"""
+    def create():
+        name = f'user_{uuid.uuid4().hex[:10]}'
+        response = client.post('/api/auth/signup', json={
+            'username': name, 'email': f'{name}@example.com', 'password': 'password123'})
+        assert response.status_code == 201, response.get_json()
+        body = response.get_json()
+        return body['user']['id'], {'Authorization': f"Bearer {body['token']}"}
+    return create
+
+
+@pytest.fixture
+def admin_headers(client):
+    """Authorization headers for the default administrator"""
+    response = client.post('/api/auth/login', json={'username': 'Ken Tse', 'password': 'admin123'})
+    assert response.status_code == 200, response.get_json()
+    return {'Authorization': f"Bearer {response.get_json()['token']}"}
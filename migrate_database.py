@@ -0,0 +1,24 @@
+"""
+Bring the configured database's schema up to date and report its version
+Run: python migrate_database.py
+The app also migrates on startup (see MIGRATIONS in chatapp_database.py); this is for deploy
+scripts and for checking a database by hand. Replaces the old one-off add_*_column.py scripts.
+Exits with status 1 if any migration is still pending (one failed).
+"""
+import sys
+from chatapp_database import ChatAppDatabase, MIGRATIONS
+
+db = ChatAppDatabase()  # Applies pending migrations
+
+print("\n" + "="*70)
+print("🛠️  SCHEMA MIGRATIONS")
+print("="*70)
+print(f"Schema version: {db.schema_version()} (latest {MIGRATIONS[-1][0]})")
+
+pending = db.pending_migrations()
+for version, description in pending:
+    print(f"   ❌ {version}: {description}")
+
+print("="*70)
+print("✅ Schema is up to date" if not pending else f"❌ {len(pending)} migration(s) pending - see errors above")
+sys.exit(0 if not pending else 1)
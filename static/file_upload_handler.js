@@ -13,7 +13,10 @@ class FileUploadHandler {
             'admin-chat': null,
             'admin-reply': null
         };
-        this.maxFileSize = 50 * 1024 * 1024; // 50MB limit
+        this.maxFileSize = 500 * 1024 * 1024; // 500MB limit for chunked uploads (CHUNKED_UPLOAD_MAX_SIZE)
+        this.maxSingleUploadSize = 50 * 1024 * 1024; // 50MB limit for one-request uploads
+        this.chunkedThreshold = 8 * 1024 * 1024; // Larger files are sent in resumable chunks
+        this.chunkRetries = 5; // Attempts per chunk before giving up
         this.init();
     }
 
@@ -46,9 +49,10 @@ class FileUploadHandler {
 
         console.log('File selected:', file.name, 'Context:', context);
 
-        // Check file size
-        if (file.size > this.maxFileSize) {
-            alert(`File is too large. Maximum size is ${this.maxFileSize / 1024 / 1024}MB`);
+        // Check file size (chunked uploads need crypto.subtle for the chunk checksums)
+        const maxSize = this.canUploadChunked() ? this.maxFileSize : this.maxSingleUploadSize;
+        if (file.size > maxSize) {
+            alert(`File is too large. Maximum size is ${maxSize / 1024 / 1024}MB`);
             event.target.value = '';
             return;
         }
@@ -61,7 +65,7 @@ class FileUploadHandler {
         this.showUploadingPreview(file, previewId, context);
 
         // Upload file to server
-        const uploadedData = await this.uploadFileToServer(file, context);
+        const uploadedData = await this.uploadFileToServer(file, context, previewId);
         
         if (uploadedData) {
             // Show final preview with uploaded file
@@ -85,13 +89,20 @@ class FileUploadHandler {
                 <i class="fas fa-spinner fa-spin" style="font-size: 24px; color: #667eea;"></i>
                 <div style="flex: 1;">
                     <div style="font-weight: 500; color: #333;">Uploading ${fileName}...</div>
-                    <div style="font-size: 0.85rem; color: #666;">${fileSize}</div>
+                    <div class="upload-progress" style="font-size: 0.85rem; color: #666;">${fileSize}</div>
                 </div>
             </div>
         `;
         preview.style.display = 'block';
     }
 
+    showUploadProgress(file, previewId, sent) {
+        const progress = document.querySelector(`#${previewId} .upload-progress`);
+        if (progress) {
+            progress.textContent = `${this.formatFileSize(file.size)} • ${Math.floor(sent * 100 / file.size)}%`;
+        }
+    }
+
     showFilePreview(file, previewId, context, uploadedData = null) {
         const preview = document.getElementById(previewId);
         if (!preview) return;
@@ -147,33 +158,124 @@ class FileUploadHandler {
         return this.uploadedFileData[context];
     }
 
-    async uploadFileToServer(file, context) {
+    async uploadFileToServer(file, context, previewId) {
         /**Upload file to server and store the response */
+        try {
+            const data = file.size > this.chunkedThreshold && this.canUploadChunked()
+                ? await this.uploadChunked(file, previewId)
+                : await this.uploadSingle(file);
+            this.uploadedFileData[context] = data;
+            console.log('File uploaded successfully:', data);
+            return data;
+        } catch (error) {
+            console.error('Error uploading file:', error);
+            alert('Failed to upload file: ' + error.message);
+            return null;
+        }
+    }
+
+    authHeaders() {
+        return { 'Authorization': `Bearer ${localStorage.getItem('authToken')}` };
+    }
+
+    canUploadChunked() {
+        // crypto.subtle only exists in secure contexts (HTTPS or localhost)
+        return Boolean(window.crypto && window.crypto.subtle);
+    }
+
+    async uploadSingle(file) {
+        /**Whole file in one multipart request */
         const formData = new FormData();
         formData.append('file', file);
 
-        try {
-            const response = await fetch('/api/upload-file', {
+        const response = await fetch('/api/upload', {
+            method: 'POST',
+            headers: this.authHeaders(),
+            body: formData
+        });
+        const data = await response.json();
+        if (!response.ok) {
+            throw new Error(data.error || 'Upload failed');
+        }
+        return data;
+    }
+
+    async uploadChunked(file, previewId) {
+        /**Resumable upload: start (or resume) a session, PUT the missing chunks, then complete it */
+        const resumeKey = `upload:${file.name}:${file.size}:${file.lastModified}`;
+        let session = null;
+
+        // Pick up a session left behind by a dropped connection or a page reload
+        const savedId = localStorage.getItem(resumeKey);
+        if (savedId) {
+            const response = await fetch(`/api/upload/sessions/${savedId}`, { headers: this.authHeaders() });
+            if (response.ok) {
+                session = await response.json();
+            }
+        }
+
+        if (!session) {
+            const response = await fetch('/api/upload/sessions', {
                 method: 'POST',
-                headers: {
-                    'Authorization': `Bearer ${localStorage.getItem('authToken')}`
-                },
-                body: formData
+                headers: { ...this.authHeaders(), 'Content-Type': 'application/json' },
+                body: JSON.stringify({ filename: file.name, size: file.size })
             });
+            const data = await response.json();
+            if (!response.ok) {
+                throw new Error(data.error || 'Upload failed');
+            }
+            session = data;
+            localStorage.setItem(resumeKey, session.upload_id);
+        }
 
-            if (response.ok) {
-                const data = await response.json();
-                this.uploadedFileData[context] = data;
-                console.log('File uploaded successfully:', data);
-                return data;
-            } else {
-                const error = await response.json();
-                throw new Error(error.error || 'Upload failed');
+        const received = new Set(session.received);
+        let sent = received.size * session.chunk_size;
+        for (let index = 0; index < session.chunks; index++) {
+            if (received.has(index)) continue;
+            const chunk = file.slice(index * session.chunk_size, (index + 1) * session.chunk_size);
+            await this.putChunk(session.upload_id, index, chunk);
+            sent += chunk.size;
+            this.showUploadProgress(file, previewId, Math.min(sent, file.size));
+        }
+
+        const response = await fetch(`/api/upload/sessions/${session.upload_id}/complete`, {
+            method: 'POST',
+            headers: this.authHeaders()
+        });
+        const data = await response.json();
+        if (!response.ok) {
+            throw new Error(data.error || 'Upload failed');
+        }
+        localStorage.removeItem(resumeKey);
+        return data;
+    }
+
+    async putChunk(uploadId, index, chunk) {
+        /**PUT one chunk with its SHA-256, retrying network errors and 5xx with backoff */
+        const body = await chunk.arrayBuffer();
+        const digest = await crypto.subtle.digest('SHA-256', body);
+        const checksum = Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+
+        for (let attempt = 1; ; attempt++) {
+            let response = null;
+            try {
+                response = await fetch(`/api/upload/sessions/${uploadId}/chunks/${index}`, {
+                    method: 'PUT',
+                    headers: { ...this.authHeaders(), 'X-Chunk-SHA256': checksum },
+                    body: body
+                });
+            } catch (error) {
+                if (attempt >= this.chunkRetries) throw error;
             }
-        } catch (error) {
-            console.error('Error uploading file:', error);
-            alert('Failed to upload file: ' + error.message);
-            return null;
+            if (response && response.ok) return;
+            if (response && response.status < 500) {
+                const error = await response.json().catch(() => ({}));
+                throw new Error(error.error || `Chunk ${index} was rejected`);
+            }
+            if (attempt >= this.chunkRetries) {
+                throw new Error(`Chunk ${index} failed after ${attempt} attempts`);
+            }
+            await new Promise(resolve => setTimeout(resolve, 1000 * 2 ** (attempt - 1)));
         }
     }
 
@@ -0,0 +1,109 @@
+"""Test the ASGI entry point: native long-poll routes and request bodies streamed into Flask"""
+import asyncio
+import hashlib
+import json
+
+import pytest
+
+
+@pytest.fixture
+def asgi(chatapp):
+    import chatapp_asgi
+    return chatapp_asgi.app
+
+
+def call(app, method, path, headers=(), chunks=(b'',), query=b''):
+    """Drive one HTTP request through the ASGI app -> (status, headers, body, body messages received)"""
+    scope = {
+        'type': 'http', 'http_version': '1.1', 'method': method, 'path': path, 'root_path': '',
+        'scheme': 'http', 'query_string': query, 'server': ('testserver', 80), 'client': ('127.0.0.1', 5000),
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+    }
+    messages = [{'type': 'http.request', 'body': chunk, 'more_body': n < len(chunks) - 1}
+                for n, chunk in enumerate(chunks)]
+    received = []
+    response = {'body': b''}
+
+    async def receive():
+        if len(received) < len(messages):
+            received.append(messages[len(received)])
+            return received[-1]
+        await asyncio.sleep(3600)  # The client stays connected
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+            response['headers'] = dict(message['headers'])
+        else:
+            response['body'] += message.get('body', b'')
+
+    asyncio.run(app(scope, receive, send))
+    return response['status'], response['headers'], response['body'], len(received)
+
+
+def login(app):
+    body = json.dumps({'username': 'Ken Tse', 'password': 'admin123'}).encode()
+    status, _, response, _ = call(app, 'POST', '/api/auth/login', [('Content-Type', 'application/json'),
+                                                                   ('Content-Length', str(len(body)))], [body])
+    assert status == 200
+    return json.loads(response)['token']
+
+
+def multipart(name, data, boundary='chatappboundary'):
+    return (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{name}"\r\n'
+            f'Content-Type: text/plain\r\n\r\n').encode() + data + f'\r\n--{boundary}--\r\n'.encode()
+
+
+def test_sync_is_answered_natively(asgi):
+    token = login(asgi)
+    body = json.dumps({'cursors': {}, 'wait': 0}).encode()
+    status, _, response, _ = call(asgi, 'POST', '/api/sync', [('Authorization', f'Bearer {token}'),
+                                                              ('Content-Type', 'application/json')], [body])
+    assert status == 200
+    assert 'cursors' in json.loads(response)
+
+    status, _, _, _ = call(asgi, 'POST', '/api/sync', chunks=[body])
+    assert status == 401
+
+
+def test_chunked_upload_body_reaches_flask(asgi):
+    token = login(asgi)
+    data = b'streamed through the ASGI bridge\n' * 4000
+    body = multipart('stream.txt', data)
+    chunks = [body[i:i + 16384] for i in range(0, len(body), 16384)]
+    headers = [('Authorization', f'Bearer {token}'),
+               ('Content-Type', 'multipart/form-data; boundary=chatappboundary')]  # No length: chunked
+    status, _, response, received = call(asgi, 'POST', '/api/upload', headers, chunks)
+    assert status in (200, 201)
+    assert json.loads(response)['sha256'] == hashlib.sha256(data).hexdigest()
+    assert received == len(chunks)
+
+    status, _, served, _ = call(asgi, 'GET', json.loads(response)['file_url'])
+    assert status == 200 and served == data
+
+
+def test_oversized_upload_is_refused_before_its_body_is_read(asgi, chatapp):
+    token = login(asgi)
+    size = chatapp.app.config['MAX_CONTENT_LENGTH'] + 1
+    headers = [('Authorization', f'Bearer {token}'), ('Content-Length', str(size)),
+               ('Content-Type', 'multipart/form-data; boundary=chatappboundary')]
+    status, _, _, received = call(asgi, 'POST', '/api/upload', headers, [b'x' * 65536] * 4)
+    assert status == 413
+    assert received == 0
+
+
+def test_signal_stream_takes_a_ticket_not_the_login_token(asgi, chatapp, monkeypatch):
+    monkeypatch.setattr(chatapp, 'SIGNAL_STREAM_MAX_AGE', 0)  # End the stream after its first line
+    token = login(asgi)
+    status, _, body, _ = call(asgi, 'POST', '/api/call/signals/ticket', [('Authorization', f'Bearer {token}')])
+    assert status == 200
+    ticket = json.loads(body)['ticket']
+
+    status, headers, body, _ = call(asgi, 'GET', '/api/call/signals/stream', query=f'ticket={ticket}'.encode())
+    assert status == 200
+    assert headers[b'content-type'].startswith(b'text/event-stream')
+    assert body.startswith(b'retry: 1000')
+    assert call(asgi, 'GET', '/api/call/signals/stream', query=f'ticket={token}'.encode())[0] == 401
+    assert call(asgi, 'GET', '/api/call/signals/stream', query=f'token={token}'.encode())[0] == 401
+    status, _, _, _ = call(asgi, 'GET', '/api/auth/user', [('Authorization', f'Bearer {ticket}')])
+    assert status == 401
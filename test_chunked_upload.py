@@ -0,0 +1,94 @@
+"""Test that a resumable upload only completes once every chunk has arrived intact"""
+import hashlib
+
+import pytest
+
+import chatapp_uploads
+
+CHUNK = 1024
+
+
+@pytest.fixture
+def start(client, monkeypatch):
+    """start(headers, data, **fields) -> session JSON, with small chunks so a few KB spans several"""
+    monkeypatch.setattr(chatapp_uploads, 'UPLOAD_CHUNK_SIZE', CHUNK)
+
+    def create(headers, data, **fields):
+        response = client.post('/api/upload/sessions', headers=headers,
+                               json=dict({'filename': 'big.txt', 'size': len(data)}, **fields))
+        assert response.status_code == 201, response.get_json()
+        return response.get_json()
+    return create
+
+
+def put_chunk(client, headers, session, index, data, checksum=None):
+    if checksum is None:
+        checksum = hashlib.sha256(data).hexdigest()
+    return client.put(f"/api/upload/sessions/{session['upload_id']}/chunks/{index}", data=data,
+                      headers=dict(headers, **{'X-Chunk-SHA256': checksum}))
+
+
+def chunks_of(data):
+    return [data[i:i + CHUNK] for i in range(0, len(data), CHUNK)]
+
+
+def test_missing_chunk_blocks_completion_until_resumed(client, signup, start):
+    _, headers = signup()
+    data = bytes(range(256)) * 10  # 2560 bytes: chunks of 1024, 1024 and 512
+    session = start(headers, data)
+    assert session['chunks'] == 3
+    parts = chunks_of(data)
+
+    assert put_chunk(client, headers, session, 2, parts[2]).status_code == 200
+    assert put_chunk(client, headers, session, 0, parts[0]).status_code == 200
+    response = client.post(f"/api/upload/sessions/{session['upload_id']}/complete", headers=headers)
+    assert response.status_code == 409
+    assert '[1]' in response.get_json()['error']
+
+    # Resume: the session lists what arrived, only the gap is sent again
+    resumed = client.get(f"/api/upload/sessions/{session['upload_id']}", headers=headers).get_json()
+    assert sorted(resumed['received']) == [0, 2]
+    assert put_chunk(client, headers, session, 1, parts[1]).status_code == 200
+    response = client.post(f"/api/upload/sessions/{session['upload_id']}/complete", headers=headers)
+    assert response.status_code == 201
+    assert client.get(response.get_json()['file_url']).data == data
+
+
+def test_corrupt_chunk_is_rejected_and_not_recorded(client, signup, start):
+    _, headers = signup()
+    data = b'a' * CHUNK + b'b' * 100
+    session = start(headers, data)
+    good = chunks_of(data)[0]
+
+    response = put_chunk(client, headers, session, 0, b'x' + good[1:], checksum=hashlib.sha256(good).hexdigest())
+    assert response.status_code == 400
+    assert 'checksum' in response.get_json()['error']
+    assert put_chunk(client, headers, session, 0, good, checksum='').status_code == 400
+    assert put_chunk(client, headers, session, 0, good[:-1]).status_code == 400  # Short chunk
+    assert put_chunk(client, headers, session, 0, good + b'!').status_code == 400  # Long chunk
+    assert put_chunk(client, headers, session, 2, good).status_code == 400  # Past the last chunk
+    received = client.get(f"/api/upload/sessions/{session['upload_id']}", headers=headers).get_json()['received']
+    assert received == []
+
+
+def test_assembled_file_must_match_declared_sha256(client, signup, start):
+    _, headers = signup()
+    data = b'declared ' * 300
+    session = start(headers, data, sha256=hashlib.sha256(b'something else').hexdigest())
+    for index, part in enumerate(chunks_of(data)):
+        assert put_chunk(client, headers, session, index, part).status_code == 200
+    response = client.post(f"/api/upload/sessions/{session['upload_id']}/complete", headers=headers)
+    assert response.status_code == 409
+    assert 'SHA-256' in response.get_json()['error']
+
+
+def test_session_belongs_to_its_owner(client, signup, start):
+    _, owner = signup()
+    _, other = signup()
+    data = b'mine ' * 100
+    session = start(owner, data)
+
+    assert client.get(f"/api/upload/sessions/{session['upload_id']}", headers=other).status_code == 404
+    assert put_chunk(client, other, session, 0, data).status_code == 404
+    response = client.post(f"/api/upload/sessions/{session['upload_id']}/complete", headers=other)
+    assert response.status_code == 404
@@ -0,0 +1,103 @@
+"""Test that pooled connections go back to the pool (rolled back) when the caller's work fails"""
+import os
+import tempfile
+import types
+
+import pytest
+
+import chatapp_database
+from chatapp_database import (ChatAppDatabase, PoolTimeoutError, PostgreSQLConnectionPool,
+                              PostgreSQLConnectionWrapper)
+
+
+class FakePgConnection:
+    """Just enough of a psycopg2 connection for the pool"""
+
+    def __init__(self):
+        self.closed = False
+        self.rollbacks = 0
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def pg_connect(monkeypatch):
+    """Replace psycopg2.connect; returns the connections it opened (psycopg2 may not be installed)"""
+    opened = []
+
+    def connect(db_url):
+        opened.append(FakePgConnection())
+        return opened[-1]
+
+    monkeypatch.setattr(chatapp_database, 'psycopg2', types.SimpleNamespace(connect=connect), raising=False)
+    return opened
+
+
+def test_postgres_connection_returns_to_pool_after_error(pg_connect):
+    pool = PostgreSQLConnectionPool('postgresql://test', max_size=1, timeout=0.2)
+    with pytest.raises(RuntimeError):
+        conn = PostgreSQLConnectionWrapper(pool.acquire(), pool)
+        try:
+            raise RuntimeError('query failed')
+        finally:
+            conn.close()
+    conn.close()  # A second close is a no-op, not a second release
+
+    stats = pool.stats()
+    assert stats['in_use'] == 0 and stats['idle'] == 1
+    assert pg_connect[0].rollbacks == 1  # Whatever the failed call left uncommitted is gone
+    assert pool.acquire() is pg_connect[0]  # Reused, and no timeout: the only slot was free again
+    assert stats['created'] == 1
+
+
+def test_postgres_pool_is_bounded(pg_connect):
+    pool = PostgreSQLConnectionPool('postgresql://test', max_size=1, timeout=0.1)
+    held = pool.acquire()
+    with pytest.raises(PoolTimeoutError):
+        pool.acquire()
+    pool.release(held)
+    assert pool.acquire() is held
+    assert pool.stats()['timeouts'] == 1
+
+
+def test_failed_connect_frees_its_slot(monkeypatch):
+    def connect(db_url):
+        raise OSError('connection refused')
+
+    monkeypatch.setattr(chatapp_database, 'psycopg2', types.SimpleNamespace(connect=connect), raising=False)
+    pool = PostgreSQLConnectionPool('postgresql://test', max_size=1, timeout=0.1)
+    for _ in range(2):
+        with pytest.raises(OSError):
+            pool.acquire()  # Not PoolTimeoutError: the first failure gave its slot back
+    assert pool.stats()['size'] == 0
+
+
+def test_sqlite_connection_is_reused_and_rolled_back_after_error():
+    db = ChatAppDatabase(os.path.join(tempfile.mkdtemp(), 'pool_test.db'))
+    before = db.pool_stats()
+    with pytest.raises(RuntimeError):
+        conn = db.get_connection()
+        try:
+            conn.cursor().execute("INSERT INTO data_versions (name, version) VALUES ('pool_test', 1)")
+            raise RuntimeError('request failed')
+        finally:
+            conn.close()
+
+    conn = db.get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM data_versions WHERE name = 'pool_test'")
+        assert cursor.fetchone()[0] == 0
+    finally:
+        conn.close()
+    after = db.pool_stats()
+    assert after['nested'] == before['nested']  # The failed checkout was released, not left in use
+    assert after['reused'] == before['reused'] + 2
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-q'])
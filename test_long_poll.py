@@ -0,0 +1,112 @@
+"""Test that a parked long poll returns as soon as the change it waits for is published"""
+import asyncio
+import os
+import tempfile
+import threading
+import time
+
+from chatapp_notify import ChangeNotifier, FileChangeNotifier
+
+
+def later(delay, fn, *args):
+    timer = threading.Timer(delay, fn, args)
+    timer.start()
+    return timer
+
+
+def test_wait_wakes_on_publish_from_another_thread():
+    notifier = ChangeNotifier()
+    since = notifier.snapshot(['conversation:1'])
+    later(0.2, notifier.publish, ['conversation:2'])  # Another key: still parked
+    timer = later(0.4, notifier.publish, ['conversation:1'])
+    started = time.monotonic()
+    assert notifier.wait(['conversation:1'], since, 10)
+    assert 0.3 < time.monotonic() - started < 5
+    timer.join()
+
+    # Published between snapshot and wait: returns at once instead of missing it
+    since = notifier.snapshot(['conversation:1'])
+    notifier.publish(['conversation:1'])
+    assert notifier.wait(['conversation:1'], since, 10)
+    assert not notifier.wait(['conversation:1'], notifier.snapshot(['conversation:1']), 0.1)
+
+
+def test_wait_async_wakes_on_publish_from_another_thread():
+    notifier = ChangeNotifier()
+
+    async def park():
+        since = notifier.snapshot(['signals:7'])
+        later(0.2, notifier.publish, ['signals:7'])
+        started = time.monotonic()
+        woken = await notifier.wait_async(['signals:7'], since, 10)
+        return woken, time.monotonic() - started
+
+    woken, elapsed = asyncio.run(park())
+    assert woken and elapsed < 5
+    assert notifier.stats()['waiting'] == 0
+
+
+def test_file_notifier_wakes_another_worker():
+    path = os.path.join(tempfile.mkdtemp(), 'notify')
+    waiter, publisher = FileChangeNotifier(path), FileChangeNotifier(path)
+    since = waiter.snapshot(['conversations'])
+    later(0.3, publisher.publish, ['conversations'])
+    started = time.monotonic()
+    assert waiter.wait(['conversations'], since, 10)
+    assert time.monotonic() - started < 5
+
+
+def long_poll_in_thread(client, method, url, **kwargs):
+    """Start the request in a thread -> (thread, result dict filled with response and elapsed time)"""
+    result = {}
+
+    def run():
+        started = time.monotonic()
+        result['response'] = client.open(url, method=method, **kwargs)
+        result['elapsed'] = time.monotonic() - started
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread, result
+
+
+def test_message_long_poll_returns_when_admin_replies(chatapp, client, signup, admin_headers):
+    user_id, headers = signup()
+    sent = client.post('/api/messages/send', headers=headers, json={'message': 'hello'})
+    since_id = sent.get_json()['message_id']
+
+    thread, result = long_poll_in_thread(chatapp.app.test_client(), 'GET',
+                                         f'/api/messages?since_id={since_id}&wait=20', headers=headers)
+    time.sleep(0.3)
+    assert thread.is_alive()  # Parked: nothing after since_id yet
+    reply = client.post('/api/messages/send', headers=admin_headers, json={'message': 'hi', 'user_id': user_id})
+    thread.join(10)
+    assert not thread.is_alive()
+    assert result['response'].status_code == 200
+    assert [m['id'] for m in result['response'].get_json()] == [reply.get_json()['message_id']]
+    assert result['elapsed'] < chatapp.LONG_POLL_RECHECK
+
+
+def test_message_long_poll_times_out_with_nothing_new(client, signup):
+    _, headers = signup()
+    since_id = client.post('/api/messages/send', headers=headers, json={'message': 'hello'}).get_json()['message_id']
+    started = time.monotonic()
+    response = client.get(f'/api/messages?since_id={since_id}&wait=0.5', headers=headers)
+    assert response.status_code == 200 and response.get_json() == []
+    assert 0.4 < time.monotonic() - started < 5
+
+
+def test_sync_long_poll_returns_when_admin_replies(chatapp, client, signup, admin_headers):
+    user_id, headers = signup()
+    since_id = client.post('/api/messages/send', headers=headers, json={'message': 'hello'}).get_json()['message_id']
+    first = client.post('/api/sync', headers=headers, json={'cursors': {}, 'since_id': since_id}).get_json()
+
+    thread, result = long_poll_in_thread(chatapp.app.test_client(), 'POST', '/api/sync', headers=headers,
+                                         json={'cursors': first['cursors'], 'since_id': since_id, 'wait': 20})
+    time.sleep(0.3)
+    assert thread.is_alive()
+    client.post('/api/messages/send', headers=admin_headers, json={'message': 'hi', 'user_id': user_id})
+    thread.join(10)
+    assert not thread.is_alive()
+    body = result['response'].get_json()
+    assert [m['message'] for m in body['messages']['items']] == ['hi']
+    assert result['elapsed'] < chatapp.LONG_POLL_RECHECK
@@ -0,0 +1,117 @@
+"""Test that history pages and search cover both the hot and archive tables"""
+import os
+import tempfile
+
+from chatapp_database import ChatAppDatabase
+
+
+def make_db():
+    path = os.path.join(tempfile.mkdtemp(), 'archive_test.db')
+    db = ChatAppDatabase(path)
+    user_id = db.create_user('archive_user', 'archive@example.com', 'password123')
+    return db, user_id
+
+
+def send_old(db, user_id, texts, unread=()):
+    """Send messages dated 2020 (read unless their text is in unread)"""
+    ids = [db.send_message(user_id, 'admin', text) for text in texts]
+    conn = db.get_connection()
+    try:
+        cursor = conn.cursor()
+        for message_id, text in zip(ids, texts):
+            cursor.execute('UPDATE admin_messages SET timestamp = ?, is_read = ? WHERE id = ?',
+                           ('2020-01-01 00:00:00', 0 if text in unread else 1, message_id))
+        conn.commit()
+    finally:
+        conn.close()
+    return ids
+
+
+def test_unread_message_does_not_hide_archived_history():
+    db, user_id = make_db()
+    first, second, third = send_old(db, user_id, ['first', 'second', 'third'], unread={'second'})
+    fourth = db.send_message(user_id, 'user', 'fourth')
+    assert db.archive_messages('2021-01-01 00:00:00') == 2  # 'second' is unread and stays hot
+
+    ids = [m['id'] for m in db.get_messages(user_id, limit=10)]
+    assert ids == [first, second, third, fourth]
+    ids = [m['id'] for m in db.get_messages(user_id, limit=2)]
+    assert ids == [third, fourth]
+    ids = [m['id'] for m in db.get_messages(user_id, limit=2, before_id=third)]
+    assert ids == [first, second]
+
+
+def test_new_message_poll_skips_archive():
+    db, user_id = make_db()
+    first, second = send_old(db, user_id, ['first', 'second'])
+    third = db.send_message(user_id, 'user', 'third')
+    db.archive_messages('2021-01-01 00:00:00')
+
+    assert [m['id'] for m in db.get_messages(user_id, since_id=first)] == [third]
+
+
+def archive_queries(db):
+    return sum(s['calls'] for s in db.query_stats(limit=1000)['statements']
+               if 'admin_messages_archive' in s['statement'])
+
+
+def summary_row(db, user_id):
+    conn = db.get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT message_count, last_message_time, archived_max_id
+            FROM conversation_summary WHERE user_id = ?
+        ''', (user_id,))
+        return tuple(cursor.fetchone())
+    finally:
+        conn.close()
+
+
+def test_history_page_newer_than_archive_skips_it():
+    db, user_id = make_db()
+    old = send_old(db, user_id, ['first', 'second'])
+    db.archive_messages('2021-01-01 00:00:00')
+    assert summary_row(db, user_id)[2] == old[-1]
+    recent = [db.send_message(user_id, 'user', f'recent {n}') for n in range(3)]
+
+    db.reset_query_stats()
+    assert [m['id'] for m in db.get_messages(user_id, limit=3)] == recent
+    assert archive_queries(db) == 0
+
+    # The next page back reaches the archived ids
+    assert [m['id'] for m in db.get_messages(user_id, limit=3, before_id=recent[0])] == old
+    assert archive_queries(db) == 1
+
+
+def test_purge_refreshes_conversation_summary():
+    db, user_id = make_db()
+    send_old(db, user_id, ['first', 'second'])
+    db.archive_messages('2021-01-01 00:00:00')
+    assert db.purge_archive('2021-01-01 00:00:00') == 2
+
+    assert summary_row(db, user_id) == (0, None, None)
+    assert db.get_messages(user_id) == []
+
+
+def test_search_finds_archived_messages():
+    db, user_id = make_db()
+    send_old(db, user_id, ['the first note', 'the second note', 'the third note'], unread={'the second note'})
+    db.send_message(user_id, 'user', 'a fourth note')
+    db.archive_messages('2021-01-01 00:00:00')
+
+    assert len(db.search_messages('third')['results']) == 1
+    assert len(db.search_messages('note', user_id=user_id)['results']) == 4
+    page = db.search_messages('note', limit=3)
+    rest = db.search_messages('note', limit=3, cursor_after=page['next_cursor'])
+    assert len({r['id'] for r in page['results'] + rest['results']}) == 4
+    assert rest['next_cursor'] is None
+
+
+if __name__ == '__main__':
+    test_unread_message_does_not_hide_archived_history()
+    test_new_message_poll_skips_archive()
+    test_history_page_newer_than_archive_skips_it()
+    test_purge_refreshes_conversation_summary()
+    test_search_finds_archived_messages()
+    print("✅ Archive history tests passed")
@@ -0,0 +1,38 @@
+"""Test who may scrape /metrics: the administrator by default, only the scrape token once one is set"""
+import pytest
+
+
+@pytest.fixture
+def no_token(chatapp, monkeypatch):
+    monkeypatch.setattr(chatapp, 'METRICS_TOKEN', '')
+
+
+@pytest.fixture
+def token(chatapp, monkeypatch):
+    monkeypatch.setattr(chatapp, 'METRICS_TOKEN', 'scrape-token-for-tests')
+    return 'scrape-token-for-tests'
+
+
+def test_without_token_only_the_administrator_reads_metrics(no_token, client, signup, admin_headers):
+    _, user = signup()
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer not-a-jwt'}).status_code == 401
+    assert client.get('/metrics', headers=user).status_code == 403
+
+    response = client.get('/metrics', headers=admin_headers)
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain')
+    assert 'chatapp_http_requests_total' in response.get_data(as_text=True)
+
+
+def test_with_token_only_the_token_reads_metrics(token, client, signup, admin_headers):
+    _, user = signup()
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong-token'}).status_code == 401
+    assert client.get('/metrics', headers={'Authorization': token}).status_code == 401  # Scheme required
+    assert client.get('/metrics', headers=user).status_code == 401
+    assert client.get('/metrics', headers=admin_headers).status_code == 401  # A JWT is not the scrape token
+
+    response = client.get('/metrics', headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 200
+    assert 'chatapp_http_requests_total' in response.get_data(as_text=True)
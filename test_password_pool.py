@@ -0,0 +1,95 @@
+"""Test the bcrypt worker pool: saturation answers 'busy', and pool workers never re-run the app"""
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+import pytest
+
+from chatapp_passwords import PasswordHasher, PasswordHasherBusy, PASSWORD_HASH_RETRY_AFTER
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'chatapp_simple.py')
+
+
+def test_saturated_hasher_rejects():
+    hasher = PasswordHasher(executor='thread', workers=1, max_pending=1, rounds=4)
+    busy = threading.Thread(target=hasher._run, args=('hash', time.sleep, 0.5))
+    busy.start()
+    time.sleep(0.1)
+    with pytest.raises(PasswordHasherBusy):
+        hasher.hash('secret123')
+    busy.join()
+    assert hasher.stats()['rejected'] == 1
+    assert hasher.check('secret123', hasher.hash('secret123'))
+
+
+def test_login_answers_429_while_the_hasher_is_saturated(chatapp, client, monkeypatch):
+    hasher = PasswordHasher(executor='thread', workers=1, max_pending=1, rounds=4)
+    monkeypatch.setattr(chatapp.db, 'passwords', hasher)
+    busy = threading.Thread(target=hasher._run, args=('hash', time.sleep, 0.5))
+    busy.start()
+    time.sleep(0.1)
+    try:
+        for path in ('/api/auth/login', '/api/auth/signup'):
+            response = client.post(path, json={'username': 'Ken Tse', 'email': 'storm@example.com',
+                                               'password': 'admin123'})
+            assert response.status_code == 429
+            assert response.headers['Retry-After'] == str(PASSWORD_HASH_RETRY_AFTER)
+    finally:
+        busy.join()
+    assert client.post('/api/auth/login', json={'username': 'Ken Tse', 'password': 'admin123'}).status_code == 200
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def run_dev_server(cwd, port, login):
+    """Start `python chatapp_simple.py`, optionally log in once, stop it; returns its output"""
+    env = dict(os.environ, PORT=str(port), PASSWORD_HASH_EXECUTOR='process', PYTHONUNBUFFERED='1')
+    log_path = os.path.join(cwd, 'server.log')
+    log = open(log_path, 'w')
+    server = subprocess.Popen([sys.executable, APP], cwd=cwd, env=env, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        deadline = time.monotonic() + 60
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError:
+                assert time.monotonic() < deadline and server.poll() is None, 'dev server did not start'
+                time.sleep(0.2)
+        if login:
+            body = json.dumps({'username': 'Ken Tse', 'password': 'admin123'}).encode()
+            request = urllib.request.Request(f'http://127.0.0.1:{port}/api/auth/login', data=body,
+                                             headers={'Content-Type': 'application/json'})
+            with urllib.request.urlopen(request, timeout=30) as response:
+                assert response.status == 200
+    finally:
+        server.send_signal(signal.SIGINT)  # Ctrl-C: lets the pool shut its workers down
+        server.wait(timeout=30)
+        log.close()
+    with open(log_path) as f:
+        return f.read()
+
+
+def test_dev_server_pool_does_not_rerun_app():
+    cwd = tempfile.mkdtemp()
+    run_dev_server(cwd, free_port(), login=False)  # Creates the database and the admin
+    # Existing database: the first hash happens on a request thread, so the pool is not forked
+    output = run_dev_server(cwd, free_port(), login=True)
+    assert output.count('Using SQLite database') == 1, output
+
+
+if __name__ == '__main__':
+    test_saturated_hasher_rejects()
+    test_dev_server_pool_does_not_rerun_app()
+    print("✅ Password pool tests passed")
@@ -0,0 +1,74 @@
+"""Test the call signal stores: TTL expiry, per-recipient queue bound, wakeups, shared delivery"""
+import os
+import tempfile
+import threading
+import time
+
+import pytest
+
+from chatapp_database import ChatAppDatabase
+from chatapp_signals import DatabaseSignalStore, InMemorySignalStore
+
+RECIPIENT, SENDER = 7, 3
+
+
+@pytest.fixture(scope='module')
+def db():
+    return ChatAppDatabase(os.path.join(tempfile.mkdtemp(), 'signals_test.db'))
+
+
+@pytest.fixture(params=['memory', 'database'])
+def make_store(request, db):
+    def make(**kwargs):
+        if request.param == 'memory':
+            return InMemorySignalStore(**kwargs)
+        store = DatabaseSignalStore(db, **kwargs)
+        store.drain(RECIPIENT)  # Leftovers from the previous test
+        return store
+    return make
+
+
+def test_stale_ice_candidates_expire(make_store):
+    store = make_store(ttl=30, ice_ttl=0.05)
+    store.push(RECIPIENT, SENDER, {'type': 'ice', 'candidate': 'old'})
+    store.push(RECIPIENT, SENDER, {'type': 'offer', 'sdp': 'v=0'})
+    time.sleep(0.1)
+    store.push(RECIPIENT, SENDER, {'type': 'ice', 'candidate': 'fresh'})
+
+    signals = store.drain(RECIPIENT)
+    assert [s['signal'].get('candidate', s['signal']['type']) for s in signals] == ['offer', 'fresh']
+    assert all(s['from'] == SENDER for s in signals)
+    assert store.drain(RECIPIENT) == []
+    assert store.stats()['expired'] == 1 and store.stats()['delivered'] == 2
+
+
+def test_queue_keeps_the_newest_signals(make_store):
+    store = make_store(max_queue=3)
+    for n in range(5):
+        store.push(RECIPIENT, SENDER, {'type': 'ice', 'candidate': n})
+    assert [s['signal']['candidate'] for s in store.drain(RECIPIENT)] == [2, 3, 4]
+    assert store.stats()['dropped'] == 2
+
+
+def test_waiting_recipient_is_woken_by_a_push(make_store):
+    store = make_store()
+    timer = threading.Timer(0.1, store.push, (RECIPIENT, SENDER, {'type': 'answer'}))
+    timer.start()
+    started = time.monotonic()
+    signals = store.wait(RECIPIENT, timeout=5)
+    timer.join()
+    assert [s['signal']['type'] for s in signals] == ['answer']
+    assert time.monotonic() - started < 2
+
+
+def test_database_store_delivers_across_workers(db):
+    # Two stores on one database stand in for two gunicorn workers
+    sender_worker, recipient_worker = DatabaseSignalStore(db), DatabaseSignalStore(db)
+    recipient_worker.drain(RECIPIENT)
+    sender_worker.push(RECIPIENT, SENDER, {'type': 'offer'})
+    assert [s['signal']['type'] for s in recipient_worker.drain(RECIPIENT)] == ['offer']
+    assert sender_worker.drain(RECIPIENT) == []
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-q'])
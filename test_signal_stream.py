@@ -0,0 +1,69 @@
+"""Test that the signal stream URL carries a short-lived ticket, never the login token"""
+import logging
+
+import pytest
+
+from chatapp_logging import RedactQueryFilter
+
+
+@pytest.fixture
+def ticket(client, signup):
+    """(login headers, stream ticket) for a new user"""
+    _, headers = signup()
+    response = client.post('/api/call/signals/ticket', headers=headers)
+    assert response.status_code == 200
+    assert response.get_json()['expires_in'] > 0
+    return headers, response.get_json()['ticket']
+
+
+def open_stream(client, query='', headers=None):
+    """GET the stream -> (status, first chunk of the body); the stream is closed after it"""
+    response = client.get(f'/api/call/signals/stream{query}', headers=headers, buffered=False)
+    try:
+        return response.status_code, next(iter(response.response), b'')
+    finally:
+        response.close()
+
+
+def test_ticket_opens_the_stream(client, ticket):
+    _, stream_ticket = ticket
+    status, first = open_stream(client, f'?ticket={stream_ticket}')
+    assert status == 200
+    assert first == b'retry: 1000\n\n'
+
+
+def test_login_token_is_refused_in_the_url(client, ticket):
+    headers, _ = ticket
+    login_token = headers['Authorization'][7:]
+    assert open_stream(client, f'?token={login_token}')[0] == 401
+    assert open_stream(client, f'?ticket={login_token}')[0] == 401
+    assert open_stream(client, headers=headers)[0] == 200  # Non-browser clients may still send the header
+
+
+def test_ticket_is_not_a_login_token(client, ticket):
+    _, stream_ticket = ticket
+    response = client.get('/api/auth/user', headers={'Authorization': f'Bearer {stream_ticket}'})
+    assert response.status_code == 401
+    assert client.post('/api/call/signals/ticket').status_code == 401
+
+
+def test_expired_ticket_is_refused(chatapp, client, signup, monkeypatch):
+    _, headers = signup()
+    monkeypatch.setattr(chatapp, 'SIGNAL_STREAM_TICKET_TTL', -1)
+    expired = client.post('/api/call/signals/ticket', headers=headers).get_json()['ticket']
+    status, body = open_stream(client, f'?ticket={expired}')
+    assert status == 401 and b'expired' in body
+
+
+@pytest.mark.parametrize('logger, args', [
+    ('werkzeug', ('127.0.0.1', '-', '"GET /api/call/signals/stream?ticket=SECRET&x=1 HTTP/1.1"', '200', '-')),
+    ('uvicorn.access', ('127.0.0.1', 'GET', '/api/call/signals/stream?token=SECRET', '1.1', 200)),
+])
+def test_access_log_lines_hide_credentials(chatapp, logger, args):
+    redact = [f for f in logging.getLogger(logger).filters if isinstance(f, RedactQueryFilter)]
+    assert len(redact) == 1  # Attached by configure_logging
+    record = logging.LogRecord(logger, logging.INFO, __file__, 0, ' '.join(['%s'] * len(args)), args, None)
+    redact[0].filter(record)
+    line = record.getMessage()
+    assert 'SECRET' not in line
+    assert '/api/call/signals/stream?' in line
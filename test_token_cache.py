@@ -0,0 +1,83 @@
+"""Test that cached tokens follow the account: role changes and deletes apply at once, in every worker"""
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import jwt
+import pytest
+
+from chatapp_notify import FileChangeNotifier
+from chatapp_tokens import TokenCache
+
+SECRET = 'token-cache-test-secret-of-32-bytes!'
+
+
+def make_token(user_id, role='user'):
+    return jwt.encode({'user_id': user_id, 'role': role, 'exp': datetime.utcnow() + timedelta(hours=1)},
+                      SECRET, algorithm='HS256')
+
+
+def test_role_change_and_delete_reach_another_worker():
+    users = {5: {'role': 'user'}}
+    path = os.path.join(tempfile.mkdtemp(), 'tokens.notify')
+    # Two caches with their own notifiers on one file stand in for two gunicorn workers
+    admin_worker = TokenCache(SECRET, load_user=users.get, notifier=FileChangeNotifier(path))
+    other_worker = TokenCache(SECRET, load_user=users.get, notifier=FileChangeNotifier(path))
+    token = make_token(5)
+    assert other_worker.decode(token)['role'] == 'user'
+    assert other_worker.lookup(token) is not None  # Cached
+
+    users[5] = {'role': 'paid'}
+    admin_worker.invalidate_user(5)
+    deadline = time.monotonic() + 5
+    while other_worker.lookup(token) is not None:
+        assert time.monotonic() < deadline, 'the other worker kept the stale claims'
+        time.sleep(0.05)
+    assert other_worker.decode(token)['role'] == 'paid'  # The role comes from the account, not the JWT
+
+    del users[5]
+    admin_worker.invalidate_user(5)
+    deadline = time.monotonic() + 5
+    while other_worker.lookup(token) is not None:
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    with pytest.raises(jwt.InvalidTokenError):
+        other_worker.decode(token)
+    assert other_worker.stats()['rejected'] == 1
+
+
+def test_cache_is_bounded_and_honours_exp():
+    cache = TokenCache(SECRET, max_size=2)
+    tokens = [make_token(n) for n in range(3)]
+    for token in tokens:
+        cache.decode(token)
+    assert cache.lookup(tokens[0]) is None and cache.stats()['evicted'] == 1
+
+    expiring = jwt.encode({'user_id': 9, 'exp': datetime.utcnow() + timedelta(seconds=1)}, SECRET, algorithm='HS256')
+    cache.decode(expiring)
+    time.sleep(1.1)
+    with pytest.raises(jwt.ExpiredSignatureError):
+        cache.lookup(expiring)
+
+
+def test_admin_actions_apply_to_cached_tokens(chatapp, client, signup, admin_headers):
+    user_id, headers = signup()
+    assert client.get('/api/admin/users', headers=headers).status_code == 403  # Cached as 'user'
+
+    response = client.post(f'/api/admin/users/{user_id}/role', headers=admin_headers, json={'role': 'administrator'})
+    assert response.status_code == 200
+    assert client.get('/api/admin/users', headers=headers).status_code == 200
+
+    response = client.post(f'/api/admin/users/{user_id}/role', headers=admin_headers, json={'role': 'user'})
+    assert response.status_code == 200
+    assert client.post(f'/api/admin/users/{user_id}/delete', headers=admin_headers).status_code == 200
+    response = client.get('/api/auth/user', headers=headers)
+    assert response.status_code == 401
+
+    assert client.post(f'/api/admin/users/{user_id}/restore', headers=admin_headers).status_code == 200
+    assert client.get('/api/auth/user', headers=headers).status_code == 200
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-q'])
@@ -0,0 +1,54 @@
+"""Test that a repeated upload is stored once, and that a hash alone never yields a file URL"""
+import hashlib
+import io
+
+
+def upload(client, headers, data, name='notes.txt'):
+    return client.post('/api/upload', headers=headers, content_type='multipart/form-data',
+                       data={'file': (io.BytesIO(data), name)})
+
+
+def test_repeated_upload_is_stored_once(chatapp, client, signup):
+    _, headers = signup()
+    data = b'the same bytes, twice ' * 100
+    first = upload(client, headers, data)
+    assert first.status_code == 201
+    second = upload(client, headers, data, name='copy.txt')
+    assert second.status_code == 200
+    first, second = first.get_json(), second.get_json()
+    assert second['duplicate'] and not first['duplicate']
+    assert first['file_url'] == second['file_url'] == f"/api/files/{hashlib.sha256(data).hexdigest()}.txt"
+    assert second['original_filename'] == 'copy.txt'
+    stored = [p for p in chatapp.upload_store.folder.iterdir() if p.name.startswith(first['sha256'])]
+    assert len(stored) == 1
+    assert client.get(first['file_url']).data == data
+
+
+def test_hash_alone_does_not_return_a_stored_file(client, signup):
+    _, owner = signup()
+    data = b'private content of another user'
+    sha256 = upload(client, owner, data).get_json()['sha256']
+
+    _, other = signup()
+    assert client.get(f'/api/upload/{sha256}', headers=other).status_code in (404, 405)
+    response = client.post('/api/upload/sessions', headers=other,
+                           json={'filename': 'guess.txt', 'size': len(data), 'sha256': sha256})
+    assert response.status_code == 201
+    assert 'file_url' not in response.get_json()  # A new session: the bytes still have to be sent
+
+
+def test_chunked_upload_of_stored_content_is_deduplicated(client, signup):
+    _, headers = signup()
+    data = b'chunked duplicate ' * 50
+    stored = upload(client, headers, data).get_json()
+
+    session = client.post('/api/upload/sessions', headers=headers,
+                          json={'filename': 'again.txt', 'size': len(data)}).get_json()
+    assert session['chunks'] == 1
+    response = client.put(f"/api/upload/sessions/{session['upload_id']}/chunks/0", data=data,
+                          headers=dict(headers, **{'X-Chunk-SHA256': hashlib.sha256(data).hexdigest()}))
+    assert response.status_code == 200
+    response = client.post(f"/api/upload/sessions/{session['upload_id']}/complete", headers=headers)
+    assert response.status_code == 200
+    assert response.get_json()['duplicate']
+    assert response.get_json()['file_url'] == stored['file_url']
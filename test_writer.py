@@ -0,0 +1,114 @@
+"""Test the group-commit writer: failing jobs roll back alone, failed commits roll back the batch"""
+import os
+import sqlite3
+import tempfile
+
+import pytest
+
+from chatapp_database import ChatAppDatabase
+from chatapp_writer import WriteQueue
+
+
+class FailingCommit:
+    """Connection whose commit fails (disk full, lost connection...)"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    def commit(self):
+        raise sqlite3.OperationalError('disk I/O error')
+
+
+def make_writer(window_ms=200, fail_commit=False):
+    path = os.path.join(tempfile.mkdtemp(), 'writer_test.db')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE notes (id INTEGER PRIMARY KEY, text TEXT UNIQUE)')
+    conn.commit()
+    conn.close()
+
+    def get_connection():
+        conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        return FailingCommit(conn) if fail_commit else conn
+
+    def rows():
+        with sqlite3.connect(path) as conn:
+            return [text for (text,) in conn.execute('SELECT text FROM notes ORDER BY id')]
+
+    return WriteQueue(get_connection, begin_sql='BEGIN IMMEDIATE', window_ms=window_ms), rows
+
+
+def insert(cursor, text):
+    cursor.execute('INSERT INTO notes (text) VALUES (?)', (text,))
+    return cursor.lastrowid
+
+
+def test_failing_job_rolls_back_only_itself():
+    writer, rows = make_writer()
+    futures = [writer.submit(insert, text) for text in ('a', 'b', 'a', 'c')]  # One batch (200 ms window)
+    assert futures[0].result() and futures[1].result() and futures[3].result()
+    with pytest.raises(sqlite3.IntegrityError):
+        futures[2].result()
+    assert rows() == ['a', 'b', 'c']
+    stats = writer.stats()
+    assert stats['batches'] == 1 and stats['jobs'] == 4 and stats['failed'] == 1
+
+
+def test_failed_commit_rolls_back_the_whole_batch():
+    writer, rows = make_writer(fail_commit=True)
+    futures = [writer.submit(insert, text) for text in ('a', 'b')]
+    for future in futures:
+        with pytest.raises(sqlite3.OperationalError):
+            future.result(timeout=10)
+    assert rows() == []
+    assert writer.stats()['commit_failures'] == 1
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs fork')
+def test_forked_child_starts_its_own_writer():
+    writer, rows = make_writer(window_ms=0)
+    writer.run(insert, 'parent')
+    pid = os.fork()
+    if pid == 0:
+        try:
+            writer.submit(insert, 'child').result(timeout=10)  # The parent's writer thread is not here
+            os._exit(0)
+        except BaseException:
+            os._exit(1)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert rows() == ['parent', 'child']
+
+
+def test_database_writes_go_through_the_writer():
+    db = ChatAppDatabase(os.path.join(tempfile.mkdtemp(), 'writer_db_test.db'))
+    if db.writer is None:
+        pytest.skip('SQLITE_WRITER is off')
+
+    def jobs():
+        return db.writer.stats()['jobs']
+
+    before = jobs()
+    user_id = db.create_user('writer_user', 'writer@example.com', 'password123')
+    admin_id = db.create_user('writer_admin', 'writer_admin@example.com', 'password123', role='administrator')
+    message_id = db.send_message(user_id, 'user', 'hello')
+    assert db.delete_message(message_id, admin_id, 'administrator') == user_id
+    call_id = db.log_call_attempt(user_id, admin_id)
+    db.update_call_status(call_id, 'missed')
+    db.mark_missed_call_seen(call_id)
+    assert db.update_user_role(user_id, 'user')
+    assert db.soft_delete_user(user_id)
+    assert db.restore_user(user_id)
+    assert db.purge_archive('2000-01-01 00:00:00') == 0
+    assert jobs() - before == 11
+    assert db.get_missed_calls(admin_id)[0]['seen']
+
+
+if __name__ == '__main__':
+    test_failing_job_rolls_back_only_itself()
+    test_failed_commit_rolls_back_the_whole_batch()
+    test_forked_child_starts_its_own_writer()
+    test_database_writes_go_through_the_writer()
+    print("✅ Writer tests passed")